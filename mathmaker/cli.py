@@ -27,6 +27,7 @@ import errno
 import argparse
 import locale
 from pathlib import Path
+from functools import partial
 from json.decoder import JSONDecodeError
 
 import mathmakerlib.config
@@ -35,8 +36,9 @@ from mathmaker import __info__, __software_name__
 from mathmaker import settings
 from mathmaker.lib import shared
 from mathmaker.lib import old_style_sheet
-from mathmaker.lib.document.frames import Sheet
-from mathmaker.lib.tools import load_config
+from mathmaker.lib.document.frames import Sheet, Copies
+from mathmaker.lib.tools import load_config, feasibility
+from mathmaker.lib.tools.pdf_cache import seeded_key
 from mathmaker.lib.tools.ignition \
     import (check_dependencies, install_gettext_translations,
             check_settings_consistency)
@@ -50,11 +52,6 @@ def entry_point():
     XML_SHEETS = get_xml_sheets_paths()
     YAML_SHEETS = read_index()
     log = settings.mainlogger
-    check_dependencies(euktoeps=settings.euktoeps,
-                       xmllint=settings.xmllint,
-                       lualatex=settings.lualatex,
-                       luaotfload_tool=settings
-                       .luaotfload_tool)
     parser = argparse.ArgumentParser(description='Creates maths exercices '
                                                  'sheets and their solutions.')
     parser.add_argument('-l', '--language', action='store', dest='lang',
@@ -75,6 +72,21 @@ def entry_point():
     parser.add_argument('--pdf', action='store_true', dest='pdf_output',
                         help='the output will be in pdf format instead '
                              'of LaTeX')
+    parser.add_argument('--pdf-cache', action='store_true',
+                        dest='pdf_cache', default=settings.pdf_cache,
+                        help='with --pdf, reuse the pdf documents previously '
+                             'compiled from the exact same LaTeX source, and '
+                             'store the new ones. This will override any '
+                             'value you may have set in '
+                             '~/.config/mathmaker/user_config.yaml')
+    parser.add_argument('--preamble-format', action='store_true',
+                        dest='preamble_format',
+                        default=settings.preamble_format,
+                        help='with --pdf, compile the document against a '
+                             'precompiled LuaLaTeX format of its preamble '
+                             '(built at first use). This will override any '
+                             'value you may have set in '
+                             '~/.config/mathmaker/user_config.yaml')
     parser.add_argument('-d', '--output-directory', action='store',
                         dest='outputdir',
                         default=settings.outputdir,
@@ -90,6 +102,24 @@ def entry_point():
                              'calculation tabular will be created twice, with '
                              'questions shifted by a random offset the second '
                              'time. ')
+    parser.add_argument('--copies', action='store', type=int,
+                        dest='copies', default=1,
+                        help='the number of different copies of the sheet '
+                             'to create, one after the other in the same '
+                             'document (e.g. one copy per pupil). This '
+                             'cannot be used together with --interactive '
+                             'nor --cotinga-template.')
+    parser.add_argument('--seed', action='store', type=int,
+                        dest='seed', default=None,
+                        help='generate the sheet from this seed: the same '
+                             'sheet, generated with the same seed, options '
+                             'and configuration, will be the same document. '
+                             'The numbers drawn before do not matter, nor do '
+                             'the ones drawn from the seed matter to the '
+                             'next sheets. With --pdf and --pdf-cache, the '
+                             'pdf document is stored, and reused next time '
+                             'the same sheet is generated with the same seed '
+                             'and options.')
     parser.add_argument('--interactive', action='store_true',
                         dest='enable_js_form',
                         help='When this option is enabled, the mental '
@@ -112,23 +142,68 @@ def entry_point():
                              'able to compile the document. '
                              'This will override any value you may have set '
                              'in ~/.config/mathmaker/user_config.yaml')
+    parser.add_argument('--profile-draws', action='store',
+                        dest='profile_draws',
+                        default=settings.profile_draws,
+                        help='time the draws from the databases, and write '
+                             'a report to the provided file at the end (as '
+                             'json if its name ends with .json, as text '
+                             'otherwise). This will override any value you '
+                             'may have set in '
+                             '~/.config/mathmaker/user_config.yaml')
+    parser.add_argument('--render-processes', action='store', type=int,
+                        dest='render_processes',
+                        default=settings.render_processes,
+                        help='the number of processes building the questions '
+                             'of each exercise, once its numbers have been '
+                             'drawn. This will override any value you may '
+                             'have set in '
+                             '~/.config/mathmaker/user_config.yaml')
+    parser.add_argument('-j', '--jobs', action='store', type=int,
+                        dest='jobs', default=None,
+                        help='with check-feasibility, the number of sheets '
+                             'checked in parallel (default: the number of '
+                             'CPUs).')
     parser.add_argument('main_directive', metavar='[DIRECTIVE|FILE]',
                         help='this can either match a sheetname included in '
                              'mathmaker, or a mathmaker xml file, or it may '
                              'be the special directives "list", that will '
                              'print the complete list and exit; "config" '
                              'that will show current mathmaker configuration '
-                             'values; or "belts" that will show currently '
-                             'loaded belts scale.')
+                             'values; "belts" that will show currently '
+                             'loaded belts scale; or "check-feasibility" that '
+                             'will count, without generating any sheet, the '
+                             'numbers each source of each YAML sheet may '
+                             'provide, and report the sources that may run '
+                             'out.')
+    parser.add_argument('--recheck-deps', action='store_true',
+                        dest='recheck_deps',
+                        help='check again the versions of mathmaker\'s '
+                             'dependencies (lualatex etc.), instead of '
+                             'reusing the ones found previously.')
     parser.add_argument('--version', '-v',
                         action='version',
                         version=__info__)
     args = parser.parse_args()
+    if args.copies < 1:
+        parser.error('--copies must be at least 1')
+    if args.copies > 1 and (args.enable_js_form or args.cot):
+        parser.error('--copies cannot be used together with --interactive '
+                     'nor --cotinga-template')
+    check_dependencies(euktoeps=settings.euktoeps,
+                       xmllint=settings.xmllint,
+                       lualatex=settings.lualatex,
+                       luaotfload_tool=settings.luaotfload_tool,
+                       recheck=args.recheck_deps)
     install_gettext_translations(language=args.lang)
     # From now on, settings.language has its definitive value
     settings.outputdir = args.outputdir
     settings.font = args.font
     settings.encoding = args.encoding
+    settings.pdf_cache = args.pdf_cache
+    settings.preamble_format = args.preamble_format
+    settings.profile_draws = args.profile_draws
+    settings.render_processes = args.render_processes
     settings.locale = settings.language + '.' + settings.encoding \
         if not sys.platform.startswith('win') \
         else settings.language
@@ -148,80 +223,82 @@ def entry_point():
         else:
             raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT),
                                     args.belts)
+    if args.seed is not None:
+        shared.use_seed(args.seed)
 
-    if args.main_directive == 'list':
-        sys.stdout.write(list_all_sheets())
-        shared.db.close()
-        shared.natural_nb_tuples_db.close()
-        shared.solids_db.close()
-        shared.shapes_db.close()
-        shared.anglessets_db.close()
-        sys.exit(0)
-    elif args.main_directive in ('config', 'belts'):
-        if args.main_directive == 'config':
-            print(json.dumps(load_config('user_config', settings.settingsdir),
-                             indent=2))
-        else:
-            print(json.dumps(settings.mc_belts,
-                             indent=2))
-        shared.db.close()
-        shared.natural_nb_tuples_db.close()
-        shared.solids_db.close()
-        shared.shapes_db.close()
-        shared.anglessets_db.close()
-        sys.exit(0)
-    elif args.main_directive in old_style_sheet.AVAILABLE:
-        sh = old_style_sheet.AVAILABLE[args.main_directive][0]()
-    else:
-        build_from_yaml = False
-        if args.main_directive in XML_SHEETS:
-            fn = XML_SHEETS[args.main_directive]
-        elif os.path.isfile(args.main_directive):
-            fn = args.main_directive
-        elif args.main_directive in YAML_SHEETS:
-            fn = YAML_SHEETS[args.main_directive]
-            build_from_yaml = True
-        else:
-            log.error(args.main_directive
-                      + " is not a correct directive for " + __software_name__
-                      + ", you can run `mathmaker list` to get the complete "
-                      "list of directives.")
-            # print("--- {sec} seconds ---"\
-            #      .format(sec=round(time.time() - start_time, 3)))
-            shared.db.close()
-            shared.natural_nb_tuples_db.close()
-            shared.solids_db.close()
-            shared.shapes_db.close()
-            shared.anglessets_db.close()
-            sys.exit(1)
-        if build_from_yaml:
-            sh = Sheet(*fn, filename=None, shift=args.shift,
-                       enable_js_form=args.enable_js_form, cot=args.cot)
-        else:
-            sh = Sheet('', '', '', filename=fn)
+    # Only the documents of the sheets known by their names are stored under
+    # their seeds: the content of a file may change
+    known_sheet = True
 
-    try:
-        shared.machine.write_out(str(sh), pdf_output=args.pdf_output)
-    except Exception:
-        log.error("An exception occured during the creation of the sheet.",
-                  exc_info=True)
-        shared.natural_nb_tuples_db.close()
-        shared.solids_db.close()
-        shared.shapes_db.close()
-        shared.anglessets_db.close()
-        shared.db.close()
-        sys.exit(1)
+    # The databases are committed and closed at the end of the block, or
+    # only closed if it is left because of an error or sys.exit()
+    with shared.connected():
+        if args.main_directive == 'list':
+            sys.stdout.write(list_all_sheets())
+            sys.exit(0)
+        elif args.main_directive in ('config', 'belts'):
+            if args.main_directive == 'config':
+                print(json.dumps(load_config('user_config',
+                                             settings.settingsdir),
+                                 indent=2))
+            else:
+                print(json.dumps(settings.mc_belts,
+                                 indent=2))
+            sys.exit(0)
+        elif args.main_directive == 'check-feasibility':
+            rows = feasibility.check_sheets(list(YAML_SHEETS),
+                                            processes=args.jobs)
+            sys.stdout.write(feasibility.report(rows))
+            sys.exit(1 if any(feasibility.failed(row) for row in rows)
+                     else 0)
+        elif args.main_directive in old_style_sheet.AVAILABLE:
+            build_sheet = old_style_sheet.AVAILABLE[args.main_directive][0]
+        else:
+            build_from_yaml = False
+            if args.main_directive in XML_SHEETS:
+                fn = XML_SHEETS[args.main_directive]
+            elif os.path.isfile(args.main_directive):
+                fn = args.main_directive
+                known_sheet = False
+            elif args.main_directive in YAML_SHEETS:
+                fn = YAML_SHEETS[args.main_directive]
+                build_from_yaml = True
+            else:
+                log.error(args.main_directive
+                          + " is not a correct directive for "
+                          + __software_name__
+                          + ", you can run `mathmaker list` to get the "
+                          "complete list of directives.")
+                # print("--- {sec} seconds ---"\
+                #      .format(sec=round(time.time() - start_time, 3)))
+                sys.exit(1)
+            if build_from_yaml:
+                build_sheet = partial(Sheet, *fn, filename=None,
+                                      shift=args.shift,
+                                      enable_js_form=args.enable_js_form,
+                                      cot=args.cot)
+            else:
+                build_sheet = partial(Sheet, '', '', '', filename=fn)
+        key = None
+        if (args.seed is not None and args.pdf_output and known_sheet
+            and not args.cot):
+            key = seeded_key(args.main_directive, args.seed,
+                             shift=args.shift,
+                             enable_js_form=args.enable_js_form,
+                             copies=args.copies)
+            if shared.machine.write_seeded(key):
+                log.info("Done (from the pdf cache).")
+                sys.exit(0)
+        sh = build_sheet() if args.copies == 1 \
+            else Copies(build_sheet, args.copies)
 
-    shared.db.commit()
-    shared.db.close()
-    shared.natural_nb_tuples_db.commit()
-    shared.natural_nb_tuples_db.close()
-    shared.solids_db.commit()
-    shared.solids_db.close()
-    shared.shapes_db.commit()
-    shared.shapes_db.close()
-    shared.anglessets_db.commit()
-    shared.anglessets_db.close()
+        try:
+            shared.machine.write_out(str(sh), pdf_output=args.pdf_output,
+                                     seeded_key=key)
+        except Exception:
+            log.error("An exception occured during the creation of the "
+                      "sheet.", exc_info=True)
+            sys.exit(1)
     log.info("Done.")
     sys.exit(0)
 
@@ -41,7 +41,8 @@ TIME_CONTEXT = {'sep': 'as_si_units', 'si_show_0h': False,
 
 def check_options_consistency(category, level, direction):
     possible_triplets = []
-    for option in OPTIONS_VALUES:
+    # sorted: the order of a set of strings changes with the hash seed
+    for option in sorted(OPTIONS_VALUES):
         if ((category is None or category == option[0])
             and (level is None or level == option[1])
             and (direction is None or direction == option[2])):
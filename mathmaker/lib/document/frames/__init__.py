@@ -23,7 +23,8 @@
 from .question import Question
 from .exercise import Exercise, get_nb_sources_from_question_info
 from .sheet import Sheet
+from .copies import Copies
 
 
-__all__ = ['Sheet', 'Exercise', 'Question',
+__all__ = ['Sheet', 'Copies', 'Exercise', 'Question',
            'get_nb_sources_from_question_info']
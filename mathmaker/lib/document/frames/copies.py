@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+
+# Mathmaker creates automatically maths exercises sheets
+# with their answers
+# Copyright 2006-2017 Nicolas Hainaux <nh.techn@gmail.com>
+
+# This file is part of Mathmaker.
+
+# Mathmaker is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# any later version.
+
+# Mathmaker is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Mathmaker; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+from mathmaker.lib import shared
+
+
+class Copies(object):
+    """
+    Several copies of the same sheet, written as one document.
+
+    Each copy is a sheet of its own, built after the previous ones, so that
+    its numbers are drawn among the ones the previous copies did not draw
+    (as far as the sources allow it). The copies share the preamble and are
+    written one after the other, each one with its exercises and their
+    answers, starting on a new page (or a new frame, for slideshows).
+    """
+
+    def __init__(self, build_sheet, n):
+        """
+        Build the n copies.
+
+        :param build_sheet: the function creating one copy of the sheet
+        :type build_sheet: callable
+        :param n: the number of copies
+        :type n: int
+        """
+        if n < 1:
+            raise ValueError(f'At least one copy is required, got {n}.')
+        self.sheets = [build_sheet()]
+        if shared.enable_js_form and n > 1:
+            raise ValueError('The interactive sheets cannot be copied: their '
+                             'fields\' names would collide.')
+        self.sheets += [build_sheet() for _ in range(n - 1)]
+        self.layout_type = self.sheets[0].layout_type
+
+    def __str__(self):
+        M = shared.machine
+        result = M.write_document_begins(variant=self.layout_type)
+        for i, sh in enumerate(self.sheets):
+            if i and self.layout_type != 'slideshow':
+                result += M.write_jump_to_next_page()
+            result += sh.body_to_str()
+        result += M.write_document_ends()
+
+        return self.sheets[0].preamble_to_str(result) + result
@@ -23,7 +23,7 @@
 import copy
 import random
 import warnings
-from collections import namedtuple
+from collections import namedtuple, Counter
 from string import ascii_lowercase as alphabet
 
 from intspan import intspan
@@ -34,10 +34,10 @@ from mathmakerlib.calculus import is_integer, Number
 from mathmaker.lib import shared
 from mathmaker import settings
 from mathmaker.lib.constants.latex import COLORED_QUESTION_MARK, COLORED_ANSWER
+from mathmaker.lib.tools import render_pool
 from mathmaker.lib.tools.maths import coprimes_to
 from mathmaker.lib.tools.frameworks import read_layout, build_questions_list
 from mathmaker.lib.tools.frameworks import get_q_modifier, parse_qid
-from .question import Question
 from mathmaker.lib.constants import BOOLEAN, SLIDE_CONTENT_SEP
 from mathmaker.lib.constants.content \
     import SUBKINDS_TO_UNPACK, UNPACKABLE_SUBKINDS, SOURCES_TO_UNPACK
@@ -135,7 +135,7 @@ def build_q_dict(q_list):
                     to_unpack[q_subkind] = copy.deepcopy(
                         SUBKINDS_TO_UNPACK[q_subkind])
                     subk_left = to_unpack[q_subkind] - already_unpacked
-                s = list(subk_left)
+                s = sorted(subk_left)
                 random.shuffle(s)
                 q_subkind = s.pop()
                 already_unpacked |= {q_subkind}
@@ -222,6 +222,47 @@ def preprocess_qoptions(q_i):
         # will be handled in database.py (preprocess_pythagorean_query)
 
 
+def prefetch_key(q_i):
+    """
+    Identify the questions whose numbers may be drawn all at once.
+
+    These questions have the same id, the same options and one numbers'
+    source, that must not be chosen at random (like SOURCES_TO_UNPACK) nor
+    forced to a table. Return None if the question is not one of them.
+
+    :param q_i: the Q_info object, whose fields are
+                'id,kind,subkind,nb_source,options,order'
+    :type q_i: Q_info (named tuple)
+    """
+    if (len(q_i.nb_source) != 1
+        or q_i.nb_source[0] in SOURCES_TO_UNPACK
+        or q_i.id in ['order_of_operations', 'pythagorean_theorem']
+        or q_i.options.get('force_table', None) is not None):
+        return None
+    return (q_i.id, q_i.nb_source[0], repr(sorted(q_i.options.items())))
+
+
+def pop_prefetched(prefetched, nb_source, not_in=None, **kwargs):
+    """
+    Remove and return the first of the prefetched numbers not in not_in.
+
+    The numbers are checked against not_in the way the database query would
+    check them (see mc_source.excludes()). Return None if there is none.
+
+    :param prefetched: the numbers drawn in advance
+    :type prefetched: list
+    :param nb_source: the numbers' source they have been drawn from
+    :type nb_source: str
+    :param not_in: the numbers that must not be reused (as str), or None
+    :type not_in: None or list
+    """
+    for i, drawn in enumerate(prefetched):
+        if not shared.mc_source.excludes(drawn, nb_source, not_in=not_in,
+                                         **kwargs):
+            return prefetched.pop(i)
+    return None
+
+
 def auto_adjust_nb_sources(nb_sources: list, q_i: namedtuple):
     """
     Automatically adjust nb_sources for certains questions.
@@ -341,7 +382,7 @@ def get_nb_sources_from_question_info(q_i):
                 s = stu[nb_source][q_i.id]
             else:
                 s = stu[nb_source][q_i.subkind]
-            s = list(s)
+            s = sorted(s)
             random.shuffle(s)
             nb_source = s.pop()
             if (tag_to_unpack == 'auto_vocabulary'
@@ -571,12 +612,36 @@ class Exercise(object):
         #  etc.
         # ]
 
-        # Now, we generate the numbers & questions, by type of question first
-        self._questions_list = []
+        # First, all the numbers are drawn, then the questions are built
+        # (possibly in parallel, see render_pool.py)
+        self._questions_list = render_pool.render(
+            self._draw_numbers(mixed_q_list),
+            processes=settings.render_processes)
+        shared.number_of_the_question = 0
+
+    def _draw_numbers(self, mixed_q_list):
+        """
+        Draw the numbers of all the questions of mixed_q_list.
+
+        They are drawn in the questions' order, as each draw may depend on
+        the previous ones (last_draw, not_in). Nothing is rendered: return
+        the arguments to build each Question with, as (q_kind, options).
+
+        :param mixed_q_list: the questions (see build_mixed_q_list())
+        :type mixed_q_list: list of Q_info
+        :rtype: list
+        """
+        drafts = []
         last_draw = {}
+        # The numbers of the questions sharing the same source and options
+        # are drawn at once, when the first of them is met
+        prefetch_keys = [prefetch_key(q) for q in mixed_q_list]
+        prefetch_sizes = Counter(prefetch_keys)
+        prefetched = {}
+        prefetch_kw = {}
         numbering = numbering_device(self.q_numbering)
         log = settings.dbg_logger.getChild('Exercise.init')
-        for q in mixed_q_list:
+        for q, q_key in zip(mixed_q_list, prefetch_keys):
             q_number = next(numbering)
             log.debug('QUESTION # {} -------------------------------- {} ---'
                       '-----------------------------'.format(q_number, q.id))
@@ -664,24 +729,45 @@ class Exercise(object):
                     if q.options.get('force_table', None) is not None:
                         not_in = None
                         either = [q.options.get('force_table')]
-                    try:
-                        drawn = shared.mc_source.next(
-                            nb_source, q_id=q.id, not_in=not_in,
-                            either_nb1_nb2_in=either, qkw=q.options,
-                            **get_q_modifier(q.id, nb_source), **xkw)
-                    except RuntimeError as excinfo:
-                        if ((str(excinfo).startswith('The conditions to draw a'
-                             ' random int tuple lead to no result.')
-                             and nb_source.startswith('nn'))
-                            or (str(excinfo).startswith('No result from '
-                                'database query.'))):
-                            not_in = None
+                    drawn = None
+                    if (q_key is not None and prefetch_sizes[q_key] > 1
+                        and len(nbsources_xkw_list) == 1
+                        and not extra_infos['merge_sources']
+                        and shared.mc_source.batchable(nb_source)):
+                        if q_key not in prefetched:
+                            prefetch_kw[q_key] = dict(
+                                q_id=q.id, qkw=dict(q.options),
+                                **get_q_modifier(q.id, nb_source), **xkw)
+                            try:
+                                prefetched[q_key] = shared.mc_source\
+                                    .next_many(prefetch_sizes[q_key],
+                                               nb_source,
+                                               **prefetch_kw[q_key])
+                            except RuntimeError:
+                                prefetched[q_key] = []
+                        drawn = pop_prefetched(prefetched[q_key], nb_source,
+                                               not_in=not_in,
+                                               **prefetch_kw[q_key])
+                    if drawn is None:
+                        try:
                             drawn = shared.mc_source.next(
                                 nb_source, q_id=q.id, not_in=not_in,
                                 either_nb1_nb2_in=either, qkw=q.options,
                                 **get_q_modifier(q.id, nb_source), **xkw)
-                        else:
-                            raise
+                        except RuntimeError as excinfo:
+                            if ((str(excinfo).startswith(
+                                 'The conditions to draw a random int tuple '
+                                 'lead to no result.')
+                                 and nb_source.startswith('nn'))
+                                or (str(excinfo).startswith(
+                                    'No result from database query.'))):
+                                not_in = None
+                                drawn = shared.mc_source.next(
+                                    nb_source, q_id=q.id, not_in=not_in,
+                                    either_nb1_nb2_in=either, qkw=q.options,
+                                    **get_q_modifier(q.id, nb_source), **xkw)
+                            else:
+                                raise
                     nb_to_use += drawn
 
                 known_elts = set()
@@ -701,11 +787,16 @@ class Exercise(object):
             q.options.update({'details_level': self.details_level,
                               'preset': self.preset,
                               'x_layout_variant': self.layout_variant})
-            self._questions_list += \
-                [Question(q.id, **q.options, nb_source=nb_source,
-                          build_data=nb_to_use,
-                          number_of_the_question=q_number, )]
-        shared.number_of_the_question = 0
+            drafts.append((q.id, dict(q.options, nb_source=nb_source,
+                                      build_data=nb_to_use,
+                                      number_of_the_question=q_number)))
+        # The numbers drawn in advance but not used may be drawn again
+        for q_key, unused in prefetched.items():
+            for drawn in unused:
+                shared.mc_source.release(drawn, q_key[1],
+                                         **prefetch_kw[q_key])
+        return drafts
+
 
     @property
     def questions_list(self):
@@ -22,9 +22,7 @@
 
 from mathmaker import settings
 from mathmaker.lib import shared
-from mathmaker.lib.document.content import algebra, calculation, geometry
-
-ALL_MODULES = (algebra, calculation, geometry)
+from mathmaker.lib.document.content import get_question_module
 
 
 # ------------------------------------------------------------------------------
@@ -71,15 +69,7 @@ class Question(object):
                           'vocabulary_quadruple']:
             mod_name = 'vocabulary_simple_multiple_of_a_number'
 
-        for m in ALL_MODULES:
-            if hasattr(m, mod_name):
-                module = getattr(m, mod_name)
-                break
-        else:
-            raise AttributeError(mod_name + ' not found in ALL_MODULES: '
-                                 + ', '.join([m.__name__
-                                             for m in ALL_MODULES]))
-        m = module.sub_object(**options)
+        m = get_question_module(mod_name).sub_object(**options)
 
         default_q_sp = '30.0pt'
         if self.x_layout_variant == 'evenly_hspaced':
@@ -295,6 +295,38 @@ class Sheet(object):
     #   @brief Writes the whole sheet's content to the output.
     def __str__(self):
         result = shared.machine.write_document_begins(variant=self.layout_type)
+        result += self.body_to_str()
+        result += shared.machine.write_document_ends()
+
+        preamble = self.preamble_to_str(result)
+
+        if self.cot:
+            required.package['fancyvrb'] = True
+            # title = shared.machine.write(self.title, emphasize='bold')
+            template = Path(__file__).parent / 'templates/cotinga_template.tex'
+            template = template.read_text()
+            template = template.replace('PREAMBLE', preamble)
+            # template = template.replace('TITLE', title)
+            if self.shift:
+                for i in [0, 1]:
+                    output = Path(f'{self.cot}{i}.tex')
+                    content = self.exercises_list[i].to_str('exc')
+                    output.write_text(template.replace('CONTENT', content))
+            else:
+                output = Path(f'{self.cot}.tex')
+                content = self.exercises_list[0].to_str('exc')
+                output.write_text(template.replace('CONTENT', content))
+
+        return preamble + result
+
+    def body_to_str(self):
+        """
+        Return the content of the sheet, between the beginning and the end of
+        the document.
+
+        :rtype: str
+        """
+        result = ''
 
         if self.layout_type in ['default', 'equations', 'slideshow']:
             result += self.sheet_header_to_str()
@@ -347,36 +379,25 @@ class Sheet(object):
             result += self.answers_title_to_str()
             result += self.texts_to_str('ans', len(self.exercises_list) // 2)
 
-        result += shared.machine.write_document_ends()
+        return result
 
+    def preamble_to_str(self, document):
+        """
+        Return the preamble matching the content of the document.
+
+        :param document: the content of the document
+        :type document: str
+        :rtype: str
+        """
         pkg = []
-        if any([s in result for s in KNOWN_AMSSYMB_SYMBOLS]):
+        if any([s in document for s in KNOWN_AMSSYMB_SYMBOLS]):
             pkg.append('amssymb')
-        if any([s in result for s in KNOWN_AMSMATH_SYMBOLS]):
+        if any([s in document for s in KNOWN_AMSMATH_SYMBOLS]):
             pkg.append('amsmath')
-        if any([s in result for s in KNOWN_TEXTCOMP_SYMBOLS]):
+        if any([s in document for s in KNOWN_TEXTCOMP_SYMBOLS]):
             pkg.append('textcomp')
-        preamble = shared.machine.write_preamble(variant=self.layout_type,
-                                                 required_pkg=pkg)
-
-        if self.cot:
-            required.package['fancyvrb'] = True
-            # title = shared.machine.write(self.title, emphasize='bold')
-            template = Path(__file__).parent / 'templates/cotinga_template.tex'
-            template = template.read_text()
-            template = template.replace('PREAMBLE', preamble)
-            # template = template.replace('TITLE', title)
-            if self.shift:
-                for i in [0, 1]:
-                    output = Path(f'{self.cot}{i}.tex')
-                    content = self.exercises_list[i].to_str('exc')
-                    output.write_text(template.replace('CONTENT', content))
-            else:
-                output = Path(f'{self.cot}.tex')
-                content = self.exercises_list[0].to_str('exc')
-                output.write_text(template.replace('CONTENT', content))
-
-        return preamble + result
+        return shared.machine.write_preamble(variant=self.layout_type,
+                                             required_pkg=pkg)
 
     # --------------------------------------------------------------------------
     ##
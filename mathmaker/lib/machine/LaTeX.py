@@ -39,6 +39,9 @@ from mathmaker import settings
 from mathmaker.lib.constants import latex, SLIDE_CONTENT_SEP
 from mathmaker.lib.constants.latex import TEXT_SCALES, TEXT_RANKS
 from mathmaker.lib.tools import generate_preamble_comment
+from mathmaker.lib.tools.pdf_cache import PdfCache
+from mathmaker.lib.tools.preamble_format import PreambleFormats
+from mathmaker.lib.tools.preamble_format import split_preamble
 from mathmaker.lib.core.base import Printable, Drawable
 from . import Structure
 
@@ -88,7 +91,7 @@ class LaTeX(Structure.Structure):
         xcolor = ''
         xcolor_attr = []
         if required.package.get('xcolor', False):
-            xcolor_attr = [o for o in required.options['xcolor']]
+            xcolor_attr = sorted(required.options['xcolor'])
             if variant != 'slideshow':
                 xcolor = '% {}\n{}\n\n'.format(
                     _('To be able to color the documents'),
@@ -299,7 +302,7 @@ class LaTeX(Structure.Structure):
         # textpos
         textpos = ''
         if required.package.get('textpos', False):
-            textpos_options = [o for o in required.options['textpos']]
+            textpos_options = sorted(required.options['textpos'])
             textpos = '\n' + '% {}\n{}\n\n'\
                 .format(_('Absolute positioning of text on the page'),
                         str(UsePackage('textpos',
@@ -565,54 +568,137 @@ r"""{textcomp}{array}{cellspace}{graphicx}{epstopdf}{textpos}{specificpackages}
         else:
             self.out.write(output_str)
 
-    def write_out(self, latex_document: str, pdf_output=False):
+    def compile(self, latex_document: str, formats=None):
+        """
+        Compile the given document with lualatex and return the pdf content.
+
+        :param latex_document: contains the entire LaTeX document
+        :param formats: if provided, the document is compiled against the
+        precompiled format of its preamble, if it can be built (if the
+        document compiles without it only, the format is built again next
+        time)
+        :type formats: PreambleFormats
+        :rtype: bytes
+        """
+        fmt = None
+        if formats is not None:
+            fmt = formats.get(split_preamble(latex_document)[0])
+        if fmt is not None:
+            try:
+                return self._compile(latex_document, fmt=fmt,
+                                     env=formats.env)
+            except RuntimeError:
+                settings.mainlogger.warning(f'Compilation failed using the '
+                                            f'format {fmt}; trying without '
+                                            f'it')
+            document = self._compile(latex_document)
+            # Only the format failed: it will be built again next time
+            formats.discard(fmt)
+            return document
+        return self._compile(latex_document)
+
+    def _compile(self, latex_document: str, fmt=None, env=None):
+        fmt_option = [f'-fmt={fmt}'] if fmt is not None else []
+        with NamedTemporaryFile(mode='r+t') as tmp_file:
+            tmp_filename = os.path.basename(tmp_file.name)
+            tmp_file.write(latex_document)
+            tmp_file.seek(0)
+            p = subprocess.Popen([settings.lualatex,
+                                  *fmt_option,
+                                  '-interaction',
+                                  'nonstopmode',
+                                  tmp_file.name],
+                                 cwd=settings.outputdir,
+                                 env=env,
+                                 stdout=sys.stderr)
+            errorcode = p.wait()
+            if errorcode:
+                saved_log_name = os.path.join(
+                    settings.outputdir,
+                    'lualatex_' + time.strftime("%Y%m%d-%H%M%S") + '.log')
+                tmp_log_name = os.path.join(settings.outputdir,
+                                            tmp_filename + '.log')
+                with open(tmp_log_name, mode='rt') as tmplog,\
+                    open(saved_log_name, mode='wt') as savedlog:  # noqa
+                    savedlog.write(tmplog.read())
+                saved_tex_name = os.path.join(
+                    settings.outputdir,
+                    'lualatex_' + time.strftime("%Y%m%d-%H%M%S") + '.tex')
+                with open(saved_tex_name, mode='wt') as savedtex:
+                    savedtex.write(latex_document)
+                raise RuntimeError('lualatex had a problem while '
+                                   'compiling. See {} and {}.'
+                                   .format(saved_tex_name, saved_log_name))
+            pdf_filename = os.path.join(settings.outputdir,
+                                        tmp_filename + '.pdf')
+            with open(pdf_filename, mode='rb') as pdf_file:
+                document = pdf_file.read()
+            for f in glob.glob(os.path.join(settings.outputdir,
+                                            tmp_filename + '.*')):
+                os.remove(f)
+        return document
+
+    def pdf_cache(self):
+        """The cache of the compiled pdf documents, or None if disabled."""
+        if not settings.pdf_cache:
+            return None
+        return PdfCache(settings.pdf_cachedir,
+                        max_size=settings.pdf_cache_max_size,
+                        luatex_version=settings.luatex_version,
+                        font=settings.font)
+
+    def write_seeded(self, key):
+        """
+        Writes the pdf document stored in the cache under key, if any.
+
+        :param key: the key of a seeded document (see seeded_key())
+        :type key: str
+        :rtype: bool (whether the document has been found)
+        """
+        cache = self.pdf_cache()
+        document = None if cache is None else cache.get(key)
+        if document is None:
+            return False
+        self.out = sys.stdout.buffer
+        self.out.write(document)
+        return True
+
+    def write_out(self, latex_document: str, pdf_output=False,
+                  seeded_key=None):
         """
         Writes the given document to the output.
 
         If pdf_output is set to True then the document will be compiled into
-        a pdf and the pdf content will be written to output.
+        a pdf and the pdf content will be written to output. If the pdf cache
+        is enabled, a document compiled earlier from the exact same source
+        is reused instead of running lualatex again, and the document is
+        stored under seeded_key too, if any (see write_seeded()). If the
+        preamble formats are enabled, the document is compiled against the
+        precompiled format of its preamble.
 
         :param latex_document: contains the entire LaTeX document
         :param pdf_output: if True, output will be written in pdf format
+        :param seeded_key: the key of the document, if generated with a seed
+        (see seeded_key())
         """
         document = latex_document
         if pdf_output:
-            with NamedTemporaryFile(mode='r+t') as tmp_file:
-                tmp_filename = os.path.basename(tmp_file.name)
-                tmp_file.write(latex_document)
-                tmp_file.seek(0)
-                p = subprocess.Popen(['lualatex',
-                                      '-interaction',
-                                      'nonstopmode',
-                                      tmp_file.name],
-                                     cwd=settings.outputdir,
-                                     stdout=sys.stderr)
-                errorcode = p.wait()
-                if errorcode:
-                    saved_log_name = os.path.join(
-                        settings.outputdir,
-                        'lualatex_' + time.strftime("%Y%m%d-%H%M%S") + '.log')
-                    tmp_log_name = os.path.join(settings.outputdir,
-                                                tmp_filename + '.log')
-                    with open(tmp_log_name, mode='rt') as tmplog,\
-                        open(saved_log_name, mode='wt') as savedlog:  # noqa
-                        savedlog.write(tmplog.read())
-                    saved_tex_name = os.path.join(
-                        settings.outputdir,
-                        'lualatex_' + time.strftime("%Y%m%d-%H%M%S") + '.tex')
-                    with open(saved_tex_name, mode='wt') as savedtex:
-                        savedtex.write(document)
-                    raise RuntimeError('lualatex had a problem while '
-                                       'compiling. See {} and {}.'
-                                       .format(saved_tex_name, saved_log_name))
-                pdf_filename = os.path.join(settings.outputdir,
-                                            tmp_filename + '.pdf')
-                with open(pdf_filename, mode='rb') as pdf_file:
-                    document = pdf_file.read()
-                self.out = sys.stdout.buffer
-                for f in glob.glob(os.path.join(settings.outputdir,
-                                                tmp_filename + '.*')):
-                    os.remove(f)
+            document = None
+            cache = self.pdf_cache()
+            if cache is not None:
+                document = cache.get(latex_document)
+            if document is None:
+                formats = None
+                if settings.preamble_format:
+                    formats = PreambleFormats(
+                        settings.formatsdir, lualatex=settings.lualatex,
+                        luatex_version=settings.luatex_version)
+                document = self.compile(latex_document, formats=formats)
+                if cache is not None:
+                    cache.put(latex_document, document)
+            if cache is not None and seeded_key is not None:
+                cache.put(seeded_key, document)
+            self.out = sys.stdout.buffer
         else:
             self.out = sys.stdout
         self.out.write(document)
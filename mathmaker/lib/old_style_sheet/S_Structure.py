@@ -148,9 +148,21 @@ class S_Structure(object, metaclass=ABCMeta):
     ##
     #   @brief Writes the whole sheet's content to the output.
     def __str__(self):
+        result = shared.machine.write_document_begins()
+        result += self.body_to_str()
+        result += shared.machine.write_document_ends()
+
+        return self.preamble_to_str(result) + result
+
+    def body_to_str(self):
+        """
+        Return the content of the sheet, between the beginning and the end of
+        the document.
+
+        :rtype: str
+        """
         result = ""
         if self.layout_type in ['default', 'equations']:
-            result += shared.machine.write_document_begins()
             result += self.sheet_header_to_str()
             result += self.sheet_title_to_str()
             result += self.sheet_text_to_str()
@@ -158,11 +170,8 @@ class S_Structure(object, metaclass=ABCMeta):
             result += shared.machine.write_jump_to_next_page()
             result += self.answers_title_to_str()
             result += self.texts_to_str('ans', 0)
-            result += shared.machine.write_document_ends()
 
         elif self.layout_type == 'short_test':
-            result += shared.machine.write_document_begins()
-
             n = 1
             if self.write_texts_twice:
                 n = 2
@@ -194,21 +203,30 @@ class S_Structure(object, metaclass=ABCMeta):
             result += shared.machine.write_jump_to_next_page()
             result += self.answers_title_to_str()
             result += self.texts_to_str('ans', len(self.exercises_list) // 2)
-            result += shared.machine.write_document_ends()
 
         else:
             raise ValueError('Got ' + self.layout_type + 'instead of std|'
                              'short_test|mini_test|equations')
+        return result
+
+    def preamble_to_str(self, document):
+        """
+        Return the preamble matching the content of the document.
+
+        :param document: the content of the document
+        :type document: str
+        :rtype: str
+        """
         pkg = []
-        if any([s in result for s in KNOWN_AMSSYMB_SYMBOLS]):
+        if any([s in document for s in KNOWN_AMSSYMB_SYMBOLS]):
             pkg.append('amssymb')
-        if any([s in result for s in KNOWN_AMSMATH_SYMBOLS]):
+        if any([s in document for s in KNOWN_AMSMATH_SYMBOLS]):
             pkg.append('amsmath')
-        if any([s in result for s in KNOWN_TEXTCOMP_SYMBOLS]):
+        if any([s in document for s in KNOWN_TEXTCOMP_SYMBOLS]):
             pkg.append('textcomp')
 
         return shared.machine.write_preamble(variant=self.layout_type,
-                                             required_pkg=pkg) + result
+                                             required_pkg=pkg)
 
     # --------------------------------------------------------------------------
     ##
@@ -20,378 +20,459 @@
 # along with Mathmaker; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
 
-import sqlite3
+import random
 from pathlib import Path
+from functools import partial
+from contextlib import contextmanager
+
+from mathmakerlib import required
+from mathmakerlib.geometry import Point
 
 from mathmaker import settings
 from mathmaker.lib.machine import LaTeX
 from mathmaker.lib.constants import latex
+from mathmaker.lib.tools import write_behind, overlay
 
 TEMPLOG = Path.home() / '.local/log/mmdebug.log'
 
+# The databases, named after their settings.path attributes (their *_dist
+# paths). They share one connection: db is its main database, the others are
+# attached to it under their names, so that these attributes of this module
+# are the same connection.
+DATABASES = ('db', 'natural_nb_tuples_db', 'solids_db', 'shapes_db',
+             'anglessets_db')
+# Size of the compiled statements' cache of the connection
+CACHED_STATEMENTS = 512
+
+# The profiler of the draws, if enabled (see draws_profiler.py)
+draws_profiler = None
+
+# The share of the rows this process draws from first, as (i, n): the i-th of
+# n shares, in a process building a chunk of questions (see share_draws())
+draws_share = None
+
+# The factories registered by init(): a source (or a connection) is only
+# created on first access to the matching attribute of this module.
+_registry = {}
+
+# The connections inherited from a parent process (see reconnect())
+_inherited = []
+
 
 def log_append(text, encoding=None, errors=None):
     with TEMPLOG.open('a', encoding=encoding, errors=errors) as f:
         f.write(text)
 
 
+def __getattr__(name):
+    """Create the registered source or connection name on first access."""
+    try:
+        factory = _registry[name]
+    except KeyError:
+        raise AttributeError(f"module '{__name__}' has no attribute "
+                             f"'{name}'") from None
+    globals()[name] = value = factory()
+    return value
+
+
+def _get(name):
+    return globals()[name] if name in globals() else __getattr__(name)
+
+
+def opened_databases():
+    """The databases' connections that have been opened so far."""
+    opened = []
+    for name in DATABASES:
+        if name in globals() and globals()[name] not in opened:
+            opened.append(globals()[name])
+    return opened
+
+
+def commit():
+    """Write the pending updates of the opened databases and commit them."""
+    for db in opened_databases():
+        write_behind.flush(db)
+        db.commit()
+
+
+def _forget_sources():
+    """
+    Forget the connections and the sources created so far.
+
+    They would be created again on next access. The sources that do not
+    read the databases are kept as is.
+    """
+    from mathmaker.lib.tools import database
+    for name in _registry:
+        if not isinstance(globals().get(name), database.sub_source):
+            globals().pop(name, None)
+
+
+def close(commit=True):
+    """
+    Close the opened databases.
+
+    They would be opened again on next access, and so would the sources
+    reading them be created again.
+
+    If the draws are profiled, the report is written first.
+
+    :param commit: whether to commit the modifications before closing
+    :type commit: bool
+    """
+    if draws_profiler is not None and settings.profile_draws:
+        draws_profiler.write(settings.profile_draws)
+    for db in opened_databases():
+        if commit:
+            write_behind.flush(db)
+            db.commit()
+        write_behind.forget(db)
+        db.close()
+    _forget_sources()
+
+
+def use_seed(seed):
+    """
+    Make the next draws depend on seed only.
+
+    The databases are closed, and will be opened again with an empty state,
+    kept in memory and never written back (see overlay.connect()): the rows
+    drawn before, by this process or others, do not matter, and the seeded
+    draws do not matter to the next ones. Then the random generator is
+    seeded, and the points are named from A again, as the LaTeX packages the
+    sheet requires are found again. So, the same sheet, generated with the
+    same seed, options and configuration, is the same document, whether it
+    is the first one generated by the process or not.
+
+    With seed=None, the databases will be opened again with their shared
+    state, and the random generator is seeded from the system.
+
+    :param seed: the seed, or None
+    :type seed: None or int
+    """
+    close()
+    # The sources that do not read the databases are created again too, as
+    # they keep track of the values they provided
+    for name in _registry:
+        globals().pop(name, None)
+    settings.seed = seed
+    random.seed(seed)
+    if seed is not None:
+        required.required_initialized = False
+        required.init()
+        Point.reset_names()
+
+
+def reconnect():
+    """
+    Open new connections to the databases (on next access), in a forked
+    process.
+
+    The connections inherited from the parent process must not be used, nor
+    closed: they are kept aside, and the sources using them are forgotten.
+    The sources that do not read the databases are kept as is.
+    """
+    _inherited.extend(opened_databases())
+    _forget_sources()
+
+
+def share_draws(i, n):
+    """
+    Draw from the i-th of n shares of the values, in a forked process.
+
+    The processes building the n chunks of the questions of an exercise (see
+    render_pool) inherit the same state: each one would draw the same rows,
+    and the same values of the sources that do not read the databases. So,
+    the i-th one draws first the rows whose ids are i modulo n (the other
+    ones only when there is none left), and starts the sources that do not
+    read the databases at the i-th of n parts of their values left.
+
+    :param i: the number of the share of this process
+    :type i: int
+    :param n: the number of shares
+    :type n: int
+    """
+    global draws_share
+    from mathmaker.lib.tools import database
+    draws_share = (i, n)
+    for name in _registry:
+        if isinstance(globals().get(name), database.sub_source):
+            globals()[name].share(i, n)
+
+
+@contextmanager
+def connected():
+    """
+    Close the databases at the end of the with block.
+
+    Their modifications are committed, unless the block is left because of
+    an exception (including SystemExit).
+    """
+    try:
+        yield
+    except BaseException:
+        close(commit=False)
+        raise
+    close()
+
+
+def _connect():
+    # The queries are parameterized, so sqlite keeps their compiled form in
+    # this cache and reuses it whatever the values bound to them
+    seeded = settings.seed is not None
+    return overlay.connect(settings.path.db_dist,
+                           None if seeded else settings.path.db_state,
+                           attached={name: getattr(settings.path,
+                                                   name + '_dist')
+                                     for name in DATABASES[1:]},
+                           session=settings.session_state or seeded,
+                           timeout=settings.db_busy_timeout,
+                           cached_statements=CACHED_STATEMENTS)
+
+
 def init():
-    global db
-    global shapes_db
-    global solids_db
-    global natural_nb_tuples_db
-    global anglessets_db
-    global unique_letters_words_source
-    global names_source
-    global mini_problems_wordings_source
-    global mini_problems_prop_wordings_source
-    global mini_problems_time_wordings_source
-    global divisibility_statements_source
     global markup
-    global deci_int_triples_for_prop_source
-    global int_pairs_source
-    global int_triples_source
-    global int_quadruples_source
-    global int_quintuples_source
-    global int_sextuples_source
-    global nnsingletons_source
-    global nnpairs_source
-    global nn_deci_clever_pairs_source
-    global nntriples_source
-    global nnquadruples_source
-    global nnquintuples_source
-    global nnsextuples_source
-    global simple_proper_fractions_source
-    global simple_improper_fractions_source
-    global simple_fractions_source
-    global improper_fractions_source
-    global single_ints_source
-    global single_deci1_source
-    global angle_decorations_source
-    global angle_ranges_source
-    global int_deci_clever_pairs_source
-    global digits_places_source
-    global fracdigits_places_source
-    global int_fracs_source
-    global deci_10_100_1000_multi_source
-    global deci_10_100_1000_divi_source
-    global deci_one_digit_multi_source
-    global deci_one_digit_divi_source
-    global trigo_functions_source
-    global trigo_vocabulary_source
-    global mc_source
     global machine
-    global number_of_the_question
-    global order_of_operations_variants_source
-    global unitspairs_source
-    global uppercase_letters_source
-    global alternate_source  # , alternate_source2
-    global alternate_2masks_source
-    global alternate_3masks_source
-    global alternate_4masks_source
-    global alternate_nb2nb3_in_mini_pb_prop_source
-    global decimals_source
-    global extdecimals_source
-    global dvipsnames_selection_source
-    global polygons_source
-    global anglessets_source
-    global anglessets_1_1_source
-    global anglessets_1_1r_source
-    global anglessets_2_source
-    global anglessets_1_1_1_source
-    global anglessets_1_1_1r_source
-    global anglessets_2_1_source
-    global anglessets_2_1r_source
-    global anglessets_3_source
-    global scalene_triangle_shapes_source
-    global right_triangle_shapes_source
-    global triangle_2_1_shapes_source
-    global triangle_3_shapes_source
-    global quadrilateral_1_1_1_1_shapes_source
-    global quadrilateral_2_1_1_shapes_source
-    global quadrilateral_2_2_shapes_source
-    global quadrilateral_3_1_shapes_source
-    global quadrilateral_4_shapes_source
-    global pentagon_1_1_1_1_1_shapes_source
-    global pentagon_2_1_1_1_shapes_source
-    global pentagon_2_2_1_shapes_source
-    global pentagon_3_1_1_shapes_source
-    global pentagon_3_2_shapes_source
-    global pentagon_4_1_shapes_source
-    global pentagon_5_shapes_source
-    global hexagon_1_1_1_1_1_1_shapes_source
-    global hexagon_2_1_1_1_1_shapes_source
-    global hexagon_2_2_1_1_shapes_source
-    global hexagon_2_2_2_shapes_source
-    global hexagon_3_1_1_1_shapes_source
-    global hexagon_3_2_1_shapes_source
-    global hexagon_3_3_shapes_source
-    global hexagon_4_1_1_shapes_source
-    global hexagon_4_2_shapes_source
-    global hexagon_5_1_shapes_source
-    global hexagon_6_shapes_source
-    global rightcuboids_source
-    global ls_marks_source
     global enable_js_form
-    global distcodes_source
-    global expressions_source
-    global signed_nb_comparisons_source
-    global coordinates_xy_source
-    global cols_for_spreadsheets_source
-    global directions_source
-    global times_source
-    global multiplesof10_source
-    global time_units_couples_source
-    global time_units_conversions_source
-    global pythagorean_triples_source
-    global alternate_hyp_leg_source
-    global alternate_pyth_use_decimals_source
-    global alternate_exactness_source
-    global alternate_clockwise_anticlockwise_source
-    global alternate_acute_obtuse_pairs_source
+    global number_of_the_question
+    global draws_profiler
 
     enable_js_form = False
 
     log = settings.mainlogger
 
-    db = sqlite3.connect(settings.path.db)
-    shapes_db = sqlite3.connect(settings.path.shapes_db)
-    anglessets_db = sqlite3.connect(settings.path.anglessets_db)
-    solids_db = sqlite3.connect(settings.path.solids_db)
-    natural_nb_tuples_db = sqlite3.connect(settings.path.natural_nb_tuples_db)
+    # Forget the sources and connections created by a previous init(), once
+    # their pending updates are written
+    close()
+    for name in _registry:
+        globals().pop(name, None)
+    _registry.clear()
 
-    from mathmaker.lib.tools import database
-    unique_letters_words_source = {}
-    for n in settings.available_wNl:
-        source_name = 'w{}l'.format(n)
-        unique_letters_words_source.update(
-            {n: database.source(source_name, ['id', 'word'],
-                                language=settings.language)})
-    names_source = database.source("names", ["id", "name"],
-                                   language=settings.language)
-    mini_problems_wordings_source = database.source("mini_pb_wordings",
-                                                    ["id", "wording_context",
-                                                     "wording"])
-    mini_problems_prop_wordings_source = database.source(
-        "mini_pb_prop_wordings", ["id", "wording_context", "wording",
-                                  "nb1_xcoeff", "nb2_xcoeff", "nb3_xcoeff"])
-    mini_problems_time_wordings_source = database.source(
-        "mini_pb_time_wordings", ["id", "wording_context", "type", "wording",
-                                  "mini_start_hour",
-                                  "mini_start_minute", "maxi_start_hour",
-                                  "maxi_start_minute", "mini_duration_hour",
-                                  "mini_duration_minute", "maxi_duration_hour",
-                                  "maxi_duration_minute", "mini_end_hour",
-                                  "mini_end_minute", "maxi_end_hour",
-                                  "maxi_end_minute"])
-    divisibility_statements_source = database.source("divisibility_statements",
-                                                     ["id", "wording"])
-    deci_int_triples_for_prop_source = database.source(
-        "deci_int_triples_for_prop", ["id", "coeff", "nb1", "nb2", "nb3",
-                                      "solution"])
-
-    int_pairs_source = database.source("int_pairs", ["id", "nb1", "nb2"])
-    int_triples_source = database.source("int_triples",
-                                         ["id", "nb1", "nb2", "nb3"])
-    int_quadruples_source = database.source("int_quadruples",
-                                            ["id", "nb1", "nb2", "nb3", "nb4"])
-    int_quintuples_source = database.source("int_quintuples",
-                                            ["id", "nb1", "nb2", "nb3", "nb4",
-                                             "nb5"])
-    nnsingletons_source = database.source("singletons", ["id", "nb1"],
-                                          db=natural_nb_tuples_db)
-    nnpairs_source = database.source("pairs", ["id", "nb1", "nb2"],
-                                     db=natural_nb_tuples_db)
-    nn_deci_clever_pairs_source = database.source("nn_deci_clever_pairs",
-                                                  ["id", "nb1", "nb2"])
-    nntriples_source = database.source("triples", ["id", "nb1", "nb2", "nb3"],
-                                       db=natural_nb_tuples_db)
-    nnquadruples_source = database.source("quadruples",
-                                          ["id", "nb1", "nb2", "nb3", "nb4"],
-                                          db=natural_nb_tuples_db)
-    nnquintuples_source = database.source("quintuples",
-                                          ["id", "nb1", "nb2", "nb3", "nb4",
-                                           "nb5"], db=natural_nb_tuples_db)
-    nnsextuples_source = database.source("sextuples",
-                                         ["id", "nb1", "nb2", "nb3", "nb4",
-                                          "nb5", "nb6"],
-                                         db=natural_nb_tuples_db)
-    int_sextuples_source = database.source("int_sextuples",
-                                           ["id", "nb1", "nb2", "nb3", "nb4",
-                                            "nb5", "nb6"])
-    simple_fractions_source = database.source(
-        'simple_fractions', ['id', 'nb1', 'nb2'])
-    simple_proper_fractions_source = database.source(
-        'simple_proper_fractions', ['id', 'nb1', 'nb2'])
-    improper_fractions_source = database.source('improper_fractions',
-                                                ['id', 'nb1', 'nb2'])
-    simple_improper_fractions_source = database.source(
-        'simple_improper_fractions', ['id', 'nb1', 'nb2'])
-    single_ints_source = database.source("single_ints", ["id", "nb1"])
-    single_deci1_source = database.source("single_deci1", ["id", "nb1"])
-    angle_ranges_source = database.source("angle_ranges", ["id", "nb1", "nb2"])
-    angle_decorations_source = database.source(
-        'angle_decorations', ['id', 'variety', 'hatchmark'])
-    int_deci_clever_pairs_source = database.source("int_deci_clever_pairs",
-                                                   ["id", "nb1", "nb2"])
-    order_of_operations_variants_source = database.source(
-        'order_of_operations_variants', ['id', 'nb1'])
-    expressions_source = database.source('expressions', ['id', 'nb1'])
-    signed_nb_comparisons_source = database.source(
-        'signed_nb_comparisons', ['id', 'nb1'])
-    coordinates_xy_source = database.source('coordinates_xy',
-                                            ['id', 'nb1', 'nb2'])
-    cols_for_spreadsheets_source = database.source(
-        'cols_for_spreadsheets', ['id', 'col'])
-    pythagorean_triples_source = database.source(
-        'pythagorean_triples', ['id', 'leg0', 'leg1', 'hyp', 'calculate_hyp',
-                                'calculate_leg', 'suits_for_decimals',
-                                'exactness'])
-    time_units_couples_source = database.source('time_units_couples',
-                                                ['id', 'u1', 'u2'])
-    time_units_conversions_source = database.source('time_units_conversions',
-                                                    ['id', 'category',
-                                                     'level', 'direction'])
-    unitspairs_source = database.source('units_conversions',
-                                        ['id', 'unit1', 'unit2',
-                                         'direction', 'category',
-                                         'level', 'dimension'])
-    decimals_source = database.source('decimals', ['id', 'nb1'])
-    digits_places_source = database.source('digits_places', ['id', 'place'])
-    fracdigits_places_source = database.source('fracdigits_places',
-                                               ['id', 'place'])
-    dvipsnames_selection_source = database.source('dvipsnames_selection',
-                                                  ['id', 'color_name'])
-    ls_marks_source = database.source('ls_marks', ['id', 'mark'])
-    distcodes_source = database.source('distcodes', ['id', 'distcode'])
-    directions_source = database.source('directions', ['id', 'direction'])
-    times_source = database.source('times', ['id', 'hour', 'minute'])
-    multiplesof10_source = database.source('multiplesof10',
-                                           ['id', 'factor1', 'factor2'])
-    anglessets_source = database.source('anglessets',
-                                        ['id', 'nbof_angles', 'distcode',
-                                         'variant', 'nbof_right_angles',
-                                         'equal_angles', 'table2',
-                                         'table3', 'table4', 'table5',
-                                         'table6'],
-                                        db=anglessets_db)
-    anglessets_1_1_source = database.source(
-        '_1_1_subvariants', ['id', 'subvariant_nb'], db=anglessets_db)
-    anglessets_1_1r_source = database.source(
-        '_1_1r_subvariants', ['id', 'subvariant_nb'], db=anglessets_db)
-    anglessets_2_source = database.source(
-        '_2_subvariants', ['id', 'subvariant_nb'], db=anglessets_db)
-    anglessets_1_1_1_source = database.source(
-        '_1_1_1_subvariants', ['id', 'subvariant_nb'], db=anglessets_db)
-    anglessets_1_1_1r_source = database.source(
-        '_1_1_1r_subvariants', ['id', 'subvariant_nb'], db=anglessets_db)
-    anglessets_2_1_source = database.source(
-        '_2_1_subvariants', ['id', 'subvariant_nb'], db=anglessets_db)
-    anglessets_2_1r_source = database.source(
-        '_2_1r_subvariants', ['id', 'subvariant_nb'], db=anglessets_db)
-    anglessets_3_source = database.source(
-        '_3_subvariants', ['id', 'subvariant_nb'], db=anglessets_db)
-    polygons_source = database.source('polygons',
-                                      ['id', 'sides_nb', 'type', 'special',
-                                       'codename', 'sides_particularity',
-                                       'level', 'variant', 'table2', 'table3',
-                                       'table4', 'table5', 'table6'],
-                                      db=shapes_db)
-    scalene_triangle_shapes_source = database.source('scalene_triangle_shapes',
-                                                     ['id', 'shape_nb'],
-                                                     db=shapes_db)
-    right_triangle_shapes_source = database.source('right_triangle_shapes',
-                                                   ['id', 'shape_nb'],
-                                                   db=shapes_db)
-    triangle_2_1_shapes_source = database.source(
-        'triangle_2_1_shapes', ['id', 'shape_nb'], db=shapes_db)
-    triangle_3_shapes_source = database.source(
-        'triangle_3_shapes', ['id', 'shape_nb'], db=shapes_db)
-    quadrilateral_1_1_1_1_shapes_source = database.source(
-        'quadrilateral_1_1_1_1_shapes', ['id', 'shape_nb'], db=shapes_db)
-    quadrilateral_2_1_1_shapes_source = database.source(
-        'quadrilateral_2_1_1_shapes', ['id', 'shape_nb'], db=shapes_db)
-    quadrilateral_2_2_shapes_source = database.source(
-        'quadrilateral_2_2_shapes', ['id', 'shape_nb'], db=shapes_db)
-    quadrilateral_3_1_shapes_source = database.source(
-        'quadrilateral_3_1_shapes', ['id', 'shape_nb'], db=shapes_db)
-    quadrilateral_4_shapes_source = database.source(
-        'quadrilateral_4_shapes', ['id', 'shape_nb'], db=shapes_db)
-    pentagon_1_1_1_1_1_shapes_source = database.source(
-        'pentagon_1_1_1_1_1_shapes', ['id', 'shape_nb'], db=shapes_db)
-    pentagon_2_1_1_1_shapes_source = database.source(
-        'pentagon_2_1_1_1_shapes', ['id', 'shape_nb'], db=shapes_db)
-    pentagon_2_2_1_shapes_source = database.source(
-        'pentagon_2_2_1_shapes', ['id', 'shape_nb'], db=shapes_db)
-    pentagon_3_1_1_shapes_source = database.source(
-        'pentagon_3_1_1_shapes', ['id', 'shape_nb'], db=shapes_db)
-    pentagon_3_2_shapes_source = database.source(
-        'pentagon_3_2_shapes', ['id', 'shape_nb'], db=shapes_db)
-    pentagon_4_1_shapes_source = database.source(
-        'pentagon_4_1_shapes', ['id', 'shape_nb'], db=shapes_db)
-    pentagon_5_shapes_source = database.source(
-        'pentagon_5_shapes', ['id', 'shape_nb'], db=shapes_db)
-    hexagon_1_1_1_1_1_1_shapes_source = database.source(
-        'hexagon_1_1_1_1_1_1_shapes', ['id', 'shape_nb'], db=shapes_db)
-    hexagon_2_1_1_1_1_shapes_source = database.source(
-        'hexagon_2_1_1_1_1_shapes', ['id', 'shape_nb'], db=shapes_db)
-    hexagon_2_2_1_1_shapes_source = database.source(
-        'hexagon_2_2_1_1_shapes', ['id', 'shape_nb'], db=shapes_db)
-    hexagon_2_2_2_shapes_source = database.source(
-        'hexagon_2_2_1_1_shapes', ['id', 'shape_nb'], db=shapes_db)
-    hexagon_3_1_1_1_shapes_source = database.source(
-        'hexagon_3_1_1_1_shapes', ['id', 'shape_nb'], db=shapes_db)
-    hexagon_3_2_1_shapes_source = database.source(
-        'hexagon_3_2_1_shapes', ['id', 'shape_nb'], db=shapes_db)
-    hexagon_3_3_shapes_source = database.source(
-        'hexagon_3_3_shapes', ['id', 'shape_nb'], db=shapes_db)
-    hexagon_4_1_1_shapes_source = database.source(
-        'hexagon_4_1_1_shapes', ['id', 'shape_nb'], db=shapes_db)
-    hexagon_4_2_shapes_source = database.source(
-        'hexagon_4_2_shapes', ['id', 'shape_nb'], db=shapes_db)
-    hexagon_5_1_shapes_source = database.source(
-        'hexagon_5_1_shapes', ['id', 'shape_nb'], db=shapes_db)
-    hexagon_6_shapes_source = database.source(
-        'hexagon_6_shapes', ['id', 'shape_nb'], db=shapes_db)
-    rightcuboids_source = database.source(
-        'polyhedra', ['id', 'faces_nb', 'variant'],
-        db=solids_db)
+    _registry['db'] = _connect
+    for name in DATABASES[1:]:
+        _registry[name] = partial(_get, 'db')
+
+    from mathmaker.lib.tools import database, columnar, draws_profiler as dp
+
+    draws_profiler = dp.DrawsProfiler() if settings.profile_draws else None
+
+    def _source(name, table_name, cols, db='db', **kwargs):
+        cls = database.source
+        if (settings.columnar_sources
+            and db in columnar.COLUMNAR_DATABASES):
+            cls = columnar.columnar_source
+        _registry[name] = lambda: cls(table_name, cols, db=_get(db), **kwargs)
+
+    def _sub_source(name, source_id, **kwargs):
+        _registry[name] = partial(database.sub_source, source_id, **kwargs)
+
+    _registry['unique_letters_words_source'] = lambda: {
+        n: database.source('w{}l'.format(n), ['id', 'word'], db=_get('db'),
+                           language=settings.language)
+        for n in settings.available_wNl}
+    _source('names_source', 'names', ['id', 'name'],
+            language=settings.language)
+    _source('mini_problems_wordings_source', 'mini_pb_wordings',
+            ['id', 'wording_context', 'wording'])
+    _source('mini_problems_prop_wordings_source', 'mini_pb_prop_wordings',
+            ['id', 'wording_context', 'wording', 'nb1_xcoeff', 'nb2_xcoeff',
+             'nb3_xcoeff'])
+    _source('mini_problems_time_wordings_source', 'mini_pb_time_wordings',
+            ['id', 'wording_context', 'type', 'wording', 'mini_start_hour',
+             'mini_start_minute', 'maxi_start_hour', 'maxi_start_minute',
+             'mini_duration_hour', 'mini_duration_minute',
+             'maxi_duration_hour', 'maxi_duration_minute', 'mini_end_hour',
+             'mini_end_minute', 'maxi_end_hour', 'maxi_end_minute'])
+    _source('divisibility_statements_source', 'divisibility_statements',
+            ['id', 'wording'])
+    _source('deci_int_triples_for_prop_source', 'deci_int_triples_for_prop',
+            ['id', 'coeff', 'nb1', 'nb2', 'nb3', 'solution'])
+
+    _source('int_pairs_source', 'int_pairs', ['id', 'nb1', 'nb2'])
+    _source('int_triples_source', 'int_triples', ['id', 'nb1', 'nb2', 'nb3'])
+    _source('int_quadruples_source', 'int_quadruples',
+            ['id', 'nb1', 'nb2', 'nb3', 'nb4'])
+    _source('int_quintuples_source', 'int_quintuples',
+            ['id', 'nb1', 'nb2', 'nb3', 'nb4', 'nb5'])
+    _source('nnsingletons_source', 'singletons', ['id', 'nb1'],
+            db='natural_nb_tuples_db')
+    _source('nnpairs_source', 'pairs', ['id', 'nb1', 'nb2'],
+            db='natural_nb_tuples_db')
+    _source('nn_deci_clever_pairs_source', 'nn_deci_clever_pairs',
+            ['id', 'nb1', 'nb2'])
+    _source('nntriples_source', 'triples', ['id', 'nb1', 'nb2', 'nb3'],
+            db='natural_nb_tuples_db')
+    _source('nnquadruples_source', 'quadruples',
+            ['id', 'nb1', 'nb2', 'nb3', 'nb4'], db='natural_nb_tuples_db')
+    _source('nnquintuples_source', 'quintuples',
+            ['id', 'nb1', 'nb2', 'nb3', 'nb4', 'nb5'],
+            db='natural_nb_tuples_db')
+    _source('nnsextuples_source', 'sextuples',
+            ['id', 'nb1', 'nb2', 'nb3', 'nb4', 'nb5', 'nb6'],
+            db='natural_nb_tuples_db')
+    _source('int_sextuples_source', 'int_sextuples',
+            ['id', 'nb1', 'nb2', 'nb3', 'nb4', 'nb5', 'nb6'])
+    _source('simple_fractions_source', 'simple_fractions',
+            ['id', 'nb1', 'nb2'])
+    _source('simple_proper_fractions_source', 'simple_proper_fractions',
+            ['id', 'nb1', 'nb2'])
+    _source('improper_fractions_source', 'improper_fractions',
+            ['id', 'nb1', 'nb2'])
+    _source('simple_improper_fractions_source', 'simple_improper_fractions',
+            ['id', 'nb1', 'nb2'])
+    _source('single_ints_source', 'single_ints', ['id', 'nb1'])
+    _source('single_deci1_source', 'single_deci1', ['id', 'nb1'])
+    _source('angle_ranges_source', 'angle_ranges', ['id', 'nb1', 'nb2'])
+    _source('angle_decorations_source', 'angle_decorations',
+            ['id', 'variety', 'hatchmark'])
+    _source('int_deci_clever_pairs_source', 'int_deci_clever_pairs',
+            ['id', 'nb1', 'nb2'])
+    _source('order_of_operations_variants_source',
+            'order_of_operations_variants', ['id', 'nb1'])
+    _source('expressions_source', 'expressions', ['id', 'nb1'])
+    _source('signed_nb_comparisons_source', 'signed_nb_comparisons',
+            ['id', 'nb1'])
+    _source('coordinates_xy_source', 'coordinates_xy', ['id', 'nb1', 'nb2'])
+    _source('cols_for_spreadsheets_source', 'cols_for_spreadsheets',
+            ['id', 'col'])
+    _source('pythagorean_triples_source', 'pythagorean_triples',
+            ['id', 'leg0', 'leg1', 'hyp', 'calculate_hyp', 'calculate_leg',
+             'suits_for_decimals', 'exactness'])
+    _source('time_units_couples_source', 'time_units_couples',
+            ['id', 'u1', 'u2'])
+    _source('time_units_conversions_source', 'time_units_conversions',
+            ['id', 'category', 'level', 'direction'])
+    _source('unitspairs_source', 'units_conversions',
+            ['id', 'unit1', 'unit2', 'direction', 'category', 'level',
+             'dimension'])
+    _source('decimals_source', 'decimals', ['id', 'nb1'])
+    _source('digits_places_source', 'digits_places', ['id', 'place'])
+    _source('fracdigits_places_source', 'fracdigits_places', ['id', 'place'])
+    _source('dvipsnames_selection_source', 'dvipsnames_selection',
+            ['id', 'color_name'])
+    _source('ls_marks_source', 'ls_marks', ['id', 'mark'])
+    _source('distcodes_source', 'distcodes', ['id', 'distcode'])
+    _source('directions_source', 'directions', ['id', 'direction'])
+    _source('times_source', 'times', ['id', 'hour', 'minute'])
+    _source('multiplesof10_source', 'multiplesof10',
+            ['id', 'factor1', 'factor2'])
+    _source('anglessets_source', 'anglessets',
+            ['id', 'nbof_angles', 'distcode', 'variant', 'nbof_right_angles',
+             'equal_angles', 'table2', 'table3', 'table4', 'table5',
+             'table6'],
+            db='anglessets_db')
+    _source('anglessets_1_1_source', '_1_1_subvariants',
+            ['id', 'subvariant_nb'], db='anglessets_db')
+    _source('anglessets_1_1r_source', '_1_1r_subvariants',
+            ['id', 'subvariant_nb'], db='anglessets_db')
+    _source('anglessets_2_source', '_2_subvariants', ['id', 'subvariant_nb'],
+            db='anglessets_db')
+    _source('anglessets_1_1_1_source', '_1_1_1_subvariants',
+            ['id', 'subvariant_nb'], db='anglessets_db')
+    _source('anglessets_1_1_1r_source', '_1_1_1r_subvariants',
+            ['id', 'subvariant_nb'], db='anglessets_db')
+    _source('anglessets_2_1_source', '_2_1_subvariants',
+            ['id', 'subvariant_nb'], db='anglessets_db')
+    _source('anglessets_2_1r_source', '_2_1r_subvariants',
+            ['id', 'subvariant_nb'], db='anglessets_db')
+    _source('anglessets_3_source', '_3_subvariants', ['id', 'subvariant_nb'],
+            db='anglessets_db')
+    _source('polygons_source', 'polygons',
+            ['id', 'sides_nb', 'type', 'special', 'codename',
+             'sides_particularity', 'level', 'variant', 'table2', 'table3',
+             'table4', 'table5', 'table6'],
+            db='shapes_db')
+    _source('scalene_triangle_shapes_source', 'scalene_triangle_shapes',
+            ['id', 'shape_nb'], db='shapes_db')
+    _source('right_triangle_shapes_source', 'right_triangle_shapes',
+            ['id', 'shape_nb'], db='shapes_db')
+    _source('triangle_2_1_shapes_source', 'triangle_2_1_shapes',
+            ['id', 'shape_nb'], db='shapes_db')
+    _source('triangle_3_shapes_source', 'triangle_3_shapes',
+            ['id', 'shape_nb'], db='shapes_db')
+    _source('quadrilateral_1_1_1_1_shapes_source',
+            'quadrilateral_1_1_1_1_shapes', ['id', 'shape_nb'], db='shapes_db')
+    _source('quadrilateral_2_1_1_shapes_source', 'quadrilateral_2_1_1_shapes',
+            ['id', 'shape_nb'], db='shapes_db')
+    _source('quadrilateral_2_2_shapes_source', 'quadrilateral_2_2_shapes',
+            ['id', 'shape_nb'], db='shapes_db')
+    _source('quadrilateral_3_1_shapes_source', 'quadrilateral_3_1_shapes',
+            ['id', 'shape_nb'], db='shapes_db')
+    _source('quadrilateral_4_shapes_source', 'quadrilateral_4_shapes',
+            ['id', 'shape_nb'], db='shapes_db')
+    _source('pentagon_1_1_1_1_1_shapes_source', 'pentagon_1_1_1_1_1_shapes',
+            ['id', 'shape_nb'], db='shapes_db')
+    _source('pentagon_2_1_1_1_shapes_source', 'pentagon_2_1_1_1_shapes',
+            ['id', 'shape_nb'], db='shapes_db')
+    _source('pentagon_2_2_1_shapes_source', 'pentagon_2_2_1_shapes',
+            ['id', 'shape_nb'], db='shapes_db')
+    _source('pentagon_3_1_1_shapes_source', 'pentagon_3_1_1_shapes',
+            ['id', 'shape_nb'], db='shapes_db')
+    _source('pentagon_3_2_shapes_source', 'pentagon_3_2_shapes',
+            ['id', 'shape_nb'], db='shapes_db')
+    _source('pentagon_4_1_shapes_source', 'pentagon_4_1_shapes',
+            ['id', 'shape_nb'], db='shapes_db')
+    _source('pentagon_5_shapes_source', 'pentagon_5_shapes',
+            ['id', 'shape_nb'], db='shapes_db')
+    _source('hexagon_1_1_1_1_1_1_shapes_source', 'hexagon_1_1_1_1_1_1_shapes',
+            ['id', 'shape_nb'], db='shapes_db')
+    _source('hexagon_2_1_1_1_1_shapes_source', 'hexagon_2_1_1_1_1_shapes',
+            ['id', 'shape_nb'], db='shapes_db')
+    _source('hexagon_2_2_1_1_shapes_source', 'hexagon_2_2_1_1_shapes',
+            ['id', 'shape_nb'], db='shapes_db')
+    _source('hexagon_2_2_2_shapes_source', 'hexagon_2_2_1_1_shapes',
+            ['id', 'shape_nb'], db='shapes_db')
+    _source('hexagon_3_1_1_1_shapes_source', 'hexagon_3_1_1_1_shapes',
+            ['id', 'shape_nb'], db='shapes_db')
+    _source('hexagon_3_2_1_shapes_source', 'hexagon_3_2_1_shapes',
+            ['id', 'shape_nb'], db='shapes_db')
+    _source('hexagon_3_3_shapes_source', 'hexagon_3_3_shapes',
+            ['id', 'shape_nb'], db='shapes_db')
+    _source('hexagon_4_1_1_shapes_source', 'hexagon_4_1_1_shapes',
+            ['id', 'shape_nb'], db='shapes_db')
+    _source('hexagon_4_2_shapes_source', 'hexagon_4_2_shapes',
+            ['id', 'shape_nb'], db='shapes_db')
+    _source('hexagon_5_1_shapes_source', 'hexagon_5_1_shapes',
+            ['id', 'shape_nb'], db='shapes_db')
+    _source('hexagon_6_shapes_source', 'hexagon_6_shapes', ['id', 'shape_nb'],
+            db='shapes_db')
+    _source('rightcuboids_source', 'polyhedra', ['id', 'faces_nb', 'variant'],
+            db='solids_db')
 
     markup = latex.MARKUP
 
-    from mathmaker.lib.tools.database import sub_source, mc_source
-    from mathmaker.lib.tools.database import generate_random_decimal_nb
-    extdecimals_source = sub_source('extdecimals', ondemand=True,
-                                    generator_fct=generate_random_decimal_nb)
-    alternate_source = sub_source('alternate')
-    uppercase_letters_source = sub_source('uppercase_letters_source')
-    alternate_clockwise_anticlockwise_source = sub_source(
-        'alternate_clockwise_anticlockwise', shuffle=False)
-    alternate_acute_obtuse_pairs_source = sub_source(
-        'alternate_acute_obtuse_pairs', shuffle=False)
-    alternate_hyp_leg_source = sub_source('alternate_hyp_leg', shuffle=False)
-    alternate_pyth_use_decimals_source = sub_source(
-        'alternate_pyth_use_decimals', shuffle=False)
-    alternate_exactness_source = sub_source('alternate_exactness',
-                                            shuffle=False)
-    alternate_2masks_source = sub_source('alternate_2masks')
-    alternate_3masks_source = sub_source('alternate_3masks')
-    alternate_4masks_source = sub_source('alternate_4masks')
-    alternate_nb2nb3_in_mini_pb_prop_source = \
-        sub_source('alternate_nb2nb3_in_mini_pb_prop')
-    # alternate_source2 = sub_source('alternate2')
-    trigo_functions_source = sub_source('trigo_functions')
-    trigo_vocabulary_source = sub_source('trigo_vocabulary')
-    int_fracs_source = sub_source('int_irreducible_frac')
-    deci_10_100_1000_multi_source = sub_source(
-        'decimal_and_10_100_1000_for_multi')
-    deci_10_100_1000_divi_source = sub_source(
-        'decimal_and_10_100_1000_for_divi')
-    deci_one_digit_multi_source = sub_source(
-        'decimal_and_one_digit_for_multi')
-    deci_one_digit_divi_source = sub_source(
-        'decimal_and_one_digit_for_divi')
-    mc_source = mc_source()
+    _sub_source('extdecimals_source', 'extdecimals', ondemand=True,
+                generator_fct=database.generate_random_decimal_nb)
+    _sub_source('alternate_source', 'alternate')
+    _sub_source('uppercase_letters_source', 'uppercase_letters_source')
+    _sub_source('alternate_clockwise_anticlockwise_source',
+                'alternate_clockwise_anticlockwise', shuffle=False)
+    _sub_source('alternate_acute_obtuse_pairs_source',
+                'alternate_acute_obtuse_pairs', shuffle=False)
+    _sub_source('alternate_hyp_leg_source', 'alternate_hyp_leg',
+                shuffle=False)
+    _sub_source('alternate_pyth_use_decimals_source',
+                'alternate_pyth_use_decimals', shuffle=False)
+    _sub_source('alternate_exactness_source', 'alternate_exactness',
+                shuffle=False)
+    _sub_source('alternate_2masks_source', 'alternate_2masks')
+    _sub_source('alternate_3masks_source', 'alternate_3masks')
+    _sub_source('alternate_4masks_source', 'alternate_4masks')
+    _sub_source('alternate_nb2nb3_in_mini_pb_prop_source',
+                'alternate_nb2nb3_in_mini_pb_prop')
+    # _sub_source('alternate_source2', 'alternate2')
+    _sub_source('trigo_functions_source', 'trigo_functions')
+    _sub_source('trigo_vocabulary_source', 'trigo_vocabulary')
+    _sub_source('int_fracs_source', 'int_irreducible_frac')
+    _sub_source('deci_10_100_1000_multi_source',
+                'decimal_and_10_100_1000_for_multi')
+    _sub_source('deci_10_100_1000_divi_source',
+                'decimal_and_10_100_1000_for_divi')
+    _sub_source('deci_one_digit_multi_source',
+                'decimal_and_one_digit_for_multi')
+    _sub_source('deci_one_digit_divi_source',
+                'decimal_and_one_digit_for_divi')
+    _registry['mc_source'] = database.mc_source
 
     try:
         machine = LaTeX(settings.language)
@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+
+# Mathmaker creates automatically maths exercises sheets
+# with their answers
+# Copyright 2006-2017 Nicolas Hainaux <nh.techn@gmail.com>
+
+# This file is part of Mathmaker.
+
+# Mathmaker is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# any later version.
+
+# Mathmaker is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Mathmaker; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+
+"""
+In-memory columnar engine for the small, read-mostly databases.
+
+A columnar_source loads its whole table once, column by column, and reads
+the drawn rows (drawDate != 0) as a bitset: bit i stands for the row i. This
+bitset is shared by the sources of the same table, and read again from the
+database whenever it may have changed (see WriteBehind.version()). The
+rows matching some conditions are a bitset too, computed from the values'
+bitsets of each column (or by SQLite, once, for the conditions the engine
+does not handle itself); drawing is then a matter of a few bitwise
+operations and of picking one of the set bits at random. The bitsets are
+Python integers: the bitwise operations run in C, a machine word at a time,
+as they would on arrays, so the engine needs no other dependency.
+
+The timestamps go to the write-behind buffer, as with any source, so that
+they reach the database later on; the pending ones are added to the bitset
+at each draw. When no row is left to draw, the source
+falls back to the SQL queries, that handle the resets.
+"""
+
+import random
+from array import array
+from functools import partial
+from collections import OrderedDict, defaultdict
+
+from mathmaker.lib import shared
+from mathmaker.lib.tools.database import source, NUMBER, _freeze
+from mathmaker.lib.tools.draws_profiler import profiled
+
+# The databases whose sources may be columnar
+COLUMNAR_DATABASES = ('natural_nb_tuples_db', 'shapes_db', 'solids_db',
+                      'anglessets_db')
+
+# Number of conditions whose matching rows are kept, to be reused as is
+CONDITIONS_CACHE_SIZE = 256
+
+# Keywords telling how to draw, not which rows
+DRAW_KEYWORDS = ('timestamp', 'timestamped', 'enablereset')
+
+# Keywords only the SQL queries handle
+SQL_KEYWORDS = ('union', 'table_name', 'lock_equal_products',
+                'lock_equal_coeffs', 'lock_equal_contexts',
+                'lock_equal_types')
+
+
+# How to compare a column to the values of a condition, by suffix
+COMPARE = {'eq': lambda values, x: x == values[0],
+           'lt': lambda values, x: x < values[0],
+           'ge': lambda values, x: x >= values[0],
+           'neq': lambda values, x: x != values[0],
+           'min': lambda values, x: x >= values[0],
+           'max': lambda values, x: x <= values[0],
+           'in': lambda values, x: x in values}
+
+
+def popcount(bits):
+    return bin(bits).count('1')
+
+
+def nth_bit(bits, n):
+    """Position of the n-th set bit of bits (counting from 0)."""
+    data = bits.to_bytes((bits.bit_length() + 7) // 8, 'little')
+    for i in range(0, len(data), 8):
+        word = int.from_bytes(data[i:i + 8], 'little')
+        count = popcount(word)
+        if n < count:
+            position = i * 8
+            while True:
+                if word & 1:
+                    if not n:
+                        return position
+                    n -= 1
+                word >>= 1
+                position += 1
+        n -= count
+    raise IndexError('bits has not enough set bits')
+
+
+def bitset(positions, size):
+    """Bitset of size bits, where the bits at positions are set."""
+    data = bytearray((size + 7) // 8)
+    for i in positions:
+        data[i >> 3] |= 1 << (i & 7)
+    return int.from_bytes(data, 'little')
+
+
+class columnar_source(source):
+    """
+    A source drawing from its table loaded in memory.
+
+    It has the same interface as source, and is meant for the tables that
+    are not modified, but by the timestamps.
+    """
+
+    def __init__(self, table_name, cols, **kwargs):
+        super().__init__(table_name, cols, **kwargs)
+        # Ordered, so that the sources of the same table share the positions
+        cursor = self.db.execute('SELECT * FROM {} ORDER BY {};'
+                                 .format(table_name, self.idcol))
+        names = [d[0] for d in cursor.description]
+        rows = cursor.fetchall()
+        self.size = len(rows)
+        self.columns = {}
+        for i, name in enumerate(names):
+            values = [row[i] for row in rows]
+            if all(type(v) is int for v in values):
+                values = array('q', values)
+            self.columns[name] = values
+        self.integer_columns = [c for c, values in self.columns.items()
+                                if isinstance(values, array)]
+        self.positions = {id_: i
+                          for i, id_ in enumerate(self.columns[self.idcol])}
+        self.all_rows = (1 << self.size) - 1
+        # {column: {value: bitset}}, only for the columns of integers
+        self._values = {}
+        # Matching rows of recent conditions: {conditions: bitset}
+        self._matching = OrderedDict()
+        # The rows of the share of this process, as (share, bitset)
+        self._share_rows = (None, self.all_rows)
+
+    @property
+    def drawn(self):
+        """
+        The drawn rows: those of the database, and the pending ones.
+
+        The rows read from the database are shared by all the sources of the
+        table on the same connection, and read again when they may have
+        changed: after a reset, a flush, or a write from another connection.
+        """
+        shared_drawn = self.pending.drawn.get(self.table_name)
+        if (shared_drawn is None
+            or not self.pending.up_to_date(self.table_name,
+                                           shared_drawn[0])):
+            version = self.pending.version(self.table_name)
+            ids = self.pending.written_ids(self.table_name, 'drawDate')
+            shared_drawn = (version,
+                            bitset((self.positions[i] for i in ids),
+                                   self.size))
+            self.pending.drawn[self.table_name] = shared_drawn
+        pending = self.pending.rows.get((self.table_name, 'drawDate'), {})
+        if not pending:
+            return shared_drawn[1]
+        return (shared_drawn[1]
+                | bitset((self.positions[i]
+                          for i, value in pending.items() if value),
+                         self.size)) \
+            & ~bitset((self.positions[i]
+                       for i, value in pending.items() if not value),
+                      self.size)
+
+    def _values_of(self, col):
+        """The bitsets of the rows having each value of the column col."""
+        if col not in self._values:
+            positions = defaultdict(list)
+            for i, v in enumerate(self.columns[col]):
+                positions[v].append(i)
+            self._values[col] = {v: bitset(p, self.size)
+                                 for v, p in positions.items()}
+        return self._values[col]
+
+    def _rows_where(self, col, test):
+        """The rows whose value in col passes test."""
+        result = 0
+        for v, bits in self._values_of(col).items():
+            if test(v):
+                result |= bits
+        return result
+
+    def _filter(self, conditions):
+        """
+        The rows matching conditions, or None if they cannot be checked here.
+
+        Only the comparisons of columns of integers to numbers are checked
+        here, the same way the SQL queries would (see
+        source._kw_conditions()); any other condition is left to SQLite.
+        """
+        if self.language:
+            return None
+        rows = self.all_rows
+        for kw, value in conditions.items():
+            if (kw.startswith('info_') or kw.endswith('_noqr')
+                or (kw == 'not_in' and value is None)):
+                continue
+            col, _, suffix = kw.rpartition('_')
+            if kw in self.integer_columns:
+                col, suffix = kw, 'eq'
+            elif col not in self.integer_columns or suffix not in COMPARE:
+                return None
+            values = value if suffix == 'in' else [value]
+            if not all(NUMBER.fullmatch(str(v)) for v in values):
+                return None
+            values = [float(v) if '.' in str(v) else int(v) for v in values]
+            rows &= self._rows_where(col, partial(COMPARE[suffix], values))
+        return rows
+
+    def _select(self, conditions):
+        """The rows matching conditions, as found by SQLite."""
+        params = []
+        cmd = 'SELECT {} FROM {} WHERE 1 '.format(self.idcol, self.table_name)\
+            + self._language_part(params) \
+            + self._kw_conditions(params, **conditions)
+        return bitset((self.positions[row[0]]
+                       for row in self.db.execute(
+                           cmd, self.pending.bind(params))),
+                      self.size)
+
+    def _matching_rows(self, **kwargs):
+        """The rows matching the conditions of kwargs, drawn or not."""
+        conditions = {kw: value for kw, value in kwargs.items()
+                      if kw not in DRAW_KEYWORDS}
+        try:
+            key = _freeze(conditions)
+        except TypeError:  # unhashable value, do not cache
+            key = None
+        if key in self._matching:
+            self._matching.move_to_end(key)
+            return self._matching[key]
+        rows = self._filter(conditions)
+        if rows is None:
+            rows = self._select(conditions)
+        if key is not None:
+            self._matching[key] = rows
+            if len(self._matching) > CONDITIONS_CACHE_SIZE:
+                self._matching.popitem(last=False)
+        return rows
+
+    def _in_share(self, rows):
+        """
+        The rows of the share of this process, or all rows if none is left.
+
+        See shared.share_draws().
+        """
+        if self._share_rows[0] != shared.draws_share:
+            i, n = shared.draws_share
+            self._share_rows = (shared.draws_share,
+                                bitset((p for id_, p in self.positions.items()
+                                        if id_ % n == i), self.size))
+        return rows & self._share_rows[1] or rows
+
+    @profiled('tables', lambda src, *args, **kwargs: src.table_name)
+    def next(self, **kwargs):
+        if any(kw in kwargs for kw in SQL_KEYWORDS):
+            return super().next(**kwargs)
+        rows = self._matching_rows(**kwargs)
+        drawn = self.drawn
+        if kwargs.get('timestamped', False):
+            rows &= drawn
+        else:
+            rows &= ~drawn
+        if shared.draws_share is not None:
+            rows = self._in_share(rows)
+        n = popcount(rows)
+        if not n:  # let the SQL queries reset the table, or raise an error
+            return super().next(**kwargs)
+        i = nth_bit(rows, random.randrange(n))
+        return self._drawn(tuple(self.columns[col][i]
+                                 for col in self.allcols), **kwargs)
@@ -27,9 +27,10 @@ import random
 import warnings
 from copy import deepcopy
 from decimal import Decimal
-from functools import reduce
-from itertools import combinations
-from collections import defaultdict
+from functools import reduce, lru_cache
+from itertools import combinations, product
+from collections.abc import Sequence
+from collections import defaultdict, OrderedDict, Counter, namedtuple
 
 from intspan import intspan
 from intspan.core import ParseError
@@ -40,10 +41,47 @@ from mathmaker.lib import shared
 from mathmaker.lib.constants.numeration import DIGITSPLACES
 from mathmaker.lib.constants.numeration import DIGITSPLACES_CONFUSING
 from mathmaker.lib.tools.distcode import nndist
+from mathmaker.lib.tools.draws_profiler import profiled
 from mathmaker.lib.tools.maths import coprime_generator, generate_decimal
+from mathmaker.lib.tools.write_behind import write_behind, now, Pending
+from mathmaker.lib.tools.write_behind import PENDING_IDS
 
 FETCH_TABLE_NAME = re.compile(r'CREATE TABLE (\w+)')
 FETCH_TABLE_COLS = re.compile(r', (\w\w+)|\n[ ]+(\w\w+)|\((\w\w+)')
+NUMBER = re.compile(r'-?\d+(\.\d*)?')
+# Number of queries kept by each source, to be reused as is
+STATEMENTS_CACHE_SIZE = 32
+# Maximal number of tuples IntspansProduct lists, to check the conditions
+# linking their numbers, or to count them (see feasible()), and number of
+# lists it keeps
+FEASIBLE_TUPLES_MAX = 20000
+FEASIBLE_TUPLES_CACHE_SIZE = 64
+# Maximal number of tuples drawn at random from a product of spans too big to
+# be listed, until one matches the conditions linking their numbers
+SAMPLED_TUPLES_ATTEMPTS = 10000
+# The keywords of the conditions that IntspansProduct checks, besides the
+# ones on each number (nb1_min, nb2_in, etc.)
+SOLVER_KEYWORDS = ('not_in', 'either_nb1_nb2_in', 'constructible', 'code')
+# The tables whose rows may be locked (see source._unlock()), and the
+# keywords of the conditions excluding the locked rows
+LOCKED_TABLES = ('deci_int_triples_for_prop', 'mini_pb_prop_wordings',
+                 'mini_pb_time_wordings')
+LOCK_KEYWORDS = ('lock_equal_coeffs', 'lock_equal_contexts',
+                 'lock_equal_types')
+# Number of parsed spans (and products of spans) kept by IntspansProduct
+SPANS_CACHE_SIZE = 256
+# A row is drawn by probing random ids if the ids of the table span at most
+# PROBES_SPAN times the number of rows selected, and PROBES ids at most are
+# tried (see source._probe())
+PROBES_SPAN = 4
+PROBES = 8
+
+# A product of spans, parsed once: its intspans (not to be modified), their
+# sorted values, lengths, minima and maxima, the order of the spans by
+# length, and whether a (not) constructible tuple can be drawn from them
+CompiledSpans = namedtuple('CompiledSpans',
+                           'spans,values,lengths,mini,maxi,order,'
+                           'constructible,not_constructible')
 
 
 def parse_sql_creation_query(qr):
@@ -55,6 +93,74 @@ def parse_sql_creation_query(qr):
              if elt != ''])
 
 
+class TuplesProduct(Sequence):
+    """
+    The tuples of the product of lists of values, in the order of
+    itertools.product(), each one computed only when it is read.
+
+    So, one of them can be drawn at random (e.g. by random.choice()) without
+    listing them all. The values of the i-th list are repeated lengths[i]
+    times in the tuples (see distcode).
+    """
+
+    def __init__(self, values, lengths):
+        self.values = values
+        self.lengths = lengths
+        self.size = reduce(lambda x, y: x * y, [len(v) for v in values])
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self.size
+        if not 0 <= i < self.size:
+            raise IndexError('TuplesProduct index out of range')
+        chosen = []
+        for values in reversed(self.values):
+            i, j = divmod(i, len(values))
+            chosen.append(values[j])
+        return tuple(v for v, length in zip(reversed(chosen), self.lengths)
+                     for _ in range(length))
+
+
+class SampledTuples(object):
+    """
+    The tuples of the product of lists of values that match the conditions
+    linking their numbers, drawn at random without listing them.
+
+    The product is too big to check these conditions on each of its tuples:
+    instead, tuples are drawn from it, until one matches them. As each tuple
+    of the product is as likely to be drawn, so is each matching tuple. As
+    in TuplesProduct, the values of the i-th list are repeated lengths[i]
+    times in the tuples.
+    """
+
+    def __init__(self, values, lengths, distinct=False, constructible=None,
+                 description=''):
+        self.values = values
+        self.lengths = lengths
+        self.distinct = distinct
+        self.constructible = constructible
+        self.description = description
+        self.size = reduce(lambda x, y: x * y, [len(v) for v in values])
+
+    def draw(self):
+        """Return a matching tuple, drawn at random."""
+        for _ in range(SAMPLED_TUPLES_ATTEMPTS):
+            values = [random.choice(v) for v in self.values]
+            if self.distinct and len(set(values)) != len(values):
+                continue
+            t = tuple(v for v, length in zip(values, self.lengths)
+                      for _ in range(length))
+            if (self.constructible is not None
+                and (2 * max(t) < sum(t)) != self.constructible):
+                continue
+            return t
+        raise RuntimeError('No int tuple drawn from {} after {} attempts.\n'
+                           .format(self.description, SAMPLED_TUPLES_ATTEMPTS))
+
+
 class IntspansProduct(object):
     """Handle intspan-like ranges, possibly concatenated by ×"""
 
@@ -84,16 +190,73 @@ class IntspansProduct(object):
                                'but {} were expected.'
                                .format(len(spans), cartesianpower_spans,
                                        elt_nb))
-        for span in spans:
-            try:
-                intspan(span)
-            except ParseError:
-                raise ValueError('Syntax error found in this integers\' span: '
-                                 '{}, what should complain with intspan '
-                                 'syntax. See http://intspan.readthedocs.io/'
-                                 'en/latest/index.html'.format(span))
+        self.compiled = IntspansProduct._compile(tuple(spans))
         self.spans_str = spans
-        self.spans = [intspan(_) for _ in spans]
+        self.spans = list(self.compiled.spans)
+
+    @staticmethod
+    @lru_cache(maxsize=SPANS_CACHE_SIZE)
+    def _parse(span):
+        """The intspan of the str span. It must not be modified."""
+        try:
+            return intspan(span)
+        except ParseError:
+            raise ValueError('Syntax error found in this integers\' span: '
+                             '{}, what should complain with intspan '
+                             'syntax. See http://intspan.readthedocs.io/'
+                             'en/latest/index.html'.format(span))
+
+    @staticmethod
+    @lru_cache(maxsize=SPANS_CACHE_SIZE)
+    def _compile(spans_str):
+        """
+        Parse the spans of spans_str and precompute what the draws use.
+
+        :param spans_str: the spans, as str
+        :type spans_str: tuple
+        :rtype: CompiledSpans
+        """
+        spans = tuple(IntspansProduct._parse(s) for s in spans_str)
+        values = tuple(tuple(s) for s in spans)
+        lengths = tuple(len(v) for v in values)
+        order = tuple(sorted(range(len(spans)), key=lambda i: lengths[i]))
+        constructible = not_constructible = None
+        if all(values):
+            mini = tuple(v[0] for v in values)
+            maxi = tuple(v[-1] for v in values)
+            constructible = not_constructible = False
+            for i in range(len(spans)):
+                others = [j for j in range(len(spans)) if j != i]
+                values_to_test = [maxi[j] for j in others] + [mini[i]]
+                m = max(values_to_test)
+                values_to_test.remove(m)
+                if m < sum(values_to_test):
+                    constructible = True
+                if maxi[i] >= sum(mini[j] for j in others):
+                    not_constructible = True
+        else:
+            mini = maxi = None
+        return CompiledSpans(spans, values, lengths, mini, maxi, order,
+                             constructible, not_constructible)
+
+    @staticmethod
+    @lru_cache(maxsize=SPANS_CACHE_SIZE)
+    def _packed_spans(spans_str, dist_code):
+        """
+        The lists of spans to draw from, matching dist_code.
+
+        :param spans_str: the spans, as str
+        :type spans_str: tuple
+        :param dist_code: see _group_by_packs()
+        :type dist_code: str
+        :rtype: tuple
+        """
+        spans = IntspansProduct._compile(spans_str).spans
+        packs = IntspansProduct._filter_packs(
+            IntspansProduct._group_by_packs(spans, dist_code))
+        return tuple(tuple(line) for line in
+                     IntspansProduct._rebuild_spans_from_packs(packs,
+                                                               dist_code))
 
     def turn_to_query_conditions(self, nb_list=None, nb_modifiers=None):
         """Turn self to a SQLite query condition."""
@@ -323,10 +486,130 @@ class IntspansProduct(object):
         for kw in kwargs:
             matches = re.findall(regex_rule, kw)
             for value in matches:
+                kept = IntspansProduct._parse(kwargs[kw])
                 possibilities = [p for p in possibilities
-                                 if p % int(value) in intspan(kwargs[kw])]
+                                 if p % int(value) in kept]
         return possibilities, applied_conditions, result
 
+    @staticmethod
+    def _preprocess_either(spans, kwargs):
+        """Turn the either_nb1_nb2_in condition of kwargs into nb*_in."""
+        either = kwargs.get('either_nb1_nb2_in', None)
+        if either is not None:
+            if len(spans) == 1:
+                kwargs['nb1_in'] = [str(n) for n in either]
+            else:
+                nb1_possible = any(str(n) in [str(p) for p in spans[0]]
+                                   for n in either)
+                nb2_possible = any(str(n) in [str(p) for p in spans[1]]
+                                   for n in either)
+                if nb1_possible and nb2_possible:
+                    kwargs[random.choice(['nb1_in', 'nb2_in'])] \
+                        = [str(n) for n in either]
+                elif nb1_possible:
+                    kwargs['nb1_in'] = [str(n) for n in either]
+                else:
+                    # if still not possible, it will be detected later
+                    # (in the filtering function)
+                    kwargs['nb2_in'] = [str(n) for n in either]
+
+    @staticmethod
+    def _feasible_tuples(spans, **kwargs):
+        """
+        All tuples drawable from spans under the conditions of kwargs.
+
+        The result is computed once for given spans and conditions, and
+        reused for the next draws. The conditions on each number are checked
+        on its span, so that, unless some conditions link the numbers
+        (distinct values of a distcode, constructible), the tuples are those
+        of the product of the values left in each span, and are not listed
+        (see TuplesProduct). Otherwise, they are listed to be checked, unless
+        there are more than FEASIBLE_TUPLES_MAX of them: then they are drawn
+        at random until one matches (see SampledTuples).
+        """
+        IntspansProduct._preprocess_either(spans, kwargs)
+        conditions = {k: v for k, v in kwargs.items()
+                      if k in SOLVER_KEYWORDS or k.startswith('nb')}
+        return IntspansProduct._solve(tuple(str(s) for s in spans),
+                                      _freeze(sorted(conditions.items())))
+
+    @staticmethod
+    @lru_cache(maxsize=FEASIBLE_TUPLES_CACHE_SIZE)
+    def _solve(spans_str, conditions):
+        compiled = IntspansProduct._compile(spans_str)
+        spans = compiled.spans
+        kwargs = {k: list(v) if isinstance(v, tuple) else v
+                  for k, v in conditions}
+        constructible = kwargs.pop('constructible', None)
+        if constructible is not None and len(spans) < 2:
+            return None
+        dist_code = kwargs.get('code', None)
+        if dist_code is None:
+            packs_lengths = [1 for _ in spans]
+        else:
+            packs_lengths = [int(_) for _ in dist_code.split('_')]
+        all_conditions = []
+        # The conditions on each number are applied to its span at once
+        candidates = []
+        for i, span in enumerate(spans):
+            possibilities, applied_conditions, _ = \
+                IntspansProduct.__filter_possibilities(
+                    list(compiled.values[i]), i, span, len(spans), [],
+                    **kwargs)
+            if not possibilities:
+                raise RuntimeError('Impossible to draw an int tuple from '
+                                   '{} under these conditions: {}.\n'
+                                   .format(list(spans_str),
+                                           '; '.join(applied_conditions)))
+            all_conditions += [c for c in applied_conditions
+                               if c not in all_conditions]
+            candidates.append(possibilities)
+        # The numbers of a pack (see distcode) share the same value, that
+        # must match the conditions on each of them
+        packs_candidates = []
+        start = 0
+        for length in packs_lengths:
+            kept = [set(c) for c in candidates[start + 1:start + length]]
+            packs_candidates.append([v for v in candidates[start]
+                                     if all(v in k for k in kept)])
+            start += length
+        linking = []
+        if constructible is not None:
+            linking.append(f'constructible={constructible}')
+        if dist_code is not None:
+            linking.append(f'code={dist_code}')
+        # Without conditions linking the numbers (as the distinct values of
+        # the packs), the tuples are not listed
+        linked = (constructible is not None
+                  or (dist_code is not None and len(packs_lengths) > 1))
+        size = reduce(lambda x, y: x * y, [len(c) for c in packs_candidates])
+        if size and not linked:
+            return TuplesProduct(packs_candidates, packs_lengths)
+        if size > FEASIBLE_TUPLES_MAX:
+            return SampledTuples(
+                packs_candidates, packs_lengths,
+                distinct=dist_code is not None,
+                constructible=constructible,
+                description='{} under these conditions: {}'
+                .format(list(spans_str), '; '.join(all_conditions + linking)))
+        # Then the conditions linking the numbers are checked on each tuple
+        feasible = []
+        for values in product(*packs_candidates):
+            if dist_code is not None and len(set(values)) != len(values):
+                continue
+            t = tuple(v for v, length in zip(values, packs_lengths)
+                      for _ in range(length))
+            if (constructible is not None
+                and (2 * max(t) < sum(t)) != constructible):
+                continue
+            feasible.append(t)
+        if not feasible:
+            raise RuntimeError('Impossible to draw an int tuple from '
+                               '{} under these conditions: {}.\n'
+                               .format(list(spans_str),
+                                       '; '.join(all_conditions + linking)))
+        return tuple(feasible)
+
     @staticmethod
     def _random_draw_attempt(spans, failed_attempts, return_all=False,
                              **kwargs):
@@ -351,24 +634,7 @@ class IntspansProduct(object):
                 stick_on += [False] + [True for _ in range(p - 1)]
 
         # PREPROCESS "either..." tag before looping over the spans
-        either = kwargs.get('either_nb1_nb2_in', None)
-        if either is not None:
-            if len(spans) == 1:
-                kwargs['nb1_in'] = [str(n) for n in either]
-            else:
-                nb1_possible = any(str(n) in [str(p) for p in spans[0]]
-                                   for n in either)
-                nb2_possible = any(str(n) in [str(p) for p in spans[1]]
-                                   for n in either)
-                if nb1_possible and nb2_possible:
-                    kwargs[random.choice(['nb1_in', 'nb2_in'])] \
-                        = [str(n) for n in either]
-                elif nb1_possible:
-                    kwargs['nb1_in'] = [str(n) for n in either]
-                else:
-                    # if still not possible, it will be detected later
-                    # (in the filtering function)
-                    kwargs['nb2_in'] = [str(n) for n in either]
+        IntspansProduct._preprocess_either(spans, kwargs)
 
         # LOOP OVER THE SPANS
         for i, span in enumerate(spans):
@@ -417,37 +683,27 @@ class IntspansProduct(object):
         # CONSTRUCTIBILITY: early detection of impossible cases
         # (if the provided intspan does not allow to create a (not)
         # constructible tuple although it is required)
+        compiled = IntspansProduct._compile(tuple(str(s) for s in spans))
         constructible = kwargs.get('constructible', None)
         if constructible is not None:
-            spansL = [list(intspan(s)) for s in spans]
-            found = False
             if constructible:
-                for s in spansL:
-                    others = [_ for _ in spansL]
-                    others.remove(s)
-                    values_to_test = [max(_) for _ in others]
-                    values_to_test.append(min(s))
-                    m = max(values_to_test)
-                    values_to_test.remove(m)
-                    if m < sum(values_to_test):
-                        found = True
-                if not found:
+                if not compiled.constructible:
                     raise RuntimeError('Impossible to draw a constructible '
                                        'int tuple from {}.\n'
                                        .format([str(s) for s in spans]))
             else:
-                for s in spansL:
-                    others = [_ for _ in spansL]
-                    others.remove(s)
-                    if max(s) >= sum([min(_) for _ in others]):
-                        found = True
-                if not found:
+                if not compiled.not_constructible:
                     raise RuntimeError('Impossible to draw a not '
                                        'constructible int tuple from {}.\n'
                                        .format([str(s) for s in spans]))
-        # ATTEMPTS TO DRAW A RANDOM TUPLE
-        spans_lengths = [len(list(intspan(s))) for s in spans]
-        max_tries = min(1000, reduce(lambda x, y: x * y, spans_lengths))
+        # DRAW A RANDOM TUPLE AMONG ALL POSSIBLE ONES
+        if not return_all:
+            feasible = IntspansProduct._feasible_tuples(spans, **kwargs)
+            if isinstance(feasible, SampledTuples):
+                return tuple(sorted(feasible.draw()))
+            return tuple(sorted(random.choice(feasible)))
+        # OTHERWISE, ATTEMPTS TO DRAW A RANDOM TUPLE, KEEPING ALL POSSIBILITIES
+        max_tries = min(1000, reduce(lambda x, y: x * y, compiled.lengths))
         # each key: value of failed_attempts will be in the form:
         # tuple_that_leads_to_impossible_result: intspan(values)
         failed_attempts = defaultdict(intspan)
@@ -478,7 +734,7 @@ class IntspansProduct(object):
                                    '; '.join(applied_conditions)))
 
     def random_draw(self, return_all=False, do_shuffle=True, **kwargs):
-        spans = sorted([s for s in self.spans], key=lambda x: len(list(x)))
+        spans = [self.spans[i] for i in self.compiled.order]
         dist_code = kwargs.get('code', None)
         equilateral = kwargs.get('equilateral', None)
         equal_sides = kwargs.get('equal_sides', None)
@@ -503,9 +759,8 @@ class IntspansProduct(object):
                 dist_code = shared.distcodes_source.next(**query_conditions)[0]
         if dist_code is not None:
             kwargs.update({'code': dist_code})
-            spans_list = self._filter_packs(self._group_by_packs(spans,
-                                                                 dist_code))
-            spans_list = self._rebuild_spans_from_packs(spans_list, dist_code)
+            spans_list = [list(line) for line in self._packed_spans(
+                tuple(str(s) for s in spans), dist_code)]
             if do_shuffle:
                 random.shuffle(spans_list)
             for spans in spans_list:
@@ -524,6 +779,69 @@ class IntspansProduct(object):
             return self._random_draw_from_spans(spans, return_all=return_all,
                                                 **kwargs)
 
+    def feasible(self, **kwargs):
+        """
+        All the tuples random_draw() may return under these conditions.
+
+        With equal_sides (and not equilateral), the distcode random_draw()
+        would draw is not known, so all the tuples are listed.
+
+        :rtype: None (if there are more than FEASIBLE_TUPLES_MAX tuples to
+        list) or set
+        """
+        spans = [self.spans[i] for i in self.compiled.order]
+        dist_code = kwargs.get('code', None)
+        if kwargs.get('equilateral', None):
+            dist_code = kwargs['code'] = str(len(spans))
+        if dist_code is None:
+            spans_list = [spans]
+        else:
+            spans_list = self._packed_spans(tuple(str(s) for s in spans),
+                                            dist_code)
+        result = set()
+        for spans in spans_list:
+            try:
+                feasible = self._feasible_tuples(spans, **kwargs)
+            except RuntimeError:
+                continue
+            if (isinstance(feasible, SampledTuples)
+                or len(feasible) > FEASIBLE_TUPLES_MAX):
+                return None
+            result |= {tuple(sorted(t)) for t in feasible}
+        return result
+
+
+def _bind(value, params):
+    """
+    Return the placeholder of value in a query, and append value to params.
+
+    Values that are not numbers (e.g. the name of another column, like
+    'nb2') are returned as is, to be written in the query.
+    """
+    s = str(value)
+    if NUMBER.fullmatch(s):
+        params.append(float(s) if '.' in s else int(s))
+        return '?'
+    return s
+
+
+def _bind_str(value, params):
+    """Return the placeholder of value in a query, and append it as str."""
+    params.append(str(value))
+    return '?'
+
+
+def _freeze(kwargs):
+    """Turn kwargs into a hashable key (lists and dicts become tuples)."""
+    def freeze(value):
+        if isinstance(value, dict):
+            return tuple((k, freeze(v)) for k, v in value.items())
+        if isinstance(value, (list, tuple, set)):
+            return tuple(freeze(v) for v in value)
+        hash(value)
+        return value
+    return freeze(kwargs)
+
 
 class source(object):
     ##
@@ -540,41 +858,72 @@ class source(object):
         self.idcol = cols[0]
         self.valcols = cols[1:]
         self.language = kwargs.get('language', '')
-        self.db = kwargs.get('db', shared.db)
+        self.db = kwargs['db'] if 'db' in kwargs else shared.db
+        # Recently built queries: {kwargs: (query, parameters)}
+        self._statements = OrderedDict()
+        # The lowest and highest ids of the tables: {table: (min, max)}
+        self._id_spans = {}
+        # Number of times each fallback of _query_result() has been used
+        self.fallbacks = Counter()
+        # The ids of the rows, by their values (see lookup())
+        self._ids_by_values = None
+
+    @property
+    def pending(self):
+        """The timestamps and locks not written in the database yet."""
+        return write_behind(self.db)
 
     def _unlock(self):
         """Reset locked column of current table."""
         log = settings.dbg_logger.getChild('db_lock')
         log.debug('UNLOCK table: {}\n'.format(self.table_name))
-        self.db.execute("UPDATE {} SET locked = 0;".format(self.table_name))
+        self.pending.flush(self.table_name)
+        self.pending.clear(self.table_name, 'locked')
+        # The locks the flush could not write are reset too
+        self.pending.drop(self.table_name, 'locked')
+        self._count_reset(self.table_name)
+
+    def _twothirds_limit(self):
+        """
+        Number of rows _twothirds_reset() resets: two thirds of the
+        timestamped ones, once their pending timestamps are written.
+        """
+        self.pending.flush(self.table_name)
+        n = self.pending.count(self.table_name, 'drawDate')
+        lim = int(Number(Number('0.67') * Number(n)).rounded(Decimal('1')))
+        settings.dbg_logger.getChild('db')\
+            .debug(' 2/3 RESET: {}/{}\n'.format(lim, n))
+        return lim
 
     def _twothirds_reset(self):
         """Will reset only two thirds of the already timestamped entries."""
-        log = settings.dbg_logger.getChild('db')
-        n = tuple(self.db.execute('SELECT COUNT(*) from {} '
-                                  'WHERE drawDate != 0;'
-                                  .format(self.table_name)))[0][0]
-        lim = Number(Number('0.67') * Number(n)).rounded(Decimal('1'))
-        log.debug(' 2/3 RESET: {}/{}\n'.format(lim, n))
-        self.db.execute('UPDATE {table_name} SET drawDate=0 '
-                        'WHERE id IN '
-                        '(SELECT id FROM {table_name}'
-                        ' WHERE drawDate != 0'
-                        ' ORDER BY drawDate LIMIT {nb});'
-                        .format(table_name=self.table_name, nb=lim))
+        # The oldest timestamps are reset
+        self.pending.clear(self.table_name, 'drawDate',
+                           limit=self._twothirds_limit())
+        self._count_reset(self.table_name)
+
+    def _count_reset(self, table_name):
+        # The rows left, as counted before, are obsolete
+        self.pending.reset(table_name)
 
     ##
     #   @brief  Resets the drawDate of all table's entries (to 0)
     def _reset(self, **kwargs):
-        self.db.execute("UPDATE " + self.table_name + " SET drawDate = 0;")
+        self.pending.flush(self.table_name,
+                           kwargs.get('union', {}).get('table_name'))
+        # The updates the flush could not write are reset too
+        self.pending.clear(self.table_name, 'drawDate')
+        self.pending.drop(self.table_name, 'drawDate')
         if "lock_equal_products" in kwargs:
-            self.db.execute("UPDATE {} SET lock_equal_products = 0;"
-                            .format(self.table_name))
+            self.pending.clear(self.table_name, 'lock_equal_products')
+            self.pending.drop(self.table_name, 'lock_equal_products')
+        self._count_reset(self.table_name)
         if "union" in kwargs:
-            self.db.execute("UPDATE {} SET drawDate = 0;"
-                            .format(kwargs['union']['table_name']))
-        cmd = self._cmd(**kwargs)
-        if (not len(tuple(self.db.execute(cmd)))
+            self.pending.clear(kwargs['union']['table_name'], 'drawDate')
+            self.pending.drop(kwargs['union']['table_name'], 'drawDate')
+            self._count_reset(kwargs['union']['table_name'])
+        cmd, params = self._cmd(**kwargs)
+        if (not self._count(cmd, params)
             and kwargs.get('not_in', None) is not None):
             if 'nb1_min' in kwargs and 'nb1_max' in kwargs:
                 kwargs.update({'not_in': [str(n)
@@ -611,16 +960,75 @@ class source(object):
 
     ##
     #   @brief  Creates the language condition part of the query
-    def _language_part(self, **kwargs):
-        return "AND language = '" + self.language + "' " \
-            if self.language != ""\
-            else ""
+    def _language_part(self, params, **kwargs):
+        if self.language == "":
+            return ""
+        params.append(self.language)
+        return "AND language = ? "
+
+    def _not_in(self, **kwargs):
+        """The values of not_in that the query excludes indeed."""
+        updated_notin_list = list(kwargs.get('not_in', None) or [])
+        for c in self.valcols:
+            if c in kwargs and kwargs[c] in updated_notin_list:
+                updated_notin_list.remove(kwargs[c])
+        # prevails is used to not prevent numbers to be drawn
+        # twice in a row, like when drawing multiples of the same
+        # number, or drawing complements to the same number
+        # (e.g. 100)
+        # Take care it must contain a list of str (e.g. ['100'])
+        if "prevails" in kwargs:
+            for n in kwargs["prevails"]:
+                if n in updated_notin_list:
+                    updated_notin_list.remove(n)
+        return updated_notin_list
+
+    def excludes(self, t, **kwargs):
+        """
+        Tell whether the values t would not be drawn, because of not_in.
+
+        The values are compared as the query compares them: as numbers if
+        both are numbers, otherwise as strings.
+
+        :param t: the values of a row (as returned by next())
+        :type t: tuple
+        :rtype: bool
+        """
+        def same(value, x):
+            if NUMBER.fullmatch(str(value)) and NUMBER.fullmatch(str(x)):
+                return Decimal(str(value)) == Decimal(str(x))
+            return str(value) == str(x)
+        excluded = self._not_in(**kwargs)
+        return any(same(value, x) for value in t for x in excluded)
+
+    def release(self, t, **kwargs):
+        """
+        Cancel the draw of the row of values t, that will not be used.
+
+        Its timestamp and the locks it has set are cancelled (in the
+        write-behind buffer), so that it can be drawn again.
+
+        :param t: the values of a row (as returned by next())
+        :type t: tuple
+        """
+        cond = ' AND '.join('{} = ?'.format(c) for c in self.valcols)
+        tables = [self.table_name]
+        if 'union' in kwargs:
+            tables.append(kwargs['union']['table_name'])
+        for table_name in tables:
+            self.pending.add(table_name, 'drawDate',
+                             self._ids(table_name, cond, [str(v) for v in t]),
+                             0, idcol=self.idcol)
+            self._count_reset(table_name)
+        self._lock(t, value=0, **kwargs)
 
     ##
     #   @brief  Creates the conditions of the query, from the given kwargs
     #           Some special checks are allowed, like nb1_min <= ...
     #           and nb1_max >= ...
-    def _kw_conditions(self, wrap_in_AND=True, **kwargs):
+    #           The values are not written in the conditions, but replaced
+    #           by placeholders (?) and appended to params, in the same order
+    def _kw_conditions(self, params, wrap_in_AND=True, **kwargs):
         result = ""
 
         def hook(i):
@@ -637,88 +1045,84 @@ class source(object):
                 kn += 1
             elif kw.endswith('_mod'):
                 k = kw[:-len('_mod')]
-                result += next(hook(kn)) + k + " % " + str(kwargs[kw]) \
-                    + " = 0 "
+                result += next(hook(kn)) + k + " % " \
+                    + _bind(kwargs[kw], params) + " = 0 "
                 kn += 1
             elif kw.endswith('_notmod'):
                 k = kw[:-7]
-                result += next(hook(kn)) + k + " % " + str(kwargs[kw]) \
-                    + " != 0 "
+                result += next(hook(kn)) + k + " % " \
+                    + _bind(kwargs[kw], params) + " != 0 "
                 kn += 1
             elif kw == "triangle_inequality":
                 common_nb, t1, t2 = kwargs[kw]
-                mini = str(abs(t1 - t2) + 1)  # we avoid "too flat" triangles
-                maxi = str(t1 + t2 - 1)
+                mini = abs(t1 - t2) + 1  # we avoid "too flat" triangles
+                maxi = t1 + t2 - 1
                 result += next(hook(kn)) + ' ( '\
-                    '( nb1 = ' + str(common_nb) + ' '\
-                    'AND ( nb2 >= ' + mini + ' AND nb2 <= ' + maxi + ' ) '\
+                    '( nb1 = ' + _bind(common_nb, params) + ' '\
+                    'AND ( nb2 >= ' + _bind(mini, params) \
+                    + ' AND nb2 <= ' + _bind(maxi, params) + ' ) '\
                     ') OR '\
-                    '( nb2 = ' + str(common_nb) + ' '\
-                    'AND ( nb1 >= ' + mini + ' AND nb1 <= ' + maxi + ' ) '\
+                    '( nb2 = ' + _bind(common_nb, params) + ' '\
+                    'AND ( nb1 >= ' + _bind(mini, params) \
+                    + ' AND nb1 <= ' + _bind(maxi, params) + ' ) '\
                     ')) '
                 kn += 1
             elif (kw.startswith('info_')
                   or kw in ['prevails', 'union', 'table_name', 'enablereset',
-                            'no_order_by_random', 'timestamp', 'timestamped']):
+                            'timestamp', 'timestamped']):
                 pass
             elif kw == "lock_equal_products":
-                result += next(hook(kn)) + " lock_equal_products = 0 "
+                result += next(hook(kn)) + " lock_equal_products = 0 " \
+                    + self._not_pending_part(params, 'lock_equal_products',
+                                             **kwargs)
                 kn += 1
-            elif kw in ["lock_equal_coeffs", "lock_equal_contexts",
-                        "lock_equal_types"]:
+            elif kw in LOCK_KEYWORDS:
                 if "locked = " not in result:
-                    result += next(hook(kn)) + " locked = 0 "
+                    result += next(hook(kn)) + " locked = 0 " \
+                        + self._not_pending_part(params, 'locked', **kwargs)
                     kn += 1
             elif kw.endswith("_to_check"):
                 k = kw[:-9]
                 result += next(hook(kn)) + k + "_min" + " <= " \
-                    + str(kwargs[kw]) + " "
+                    + _bind(kwargs[kw], params) + " "
                 result += ' AND ' + k + "_max" + " >= " \
-                    + str(kwargs[kw]) + " "
+                    + _bind(kwargs[kw], params) + " "
                 kn += 1
             elif kw.endswith("_min"):
                 k = kw[:-4]
-                result += next(hook(kn)) + k + " >= " + str(kwargs[kw]) + " "
+                result += next(hook(kn)) + k + " >= " \
+                    + _bind(kwargs[kw], params) + " "
                 kn += 1
             elif kw.endswith("_max"):
                 k = kw[:-4]
-                result += next(hook(kn)) + k + " <= " + str(kwargs[kw]) + " "
+                result += next(hook(kn)) + k + " <= " \
+                    + _bind(kwargs[kw], params) + " "
                 kn += 1
             elif kw == "not_in":
                 if kwargs["not_in"] is not None:
-                    updated_notin_list = list(kwargs[kw])
-                    for c in self.valcols:
-                        if c in kwargs and kwargs[c] in updated_notin_list:
-                            updated_notin_list.remove(kwargs[c])
-                    # prevails is used to not prevent numbers to be drawn
-                    # twice in a row, like when drawing multiples of the same
-                    # number, or drawing complements to the same number
-                    # (e.g. 100)
-                    # Take care it must contain a list of str (e.g. ['100'])
-                    if "prevails" in kwargs:
-                        for n in kwargs["prevails"]:
-                            if n in updated_notin_list:
-                                updated_notin_list.remove(n)
+                    updated_notin_list = self._not_in(**kwargs)
                     if len(updated_notin_list):
                         for i, c in enumerate(self.valcols):
                             result += next(hook(kn + i)) + c + " NOT IN ( " \
-                                + ", "\
-                                .join(str(x) if is_number(x)
-                                      else "'{}'".format(x)
-                                      for x in updated_notin_list) + " ) "
+                                + ", ".join(_bind(x, params)
+                                            if is_number(x)
+                                            else _bind_str(x, params)
+                                            for x in updated_notin_list) \
+                                + " ) "
                             kn += 1
             elif kw.startswith("either_") and kw.endswith("_in"):
                 if kwargs[kw] is not None:
                     k = kw.split(sep='_')[1:-1]
-                    result += next(hook(kn)) + " ( " + k[0] + " IN ( " + ", "\
-                        .join(str(x) for x in kwargs[kw]) + " ) OR "\
-                        + k[1] + " IN ( " + ", "\
-                        .join(str(x) for x in kwargs[kw]) + " ) ) "
+                    result += next(hook(kn)) + " ( " + k[0] + " IN ( " \
+                        + ", ".join(_bind(x, params) for x in kwargs[kw]) \
+                        + " ) OR " + k[1] + " IN ( " \
+                        + ", ".join(_bind(x, params) for x in kwargs[kw]) \
+                        + " ) ) "
                     kn += 1
             elif kw.endswith("_in"):
                 k = kw[:-3]
-                result += next(hook(kn)) + k + " IN ( " + ", "\
-                    .join(str(x) for x in kwargs[kw]) + " ) "
+                result += next(hook(kn)) + k + " IN ( " \
+                    + ", ".join(_bind(x, params) for x in kwargs[kw]) + " ) "
                 kn += 1
             elif kw == 'rectangle':
                 if any([kw.startswith('nb2') for kw in kwargs]):
@@ -733,10 +1137,9 @@ class source(object):
                 kn += 1
             elif re.findall(r'nb(\d)_mod(\d+)_ge', kw):
                 for match in re.findall(r'nb(\d)_mod(\d+)_ge', kw):
-                    result += "{} nb{} % {} >= {} ".format(next(hook(kn)),
-                                                           match[0],
-                                                           match[1],
-                                                           kwargs[kw])
+                    result += "{} nb{} % {} >= {} "\
+                        .format(next(hook(kn)), match[0], match[1],
+                                _bind(kwargs[kw], params))
                     kn += 1
             elif re.findall(r'nb(\d)_mod(\d+)_range', kw):
                 for match in re.findall(r'nb(\d)_mod(\d+)_range', kw):
@@ -766,25 +1169,28 @@ class source(object):
                 elif kw.endswith('_neq'):
                     rel_sign = " != "
                     key = kw[:-4]
-                simple_quote = ""
+                quoted = False
                 try:  # automatic detection of integers
                     int(kwargs[kw])
                 except ValueError as excinfo:
                     if ('invalid literal for int() with base 10'
                         in str(excinfo)):
-                        simple_quote = "'"
+                        quoted = True
                     else:
                         raise
                 # This automatic detection in not enough, since int('1_1_1')
                 # does not raise an error.
                 if any([c not in '0123456789.' for c in str(kwargs[kw])]):
-                    simple_quote = "'"
+                    quoted = True
                 # EXCEPTION, if the number compared to is another column
                 # then do not quote it
                 if str(kwargs[kw]).startswith('nb'):
-                    simple_quote = ""
-                result += next(hook(kn)) + key + rel_sign + simple_quote \
-                    + str(kwargs[kw]) + simple_quote + " "
+                    value = str(kwargs[kw])
+                elif quoted:
+                    value = _bind_str(kwargs[kw], params)
+                else:
+                    value = _bind(kwargs[kw], params)
+                result += next(hook(kn)) + key + rel_sign + value + " "
                 kn += 1
 
         if wrap_in_AND:
@@ -794,126 +1200,381 @@ class source(object):
         return fmt.format(result) if result else ''
 
     ##
-    #   @brief  Concatenates the different parts of the query
+    #   @brief  Concatenates the different parts of the query, that selects
+    #           all the rows that may be drawn (see _draw() for the drawing)
+    #           Return the query and its parameters. The last built queries
+    #           are kept, to be reused as is if the same kwargs come again.
     def _cmd(self, **kwargs):
+        try:
+            key = _freeze(kwargs)
+        except TypeError:  # unhashable value, do not cache
+            key = None
+        if key in self._statements:
+            self._statements.move_to_end(key)
+            return self._statements[key]
+        params = []
+        query = (self._build_cmd(params, **kwargs), tuple(params))
+        if key is not None:
+            self._statements[key] = query
+            if len(self._statements) > STATEMENTS_CACHE_SIZE:
+                self._statements.popitem(last=False)
+        return query
+
+    def _build_cmd(self, params, **kwargs):
         if 'union' in kwargs:
             kwargs2 = kwargs.pop('union')
-            return "SELECT * FROM (" \
-                + self._cmd(no_order_by_random=True, **kwargs) \
-                + " UNION " \
-                + self._cmd(no_order_by_random=True, **kwargs2) \
-                + ") ORDER BY random() LIMIT 1;"
+            return "SELECT * FROM (" + self._build_cmd(params, **kwargs) \
+                + " UNION " + self._build_cmd(params, **kwargs2) + ")"
         else:
-            order_by_random = " ORDER BY random() LIMIT 1;"
-            if 'no_order_by_random' in kwargs:
-                order_by_random = ""
-            ts_condition = " WHERE drawDate = 0 "
+            # The rows whose timestamp is pending count as timestamped
+            table_name = kwargs.get('table_name', self.table_name)
+            params.append(Pending(table_name, 'drawDate'))
             if kwargs.get('timestamped', False):
-                ts_condition = " WHERE drawDate != 0 "
+                ts_condition = " WHERE ( drawDate != 0 OR {} IN {} ) "\
+                    .format(self.idcol, PENDING_IDS)
+            else:
+                ts_condition = " WHERE drawDate = 0 AND {} NOT IN {} "\
+                    .format(self.idcol, PENDING_IDS)
             return self._select_part(**kwargs) + ts_condition \
-                + self._language_part(**kwargs) \
-                + self._kw_conditions(**kwargs) \
-                + order_by_random
+                + self._language_part(params, **kwargs) \
+                + self._kw_conditions(params, **kwargs)
+
+    def _not_pending_part(self, params, column, **kwargs):
+        """Condition excluding the rows whose column's update is pending."""
+        params.append(Pending(kwargs.get('table_name', self.table_name),
+                              column))
+        return "AND {} NOT IN {} ".format(self.idcol, PENDING_IDS)
+
+    def _share(self, cmd, params):
+        """
+        The query cmd, restricted to the share of the rows of this process.
+
+        Only in a process building a chunk of questions: see
+        shared.share_draws().
+        """
+        i, n = shared.draws_share
+        return ('SELECT * FROM (' + cmd + ') WHERE {} % ? = ?'
+                .format(self.idcol), params + (n, i))
+
+    def _count(self, cmd, params=()):
+        """Number of rows selected by cmd."""
+        return tuple(self.db.execute('SELECT COUNT(*) FROM (' + cmd + ');',
+                                     self.pending.bind(params)))[0][0]
+
+    def _draw(self, cmd, params=(), n=None):
+        """
+        Return a row selected by cmd, chosen at random (or () if none).
+
+        Instead of sorting all rows by random() to keep the first one, the
+        rows are counted (unless their number n is given), then only the one
+        at a random position is read. Each row has the same probability to
+        be drawn.
+        """
+        if n is None:
+            n = self._count(cmd, params)
+        if not n:
+            return ()
+        return tuple(self.db.execute(cmd + ' LIMIT 1 OFFSET ?;',
+                                     self.pending.bind(params)
+                                     + (random.randrange(n), )))
+
+    def _rows_left(self, cmd, params, **kwargs):
+        """
+        Number of rows selected by cmd, and the version of the table.
+
+        The last count of the rows of cmd is reused, if it is not obsolete.
+        The counts are kept per version of the table, and shared by the
+        sources of the table on the same connection (see _keep_count()).
+        Drawing rows removes them from the rows cmd selects, so the count is
+        decreased (see _keep_count()), instead of counting again at next
+        draw. Other draws from the same table may remove rows too: the count
+        may then be too high, and a draw finding less rows than counted
+        means the rows must be counted again. A count that may be too low
+        (after a reset, a flush, or a write from another process, see
+        WriteBehind.version()) is not reused, as the last rows could not be
+        drawn; the version is only checked when there is a count to reuse.
+        The queries selecting the timestamped rows, or another table's rows,
+        are always counted.
+        """
+        if kwargs.get('timestamped', False) or 'union' in kwargs:
+            return self._count(cmd, params), None
+        version, counts = self.pending.counts.get(self.table_name,
+                                                  (None, {}))
+        if ((cmd, params) in counts
+            and self.pending.up_to_date(self.table_name, version)):
+            return counts.pop((cmd, params)), version
+        version = self.pending.version(self.table_name)
+        return self._count(cmd, params), version
+
+    def _keep_count(self, cmd, params, n, version, **kwargs):
+        """
+        Keep the number n of rows left, to be reused by _rows_left().
+
+        The counts kept for another version of the table are dropped.
+        """
+        if kwargs.get('timestamped', False) or 'union' in kwargs:
+            return
+        kept = self.pending.counts.get(self.table_name)
+        if kept is None or kept[0] != version:
+            kept = (version, OrderedDict())
+            self.pending.counts[self.table_name] = kept
+        kept[1][(cmd, params)] = n
+        if len(kept[1]) > STATEMENTS_CACHE_SIZE:
+            kept[1].popitem(last=False)
+
+    def _id_span(self, table_name):
+        """The lowest and highest ids of table_name's rows (read once)."""
+        if table_name not in self._id_spans:
+            self._id_spans[table_name] = tuple(self.db.execute(
+                'SELECT MIN({idcol}), MAX({idcol}) FROM {table};'
+                .format(idcol=self.idcol, table=table_name)))[0]
+        return self._id_spans[table_name]
+
+    def _probe(self, cmd, params, n, **kwargs):
+        """
+        Return a row selected by cmd, found at a random id (or () if none).
+
+        Instead of reading the rows of cmd up to a random position (see
+        _draw()), random ids of the table are tried, each one read through
+        the primary key, until one of them is selected by cmd. As each id
+        is as likely to be tried, each row has the same probability to be
+        drawn. It is only done if the n rows of cmd are numerous enough,
+        compared to the ids' span, to be found in PROBES tries, and not for
+        the union queries (whose rows come from two tables).
+        """
+        if not n or 'union' in kwargs:
+            return ()
+        low, high = self._id_span(kwargs.get('table_name', self.table_name))
+        if low is None or high - low + 1 > PROBES_SPAN * n:
+            return ()
+        probe = 'SELECT * FROM (' + cmd + ') WHERE {} = ?;'.format(self.idcol)
+        params = self.pending.bind(params)
+        for _ in range(PROBES):
+            qr = tuple(self.db.execute(probe,
+                                       params + (random.randint(low, high), )))
+            if qr:
+                return qr
+        return ()
+
+    def _counted_draw(self, cmd, params, **kwargs):
+        """
+        Same as _draw(), but reusing the last count of the rows of cmd.
+
+        The row is looked for at random ids first (see _probe()): if none
+        is found, it is read at a random position, as in _draw(). Either
+        way, each row has the same probability to be drawn.
+        """
+        n, version = self._rows_left(cmd, params, **kwargs)
+        qr = (self._probe(cmd, params, n, **kwargs)
+              or self._draw(cmd, params, n=n))
+        if not qr and n:  # the count was too high
+            n = self._count(cmd, params)
+            qr = self._draw(cmd, params, n=n)
+        if qr and kwargs.get('timestamp', True):
+            n -= 1
+        self._keep_count(cmd, params, n, version, **kwargs)
+        return qr
+
+    def _fallback(self, name):
+        """Count (and log) the use of a fallback of _query_result()."""
+        self.fallbacks[name] += 1
+        if shared.draws_profiler is not None:
+            shared.draws_profiler.fallback(self.table_name, name)
+        settings.dbg_logger.getChild('db_fallbacks')\
+            .debug('{} of {} (used {} times)'
+                   .format(name, self.table_name, self.fallbacks[name]))
+
+    def _draw_many(self, cmd, params, n, count=None):
+        """
+        Return n rows selected by cmd, chosen at random, in random order.
+
+        Less rows are returned if there are not enough of them. As in
+        _draw(), the rows are counted (unless their number count is given),
+        then only the ones at n random positions are read.
+        """
+        if count is None:
+            count = self._count(cmd, params)
+        positions = random.sample(range(1, count + 1), min(n, count))
+        if not positions:
+            return []
+        rows = [row[:-1] for row in self.db.execute(
+            'SELECT * FROM (SELECT *, row_number() OVER () AS position '
+            'FROM (' + cmd + ')) '
+            'WHERE position IN (SELECT value FROM json_each(?));',
+            self.pending.bind(params) + (json.dumps(positions), ))]
+        random.shuffle(rows)
+        return rows
+
+    def _needed_fallback(self, **kwargs):
+        """
+        The one fallback of _query_result() that frees rows of the query.
+
+        When no row of the query is left, this is found by counting the
+        rows each fallback would free, instead of trying one fallback after
+        the other, drawing again after each one:
+
+        - 'unlock', if some rows are only excluded by their lock (only in the
+          tables whose rows are locked, see _unlock());
+        - 'twothirds_reset', if some of the rows _twothirds_reset() would
+          reset are selected by the query (once unlocked, if the table is
+          unlocked too);
+        - 'reset' otherwise, and always for the queries on two tables.
+
+        The union queries and the timestamped ones are reset at once.
+
+        :rtype: None (if enablereset is False and no row is locked) or str
+        """
+        unlocked = {k: v for k, v in kwargs.items() if k not in LOCK_KEYWORDS}
+        if self.table_name in LOCKED_TABLES and unlocked != kwargs:
+            if self._count(*self._cmd(**unlocked)):
+                return 'unlock'
+        else:
+            unlocked = kwargs
+        if not kwargs.get('enablereset', True):
+            return None
+        if 'union' in kwargs or kwargs.get('timestamped', False):
+            return 'reset'
+        cmd, params = self._cmd(**dict(unlocked, timestamped=True))
+        oldest, oldest_params = self.pending.oldest(self.table_name,
+                                                    'drawDate',
+                                                    self._twothirds_limit())
+        if tuple(self.db.execute('SELECT COUNT(*) FROM (' + cmd + ') '
+                                 'WHERE {} IN {};'.format(self.idcol, oldest),
+                                 self.pending.bind(params)
+                                 + oldest_params))[0][0]:
+            return 'twothirds_reset'
+        return 'reset'
 
     ##
     #   @brief  Executes the query. If no result, resets the table and executes
     #           the query again. Returns the query's result.
-    def _query_result(self, cmd, **kwargs):
+    def _query_result(self, cmd, params, **kwargs):
         log = settings.dbg_logger.getChild('db')
-        log.debug(cmd)
-        enablereset = kwargs.get('enablereset', True)
-        qr = tuple(self.db.execute(cmd))
-        if (not len(qr)
-            and self.table_name in ['deci_int_triples_for_prop',
-                                    'mini_pb_prop_wordings',
-                                    'mini_pb_time_wordings']):
+        log.debug('{} {}'.format(cmd, params))
+        # When no row is known to be left, no query is sent before the
+        # fallbacks
+        qr = ()
+        if shared.draws_share is not None:
+            qr = self._counted_draw(*self._share(cmd, params), **kwargs)
+        if not len(qr):
+            qr = self._counted_draw(cmd, params, **kwargs)
+        if len(qr):
+            log.debug('Query result = {}\n'.format(qr))
+            return qr
+        fallback = self._needed_fallback(**kwargs)
+        if fallback is None:
+            log.debug('Query result = {}\n'.format(qr))
+            return qr
+        self._fallback(fallback)
+        if fallback == 'unlock' or (self.table_name in LOCKED_TABLES
+                                    and any(k in kwargs
+                                            for k in LOCK_KEYWORDS)):
             self._unlock()
-            qr = tuple(self.db.execute(cmd))
-        if not len(qr) and enablereset:
+        if fallback == 'twothirds_reset':
             self._twothirds_reset()
-            qr = tuple(self.db.execute(cmd))
-            if not len(qr):
-                log.debug('FULL RESET of {}\n'.format(self.table_name))
-                kwargs = self._reset(**kwargs)
-                cmd1 = self._cmd(**kwargs)
-                qr = tuple(self.db.execute(cmd1))
+        if fallback != 'reset':
+            qr = self._counted_draw(cmd, params, **kwargs)
+            if len(qr) or not kwargs.get('enablereset', True):
+                log.debug('Query result = {}\n'.format(qr))
+                return qr
+            # Rows counted may have been drawn by another process meanwhile
+            self._fallback('reset')
+        log.debug('FULL RESET of {}\n'.format(self.table_name))
+        kwargs = self._reset(**kwargs)
+        cmd1, params1 = self._cmd(**kwargs)
+        qr = self._counted_draw(cmd1, params1, **kwargs)
+        if not len(qr):
+            if ' nb1 ' in cmd1 and ' nb2 ' in cmd1:
+                self._fallback('swapped_columns')
+                cmd2 = cmd1.replace(' nb1 ', 'TEMP') \
+                    .replace(' nb2 ', ' nb1 ') \
+                    .replace('TEMP', ' nb2 ')
+                cmd2 = cmd2.replace(' nb1_', 'TEMP') \
+                    .replace(' nb2_', ' nb1_') \
+                    .replace('TEMP', ' nb2_')
+                qr = self._draw(cmd2, params1)
                 if not len(qr):
-                    if ' nb1 ' in cmd1 and ' nb2 ' in cmd1:
-                        cmd2 = cmd1.replace(' nb1 ', 'TEMP') \
-                            .replace(' nb2 ', ' nb1 ') \
-                            .replace('TEMP', ' nb2 ')
-                        cmd2 = cmd2.replace(' nb1_', 'TEMP') \
-                            .replace(' nb2_', ' nb1_') \
-                            .replace('TEMP', ' nb2_')
-                        qr = tuple(self.db.execute(cmd2))
-                        if not len(qr):
-                            logm = settings.mainlogger
-                            logm.error('Query result is empty:\nQUERY1\n{}\n'
-                                       'QUERY2\n{}\nQUERY3\n{}\n'
-                                       .format(cmd, cmd1, cmd2))
+                    self._fallback('failed')
+                    logm = settings.mainlogger
+                    logm.error('Query result is empty:\nQUERY1\n{}\n'
+                               'QUERY2\n{}\nQUERY3\n{}\n'
+                               'PARAMETERS\n{}\n{}\n'
+                               .format(cmd, cmd1, cmd2,
+                                       params, params1))
         log.debug('Query result = {}\n'.format(qr))
         return qr
 
+    ##
+    #   @brief  Returns the ids of the rows of table matching the condition
+    def _ids(self, table_name, cond, params):
+        return [row[0] for row in self.db.execute(
+            "SELECT " + self.idcol + " FROM " + table_name
+            + " WHERE " + cond + ";", params)]
+
     ##
     #   @brief  Set the drawDate to datetime() in all entries where col_name
-    #           has a value of col_match.
+    #           has a value of col_match. The update is only recorded in the
+    #           write-behind buffer, that will write it later.
     def _timestamp(self, kwconditions, **kwargs):
-        cond = self._kw_conditions(wrap_in_AND=False, **kwconditions)
+        params = []
+        cond = self._kw_conditions(params, wrap_in_AND=False, **kwconditions)
         log = settings.dbg_logger.getChild('db_timestamp')
-        log.debug('TIMESTAMP condition={}\n'.format(cond))
-        self.db.execute(
-            "UPDATE " + self.table_name
-            + " SET drawDate = strftime('%Y-%m-%d %H:%M:%f')"
-            + " WHERE " + cond + ";")
+        log.debug('TIMESTAMP condition={} {}\n'.format(cond, params))
+        tables = [self.table_name]
         if 'union' in kwargs:
-            self.db.execute(
-                "UPDATE " + kwargs['union']['table_name']
-                + " SET drawDate = strftime('%Y-%m-%d %H:%M:%f')"
-                + " WHERE " + cond + ";")
+            tables.append(kwargs['union']['table_name'])
+        date = now()
+        for table_name in tables:
+            if list(kwconditions) == [self.idcol]:
+                ids = [int(kwconditions[self.idcol])]
+            else:
+                ids = self._ids(table_name, cond, params)
+            self.pending.add(table_name, 'drawDate', ids, date,
+                             idcol=self.idcol)
 
     ##
-    #   @brief  Will 'lock' some entries
-    def _lock(self, t, **kwargs):
+    #   @brief  Will 'lock' some entries (the locks are recorded in the
+    #           write-behind buffer, like the timestamps); value=0 unlocks
+    #           them.
+    def _lock(self, t, value=1, **kwargs):
         log = settings.dbg_logger.getChild('db_lock')
         if 'lock_equal_products' in kwargs:
             if t in kwargs['info_lock']:
                 log.debug('LOCK: products equal to {} in {}\n'
                           .format(str(t[0] * t[1]), self.table_name))
-                self.db.execute(
-                    "UPDATE " + self.table_name
-                    + " SET lock_equal_products = 1"
-                    + " WHERE nb1 = '" + str(t[0])
-                    + "' and nb2 = '" + str(t[1]) + "';")
-                for couple in kwargs['info_lock'][t]:
-                    self.db.execute(
-                        "UPDATE " + self.table_name
-                        + " SET lock_equal_products = 1"
-                        + " WHERE nb1 = '" + str(couple[0])
-                        + "' and nb2 = '" + str(couple[1]) + "';")
+                couples = [t] + list(kwargs['info_lock'][t])
+                ids = self._ids(self.table_name,
+                                " OR ".join(["( nb1 = ? and nb2 = ? )"]
+                                            * len(couples)),
+                                [str(n) for couple in couples
+                                 for n in couple[0:2]])
+                self.pending.add(self.table_name, 'lock_equal_products', ids,
+                                 value, idcol=self.idcol)
         if ('lock_equal_coeffs' in kwargs
             and self.table_name == 'deci_int_triples_for_prop'):
             log.debug('LOCK: coeff {} in {}\n'
                       .format(str(t[0]), self.table_name))
-            self.db.execute(
-                "UPDATE {table_name} SET locked = 1 WHERE coeff = '{coeff}';"
-                .format(table_name=self.table_name, coeff=str(t[0])))
+            self.pending.add(self.table_name, 'locked',
+                             self._ids(self.table_name, "coeff = ?",
+                                       (str(t[0]), )),
+                             value, idcol=self.idcol)
         if ('lock_equal_contexts' in kwargs
             and self.table_name in ['mini_pb_prop_wordings',
                                     'mini_pb_time_wordings']):
             log.debug('LOCK: context "{}" in {}\n'
                       .format(str(t[0]), self.table_name))
-            self.db.execute(
-                "UPDATE {table_name} SET locked = 1 "
-                "WHERE wording_context = '{wcontext}';"
-                .format(table_name=self.table_name, wcontext=str(t[0])))
+            self.pending.add(self.table_name, 'locked',
+                             self._ids(self.table_name, "wording_context = ?",
+                                       (str(t[0]), )),
+                             value, idcol=self.idcol)
         if ('lock_equal_types' in kwargs
             and self.table_name == 'mini_pb_time_wordings'):
             log.debug('LOCK: type "{}" in {}\n'
                       .format(str(t[1]), self.table_name))
-            self.db.execute(
-                "UPDATE {table_name} SET locked = 1 "
-                "WHERE type = '{wtype}';"
-                .format(table_name=self.table_name, wtype=str(t[1])))
+            self.pending.add(self.table_name, 'locked',
+                             self._ids(self.table_name, "type = ?",
+                                       (str(t[1]), )),
+                             value, idcol=self.idcol)
 
     ##
     #   @brief  Synonym of self.next(), but makes the source an Iterator.
@@ -923,18 +1584,148 @@ class source(object):
     ##
     #   @brief  Handles the choice of the next value to return from the
     #           database
+    @profiled('tables', lambda src, *args, **kwargs: src.table_name)
     def next(self, **kwargs):
-        sql_query = self._cmd(**kwargs)
-        query_result = self._query_result(sql_query, **kwargs)
+        sql_query, params = self._cmd(**kwargs)
+        query_result = self._query_result(sql_query, params, **kwargs)
         if not len(query_result):
             raise RuntimeError('No result from database query. Command was:\n'
-                               + str(sql_query))
-        t = query_result[0]
+                               + str(sql_query) + '\nParameters were:\n'
+                               + str(params))
+        return self._drawn(query_result[0], **kwargs)
+
+    ##
+    #   @brief  Timestamps and locks the drawn row t, and returns its values
+    def _drawn(self, t, **kwargs):
         if kwargs.get('timestamp', True):
             self._timestamp({str(self.idcol): str(t[0])}, **kwargs)
         self._lock(t[1:len(t)], **kwargs)
         return t[1:len(t)]
 
+    def lookup(self, values):
+        """
+        The id of the row holding values, and whether it has been drawn.
+
+        The values of the rows are read once. The ids of the drawn rows are
+        read from the state of the rows (see WriteBehind.written_ids()),
+        shared by the sources of the table on the same connection, and read
+        again when they may have changed (see WriteBehind.version()); the
+        pending timestamps are taken into account.
+
+        :param values: the values of the columns of the source (but its id)
+        :type values: tuple
+        :rtype: None (if no row holds values) or tuple (id, bool)
+        """
+        if self._ids_by_values is None:
+            self._ids_by_values = {
+                tuple(row[1:]): row[0]
+                for row in self.db.execute('SELECT {} FROM {};'
+                                           .format(', '.join(self.allcols),
+                                                   self.table_name))}
+        i = self._ids_by_values.get(tuple(values))
+        if i is None:
+            return None
+        pending = self.pending.rows.get((self.table_name, 'drawDate'), {})
+        if i in pending:
+            return (i, bool(pending[i]))
+        shared_drawn = self.pending.drawn_ids.get(self.table_name)
+        if (shared_drawn is None
+            or not self.pending.up_to_date(self.table_name,
+                                           shared_drawn[0])):
+            shared_drawn = (self.pending.version(self.table_name),
+                            set(self.pending.written_ids(self.table_name,
+                                                         'drawDate')))
+            self.pending.drawn_ids[self.table_name] = shared_drawn
+        return (i, i in shared_drawn[1])
+
+    def _locked_ids(self, lock_columns, ids):
+        """The rows, among ids, that are locked in the database."""
+        return self._ids(self.table_name,
+                         '( {} ) AND {} IN {}'
+                         .format(' OR '.join('{} != 0'.format(col)
+                                             for col in lock_columns),
+                                 self.idcol, PENDING_IDS),
+                         (json.dumps(ids), ))
+
+    @profiled('tables', lambda src, *args, **kwargs: src.table_name)
+    def next_many(self, n, distinct_on=None, **kwargs):
+        """
+        Return n values drawn from the database, as n calls to next() would.
+
+        The n rows are drawn in one query. The rows that must be rejected
+        (because they are locked by a previous row, or because of
+        distinct_on) are replaced by drawing again; if none of them can be
+        kept, all the remaining rows are read. If there are not enough rows
+        left, the missing values are drawn by next(), that resets the table
+        if necessary. In a process building a chunk of questions, the rows
+        are only drawn at once from its share (see shared.share_draws()).
+
+        :param n: the number of values to return
+        :type n: int
+        :param distinct_on: the column (or the list of columns) in which
+        no value may be drawn twice
+        :type distinct_on: None or str or list
+        :rtype: list
+        """
+        if isinstance(distinct_on, str):
+            distinct_on = [distinct_on]
+        positions = [self.allcols.index(col) for col in distinct_on or []]
+        lock_columns = []
+        if 'lock_equal_products' in kwargs:
+            lock_columns.append('lock_equal_products')
+        if any(kw in kwargs for kw in LOCK_KEYWORDS):
+            lock_columns.append('locked')
+        drawn_ids = set()
+        # The rows locked during the whole batch, including the locks that
+        # are not pending any more, once written
+        locked = set()
+        flushes = self.pending.flushes
+        seen = {i: set() for i in positions}
+        result = []
+        exhaustive = False
+        while len(result) < n:
+            cmd, params = self._cmd(**kwargs)
+            if shared.draws_share is not None:
+                cmd, params = self._share(cmd, params)
+            count, version = self._rows_left(cmd, params, **kwargs)
+            if exhaustive:  # no row could be kept from the last round
+                count = self._count(cmd, params)
+            size = count if exhaustive else n - len(result)
+            accepted = 0
+            rows = self._draw_many(cmd, params, size, count=count)
+            if len(rows) < min(size, count):  # the count was too high
+                count = self._count(cmd, params)
+            for t in rows:
+                locked |= {i for col in lock_columns
+                           for i in self.pending.ids(self.table_name, col)}
+                if lock_columns and self.pending.flushes != flushes:
+                    flushes = self.pending.flushes
+                    locked |= set(self._locked_ids(lock_columns,
+                                                   [r[0] for r in rows]))
+                if (t[0] in drawn_ids or t[0] in locked
+                    or any(t[i] in seen[i] for i in positions)):
+                    continue
+                drawn_ids.add(t[0])
+                for i in positions:
+                    seen[i].add(t[i])
+                result.append(self._drawn(t, **kwargs))
+                accepted += 1
+                if len(result) == n:
+                    break
+            if kwargs.get('timestamp', True):
+                count -= accepted
+            self._keep_count(cmd, params, count, version, **kwargs)
+            if not accepted:
+                if exhaustive:
+                    break
+                exhaustive = True
+        log = settings.dbg_logger.getChild('db')
+        log.debug('{} values drawn at once from {}, {} missing\n'
+                  .format(len(result), self.table_name, n - len(result)))
+        while len(result) < n:
+            result.append(self.next(**kwargs))
+        return result
+
 
 def db_table(tag):
     """Table's name possibly associated to tag."""
@@ -1921,6 +2712,15 @@ class sub_source(object):
             random.shuffle(self.values)
         self.current = 0
 
+    def share(self, i, n):
+        """
+        Start at the i-th of n equal parts of the values left.
+
+        See shared.share_draws().
+        """
+        if not self.ondemand:
+            self.current += (self.max - self.current) * i // n
+
     ##
     #   @brief  Synonym of self.next(), but makes the source an Iterator.
     def __next__(self):
@@ -1947,9 +2747,139 @@ class sub_source(object):
             return qr
 
 
+# The tags mc_source.next() draws directly from one of the shared sources
+# The sources of the natural numbers' tuples, by number of elements
+NN_SOURCES = {1: 'nnsingletons_source',
+              2: 'nnpairs_source',
+              3: 'nntriples_source',
+              4: 'nnquadruples_source',
+              5: 'nnquintuples_source',
+              6: 'nnsextuples_source'}
+
+PLAIN_SOURCES = {
+    'int_pairs': 'int_pairs_source',
+    'single_int': 'single_ints_source',
+    'single_deci1': 'single_ints_source',
+    'simple_proper_fractions': 'simple_proper_fractions_source',
+    'improper_fractions': 'improper_fractions_source',
+    'simple_improper_fractions': 'simple_improper_fractions_source',
+    'expressions': 'expressions_source',
+    'coordinates_xy': 'coordinates_xy_source',
+    'cols_for_spreadsheets': 'cols_for_spreadsheets_source',
+    'multiplesof10': 'multiplesof10_source',
+    'int_deci_clever_pairs': 'int_deci_clever_pairs_source',
+    'nn_deci_clever_pairs': 'nn_deci_clever_pairs_source',
+    'time_units_couples': 'time_units_couples_source',
+    'time_units_conversions': 'time_units_conversions_source',
+    'dvipsnames_selection': 'dvipsnames_selection_source',
+    'anglessets': 'anglessets_source',
+    'rightcuboids': 'rightcuboids_source',
+    'times': 'times_source'}
+
+
 class mc_source(object):
+    def batchable(self, source_id):
+        """Tell whether next_many() draws the values of source_id at once."""
+        return (not source_id.startswith('@')
+                and source_id not in ['default', 'simple_fractions']
+                and classify_tag(source_id) in PLAIN_SOURCES)
+
+    def _plain_source(self, source_id, qkw, kwargs):
+        """
+        Return the database source next() would draw source_id from.
+
+        kwargs is updated with the conditions next() would add to the query.
+        Return None if next() does not simply draw from one database source.
+        """
+        if not self.batchable(source_id):
+            return None
+        tag_classification = classify_tag(source_id)
+        db_source = getattr(shared, PLAIN_SOURCES[tag_classification])
+        kwargs.update(preprocess_qkw(db_table(source_id), qkw=qkw))
+        if tag_classification == 'int_pairs':
+            kwargs.update(preprocess_int_pairs_tag(source_id, qkw=qkw))
+        elif tag_classification.startswith('single'):
+            kwargs.update(preprocess_single_nb_tag(source_id))
+        return db_source
+
+    @profiled('tags', lambda src, n, source_id, *args, **kwargs: source_id)
+    def next_many(self, n, source_id, distinct_on=None, q_id='', qkw=None,
+                  **kwargs):
+        """
+        Return n values drawn from source_id, as n calls to next() would.
+
+        If source_id is drawn directly from a database source, the n values
+        are drawn at once (see source.next_many()), otherwise next() is
+        called n times.
+
+        :param n: the number of values to return
+        :type n: int
+        :param source_id: the tag of the source
+        :type source_id: str
+        :param distinct_on: the column (or the list of columns) in which
+        no value may be drawn twice (only for the database sources)
+        :type distinct_on: None or str or list
+        :rtype: list
+        """
+        if qkw is None:
+            qkw = {}
+        db_kwargs = dict(kwargs)
+        db_source = self._plain_source(source_id, qkw, db_kwargs)
+        if db_source is None:
+            return [self.next(source_id, q_id=q_id, qkw=qkw, **kwargs)
+                    for _ in range(n)]
+        return db_source.next_many(n, distinct_on=distinct_on, **db_kwargs)
+
+    def excludes(self, values, source_id, q_id='', qkw=None, **kwargs):
+        """
+        Tell whether next() would not draw values, because of not_in.
+
+        source_id must be drawn directly from a database source (see
+        batchable()).
+        """
+        db_kwargs = dict(kwargs)
+        db_source = self._plain_source(source_id, qkw or {}, db_kwargs)
+        return db_source.excludes(values, **db_kwargs)
+
+    def release(self, values, source_id, q_id='', qkw=None, **kwargs):
+        """
+        Cancel the draw of values, drawn from source_id but not used.
+
+        source_id must be drawn directly from a database source (see
+        batchable()).
+        """
+        db_kwargs = dict(kwargs)
+        db_source = self._plain_source(source_id, qkw or {}, db_kwargs)
+        db_source.release(values, **db_kwargs)
+
+    def _nn_spans(self, source_id, qkw, kwargs):
+        """
+        Return the spans of a natural numbers' source, and their number.
+
+        kwargs is updated with the conditions next() would draw them with.
+        """
+        nb_of_elts = \
+            {'singletons': 1, 'pairs': 2, 'triples': 3, 'quadruples': 4,
+             'quintuples': 5,
+             'sextuples': 6}[source_id.split(':')[0][len('nn'):]]
+        spans = IntspansProduct(source_id.split(':')[1], nb_of_elts)
+        if nb_of_elts == 2:
+            reason = 'no reason'
+            if (qkw.get('variant2', 'default')
+                == 'ensure_no_confusion_between_rules'
+                and spans.spans[0] in [intspan('3'), intspan('9')]):
+                reason = '3or9'
+            if spans.spans[0] == intspan('4'):
+                if qkw.get('level', 'default') != 'default':
+                    reason = '4' + qkw.get('level', 'default')
+            if reason != 'no reason':
+                kwargs.update(preprocess_divisibles(spans.spans[0],
+                                                    reason=reason))
+        return spans, nb_of_elts
+
     ##
     #   @brief  Handles the choice of the next value to return
+    @profiled('tags', lambda src, source_id, *args, **kwargs: source_id)
     def next(self, source_id, q_id='', qkw=None, **kwargs):
         if source_id.startswith('@') or source_id == 'default':
             return (source_id, )
@@ -1963,72 +2893,24 @@ class mc_source(object):
         kwargs.update(preprocess_qkw(db_table(source_id), qkw=qkw))
         if tag_classification == 'natural_nb_tuples':
             log = settings.dbg_logger.getChild('db')
-            nb_of_elts = \
-                {'singletons': 1, 'pairs': 2, 'triples': 3, 'quadruples': 4,
-                 'quintuples': 5,
-                 'sextuples': 6}[source_id.split(':')[0][len('nn'):]]
-            spans = IntspansProduct(source_id.split(':')[1], nb_of_elts)
-            if nb_of_elts == 2:
-                reason = 'no reason'
-                if (qkw.get('variant2', 'default')
-                    == 'ensure_no_confusion_between_rules'
-                    and spans.spans[0] in [intspan('3'), intspan('9')]):
-                    reason = '3or9'
-                if spans.spans[0] == intspan('4'):
-                    if qkw.get('level', 'default') != 'default':
-                        reason = '4' + qkw.get('level', 'default')
-                if reason != 'no reason':
-                    kwargs.update(preprocess_divisibles(spans.spans[0],
-                                                        reason=reason))
+            spans, nb_of_elts = self._nn_spans(source_id, qkw, kwargs)
             random_result = sorted(spans.random_draw(**kwargs))
             log.debug('Random draw output = {}\n'.format(random_result))
-            db_source = {1: shared.nnsingletons_source,
-                         2: shared.nnpairs_source,
-                         3: shared.nntriples_source,
-                         4: shared.nnquadruples_source,
-                         5: shared.nnquintuples_source,
-                         6: shared.nnsextuples_source}[nb_of_elts]
-            L = list(random_result)
-            nb_args = {'nb{}'.format(i + 1): L[i] for i in range(nb_of_elts)}
-            found_among_timestamped = False
-            found_among_not_timestamped = False
-            try:
-                db_source.next(enablereset=False, timestamp=False, **nb_args)
-            except RuntimeError as excinfo:
-                if str(excinfo).startswith('No result from database query. '
-                                           'Command was:'):
-                    log.debug('No result from db query, among not timestamped '
-                              'entries.')
-                else:
-                    raise
-            else:
-                found_among_not_timestamped = True
-
-            try:
-                db_source.next(enablereset=False, timestamp=False,
-                               timestamped=True, **nb_args)
-            except RuntimeError as excinfo:
-                if str(excinfo).startswith('No result from database query. '
-                                           'Command was:'):
-                    log.debug('No result from db query, among timestamped '
-                              'entries.')
-                else:
-                    raise
-            else:
-                found_among_timestamped = True
-
-            if not found_among_timestamped and not found_among_not_timestamped:
-                log.debug('Got no result from db, returning random result')
+            db_source = getattr(shared, NN_SOURCES[nb_of_elts])
+            row = db_source.lookup(random_result)
+            if row is None:
+                log.debug('Not found in db, returning random result')
                 return tuple(random_result)
-            if found_among_timestamped:
-                log.debug('Got a timestamped result from db, so redrawing '
+            row_id, drawn = row
+            if drawn:
+                log.debug('Found a timestamped row in db, so redrawing '
                           'from db')
                 kwargs.update(spans.turn_to_query_conditions())
                 return db_source.next(**kwargs)
-            else:  # found among not timestamped
-                log.debug('Got a NOT timestamped result from db, so timestamp '
+            else:
+                log.debug('Found a NOT timestamped row in db, so timestamp '
                           'and return it')
-                return db_source.next(**nb_args)
+                return db_source._drawn((row_id, *random_result))
         elif tag_classification == 'int_pairs':
             kwargs.update(preprocess_int_pairs_tag(source_id, qkw=qkw))
             return shared.int_pairs_source.next(**kwargs)
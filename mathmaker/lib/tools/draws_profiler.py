@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+
+# Mathmaker creates automatically maths exercises sheets
+# with their answers
+# Copyright 2006-2017 Nicolas Hainaux <nh.techn@gmail.com>
+
+# This file is part of Mathmaker.
+
+# Mathmaker is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# any later version.
+
+# Mathmaker is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Mathmaker; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""
+Profiler of the draws from the databases.
+
+When it is enabled (see settings' DATABASES: PROFILE_DRAWS), shared.init()
+creates a DrawsProfiler, that times each draw of the database sources
+(source.next(), source.next_many()) and of the numbers' sources
+(mc_source.next(), mc_source.next_many()). The draws are grouped by table
+(or numbers' source tag) and signature, i.e. the names of the keywords that
+give the conditions, whatever their values. The report lists, for each
+group, the number of draws and the histogram of their durations, the
+fallbacks the sources have used (resets, unlocks...), and the query plans of
+the groups that took the longest time overall.
+"""
+
+import os
+import json
+import time
+from functools import wraps
+from collections import Counter
+
+from mathmaker.lib import shared
+
+# Upper bounds (in ms) of the latency histograms' buckets, and their labels
+BUCKETS = (0.1, 0.3, 1, 3, 10, 30, 100, 300, 1000)
+LABELS = ['<{}ms'.format(upper) for upper in BUCKETS] \
+    + ['>={}ms'.format(BUCKETS[-1])]
+
+# Keywords that do not change which rows may be drawn
+IGNORED_KEYWORDS = ('q_id', 'qkw', 'timestamp', 'enablereset')
+
+# Number of groups whose query plan is reported
+WORST_GROUPS = 5
+
+
+def signature(kwargs):
+    """The names of the keywords giving the conditions of a draw."""
+    return tuple(sorted(kw for kw in kwargs
+                        if not kw.startswith('info_')
+                        and kw not in IGNORED_KEYWORDS))
+
+
+def bucket(ms):
+    """Label of the histogram's bucket of a duration (in ms)."""
+    for upper, label in zip(BUCKETS, LABELS):
+        if ms < upper:
+            return label
+    return LABELS[-1]
+
+
+class DrawsProfiler(object):
+    """Timings of the draws, grouped by table (or tag) and signature."""
+
+    def __init__(self):
+        # {kind: {(name, signature): stats}}, kind being 'tables' or 'tags'
+        self.groups = {'tables': {}, 'tags': {}}
+        # {table: Counter of the fallbacks}
+        self.fallbacks = {}
+        # The kinds of draws being timed (a draw calling another one of the
+        # same kind is only timed once)
+        self._running = set()
+
+    def record(self, kind, name, kwargs, ms, src=None):
+        """
+        Record a draw that took ms milliseconds.
+
+        src, the database source, is kept along with the kwargs of the
+        slowest draw of each group, to explain its query in the report.
+        """
+        key = (name, signature(kwargs))
+        stats = self.groups[kind].setdefault(
+            key, {'calls': 0, 'total': 0.0, 'max': 0.0,
+                  'histogram': Counter(), 'slowest': None})
+        stats['calls'] += 1
+        stats['total'] += ms
+        stats['histogram'][bucket(ms)] += 1
+        if ms >= stats['max']:
+            stats['max'] = ms
+            if src is not None:
+                stats['slowest'] = (src, dict(kwargs))
+
+    def fallback(self, table, name):
+        """Record the use of a fallback (see source._fallback())."""
+        self.fallbacks.setdefault(table, Counter())[name] += 1
+
+    def _explain(self, slowest):
+        src, kwargs = slowest
+        try:
+            cmd, params = src._cmd(**kwargs)
+            return cmd, [row[-1] for row in src.db.execute(
+                'EXPLAIN QUERY PLAN ' + cmd, src.pending.bind(params))]
+        except Exception as excinfo:
+            return None, ['Cannot explain the query: {}'.format(excinfo)]
+
+    def report(self, worst=WORST_GROUPS):
+        """
+        The report of the draws recorded so far.
+
+        The groups are sorted by decreasing total time; the query plans of
+        the worst ones (of database sources) are added.
+
+        :param worst: the number of groups whose query plan is reported
+        :type worst: int
+        :rtype: dict
+        """
+        result = {}
+        for kind, groups in self.groups.items():
+            result[kind] = [
+                {'name': name, 'signature': list(sig),
+                 'calls': stats['calls'],
+                 'total_ms': round(stats['total'], 3),
+                 'mean_ms': round(stats['total'] / stats['calls'], 3),
+                 'max_ms': round(stats['max'], 3),
+                 'histogram': {label: stats['histogram'][label]
+                               for label in LABELS
+                               if stats['histogram'][label]}}
+                for (name, sig), stats
+                in sorted(groups.items(), key=lambda item: item[1]['total'],
+                          reverse=True)]
+        result['fallbacks'] = {table: dict(counts)
+                               for table, counts
+                               in sorted(self.fallbacks.items())}
+        result['worst'] = []
+        for (name, sig), stats in sorted(
+                self.groups['tables'].items(),
+                key=lambda item: item[1]['total'], reverse=True)[:worst]:
+            if stats['slowest'] is None:
+                continue
+            query, plan = self._explain(stats['slowest'])
+            result['worst'].append({'name': name, 'signature': list(sig),
+                                    'max_ms': round(stats['max'], 3),
+                                    'query': query, 'plan': plan})
+        return result
+
+    def write(self, path, worst=WORST_GROUPS):
+        """
+        Write the report to path, as json if it ends with .json, else as text.
+        """
+        report = self.report(worst=worst)
+        with open(path, 'w') as f:
+            if os.path.splitext(path)[1] == '.json':
+                json.dump(report, f, indent=4)
+            else:
+                f.write(to_text(report))
+
+
+def to_text(report):
+    """The report, as text."""
+    lines = []
+    for kind, title in [('tables', 'Draws from the tables'),
+                        ('tags', 'Draws from the numbers\' sources')]:
+        lines += [title, '=' * len(title)]
+        for group in report[kind]:
+            lines.append('{name} ({sig}): {calls} draws, {total_ms} ms '
+                         '(mean {mean_ms} ms, max {max_ms} ms)'
+                         .format(sig=', '.join(group['signature']), **group))
+            lines.append('    ' + ' '.join('{}: {}'.format(label, n)
+                                           for label, n
+                                           in group['histogram'].items()))
+        lines.append('')
+    lines += ['Fallbacks', '=========']
+    for table, counts in report['fallbacks'].items():
+        lines.append('{}: {}'.format(table, ', '.join(
+            '{} {}'.format(name, n) for name, n in sorted(counts.items()))))
+    lines += ['', 'Query plans of the worst draws', '=' * 30]
+    for group in report['worst']:
+        lines.append('{} ({}): max {} ms'
+                     .format(group['name'], ', '.join(group['signature']),
+                             group['max_ms']))
+        lines.append('    ' + str(group['query']))
+        lines += ['    ' + detail for detail in group['plan']]
+    return '\n'.join(lines) + '\n'
+
+
+def profiled(kind, name):
+    """
+    Decorate a draw method, to time it when a profiler is enabled.
+
+    :param kind: 'tables' (database sources) or 'tags' (mc_source)
+    :type kind: str
+    :param name: return the name of the group, from the method's arguments
+    :type name: callable
+    """
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, *args, **kwargs):
+            profiler = shared.draws_profiler
+            if profiler is None or kind in profiler._running:
+                return method(self, *args, **kwargs)
+            profiler._running.add(kind)
+            start = time.perf_counter()
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                profiler._running.discard(kind)
+                profiler.record(kind, name(self, *args, **kwargs), kwargs,
+                                (time.perf_counter() - start) * 1000,
+                                src=self if kind == 'tables' else None)
+        return wrapper
+    return decorator
@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+
+# Mathmaker creates automatically maths exercises sheets
+# with their answers
+# Copyright 2006-2017 Nicolas Hainaux <nh.techn@gmail.com>
+
+# This file is part of Mathmaker.
+
+# Mathmaker is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# any later version.
+
+# Mathmaker is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Mathmaker; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""
+Offline analysis of the numbers' sources of the YAML sheets.
+
+The questions of each sheet are listed as an Exercise would list them, and
+their numbers' sources expanded the same way (including the autofit ones),
+but nothing is drawn: the rows of the databases (or the tuples of natural
+numbers) each source may provide are counted instead, the drawn ones and
+the others, and compared to the number of questions drawing from it.
+
+The sheets are analysed in parallel, by processes running the same startup
+sequence as mathmakerd's workers (see mmd_pool.init_worker()).
+"""
+
+import multiprocessing
+from collections import namedtuple, OrderedDict
+
+# The statuses of a source, from the worst one
+EMPTY = 'empty'
+TOO_FEW = 'too few'
+RUNNING_OUT = 'running out'
+UNCHECKED = 'unchecked'
+ERROR = 'error'
+OK = 'ok'
+FLAGGED = (ERROR, EMPTY, TOO_FEW, RUNNING_OUT)
+
+# The keywords that do not restrict the values a source may provide, in the
+# long run (the locks are released when no row is left)
+IGNORED_KEYWORDS = ('info_lock', 'lock_equal_products', 'lock_equal_coeffs',
+                    'lock_equal_contexts', 'lock_equal_types')
+
+FeasibilityRow = namedtuple('FeasibilityRow',
+                            'sheet,exercise,question,source,needed,total,'
+                            'fresh,status')
+
+
+def status(needed, counts):
+    """
+    Tell whether a source can provide the needed values.
+
+    :param needed: the number of values drawn from the source by the sheet
+    :type needed: int
+    :param counts: the numbers of values the source may provide, and of
+    those not drawn recently (see count_source()), or None
+    :type counts: None or tuple
+    :rtype: str
+    """
+    if counts is None:
+        return UNCHECKED
+    total, fresh = counts
+    if not total:
+        return EMPTY
+    if total < needed:
+        return TOO_FEW
+    if fresh < needed:
+        return RUNNING_OUT
+    return OK
+
+
+def count_source(nb_source, qkw=None, **kwargs):
+    """
+    Count the values nb_source may provide under the conditions of kwargs.
+
+    Return None if nb_source is not drawn from the databases, or if it is a
+    source of natural numbers having too many tuples to list them.
+
+    :param nb_source: the numbers' source, as given to mc_source.next()
+    :type nb_source: str
+    :param qkw: the question's options
+    :type qkw: None or dict
+    :rtype: None or tuple (total, fresh)
+    """
+    from mathmaker.lib import shared
+    from mathmaker.lib.tools import database
+    qkw = qkw or {}
+    kwargs = {k: v for k, v in kwargs.items() if k not in IGNORED_KEYWORDS}
+    try:
+        tag_classification = database.classify_tag(nb_source)
+    except ValueError:
+        return None
+    if tag_classification == 'natural_nb_tuples':
+        kwargs.update(database.preprocess_qkw(database.db_table(nb_source),
+                                              qkw=qkw))
+        spans, nb_of_elts = shared.mc_source._nn_spans(nb_source, qkw,
+                                                       kwargs)
+        try:
+            feasible = spans.feasible(**kwargs)
+        except RuntimeError:
+            return (0, 0)
+        if feasible is None:
+            return None
+        db_source = getattr(shared, database.NN_SOURCES[nb_of_elts])
+        # The tuples missing from the database are never timestamped
+        drawn = [t for t in feasible if (db_source.lookup(t) or (0, 0))[1]]
+        return (len(feasible), len(feasible) - len(drawn))
+    db_source = shared.mc_source._plain_source(nb_source, qkw, kwargs)
+    if db_source is None:
+        return None
+    fresh = db_source._count(*db_source._cmd(**kwargs))
+    drawn = db_source._count(*db_source._cmd(timestamped=True, **kwargs))
+    return (fresh + drawn, fresh)
+
+
+def _question_sources(q):
+    """
+    The numbers' sources of the question q, and the keywords they are drawn
+    with, as Exercise draws them.
+
+    :param q: the question
+    :type q: Q_info
+    :rtype: list
+    """
+    from mathmaker.lib.tools.frameworks import get_q_modifier, process_autofit
+    from mathmaker.lib.document.frames.exercise \
+        import preprocess_qoptions, get_nb_sources_from_question_info
+    preprocess_qoptions(q)
+    nb_sources, _ = get_nb_sources_from_question_info(q)
+    result = []
+    for nb_source, xkw in nb_sources:
+        if nb_source.startswith('@'):
+            # Only the autofit sources the question sets itself
+            used = [s[0:3] for s in nb_source.split('@')[1:]]
+            for key, attributes in process_autofit(nb_source).items():
+                if key in used:
+                    attributes = dict(attributes)
+                    result.append((attributes.pop('source'), attributes, {}))
+        else:
+            result.append((nb_source, q.options,
+                           dict(get_q_modifier(q.id, nb_source), **xkw)))
+    return result
+
+
+def check_sheet(directive):
+    """
+    Count the values of the numbers' sources of each question of a sheet.
+
+    The questions drawing from the same source, with the same options, in
+    the same exercise, are gathered in one row.
+
+    :param directive: the name of a YAML sheet (see read_index())
+    :type directive: str
+    :rtype: list of FeasibilityRow
+    """
+    from mathmaker.lib.tools.frameworks import (read_index, load_sheet,
+                                                build_exercises_list,
+                                                build_questions_list)
+    from mathmaker.lib.document.frames.exercise \
+        import build_q_dict, build_mixed_q_list
+    try:
+        data = load_sheet(*read_index()[directive])
+        gathered = OrderedDict()
+        for x_nb, x_data in enumerate(build_exercises_list(data)):
+            q_dict, _ = build_q_dict(build_questions_list(x_data))
+            for q in build_mixed_q_list(q_dict, shuffle=False):
+                for nb_source, qkw, kwargs in _question_sources(q):
+                    key = (x_nb + 1, q.id, nb_source,
+                           repr(sorted(qkw.items())),
+                           repr(sorted(kwargs.items())))
+                    if key not in gathered:
+                        gathered[key] = [0, qkw, kwargs]
+                    gathered[key][0] += 1
+        rows = []
+        for (x_nb, q_id, nb_source, _, _), (needed, qkw, kwargs) \
+                in gathered.items():
+            try:
+                counts = count_source(nb_source, qkw=dict(qkw), **kwargs)
+            except Exception as excinfo:
+                rows.append(FeasibilityRow(directive, x_nb, q_id, nb_source,
+                                           needed, None, None,
+                                           '{}: {!r}'.format(ERROR,
+                                                             excinfo)))
+                continue
+            total, fresh = counts if counts is not None else (None, None)
+            rows.append(FeasibilityRow(directive, x_nb, q_id, nb_source,
+                                       needed, total, fresh,
+                                       status(needed, counts)))
+        return rows
+    except Exception as excinfo:
+        return [FeasibilityRow(directive, None, None, None, None, None, None,
+                               '{}: {!r}'.format(ERROR, excinfo))]
+
+
+def check_sheets(directives, processes=None):
+    """
+    Run check_sheet() on each of the directives, in parallel.
+
+    :param directives: the names of YAML sheets
+    :type directives: list
+    :param processes: the number of processes (default: the number of CPUs)
+    :type processes: None or int
+    :rtype: list of FeasibilityRow
+    """
+    from mathmaker.lib.tools.mmd_pool import init_worker
+    with multiprocessing.Pool(processes, initializer=init_worker) as pool:
+        results = pool.map(check_sheet, directives)
+    return [row for rows in results for row in rows]
+
+
+def flagged(row):
+    """Tell whether the row reports a source that may not be drawn from."""
+    return row.status.split(':')[0] in FLAGGED
+
+
+def failed(row):
+    """Tell whether the row reports a source the sheet cannot be drawn from."""
+    return row.status.split(':')[0] in (ERROR, EMPTY, TOO_FEW)
+
+
+def report(rows, all_rows=False):
+    """
+    Turn the rows into a text report, as a tabular.
+
+    :param rows: the rows returned by check_sheets()
+    :type rows: list of FeasibilityRow
+    :param all_rows: whether to list the rows that are not flagged too
+    :type all_rows: bool
+    :rtype: str
+    """
+    header = ('Sheet', 'Ex.', 'Question', 'Source', 'Needed', 'Total',
+              'Fresh', 'Status')
+    lines = [tuple('' if v is None else str(v) for v in row)
+             for row in rows if all_rows or flagged(row)]
+    widths = [max(len(line[i]) for line in [header] + lines)
+              for i in range(len(header))]
+    output = ''
+    for line in [header] + lines:
+        output += ' | '.join(v.ljust(w)
+                             for v, w in zip(line, widths)).rstrip() + '\n'
+        if line is header:
+            output += '-+-'.join('-' * w for w in widths) + '\n'
+    output += '\n{} source(s) checked, {} flagged.\n'\
+        .format(len(rows), len([row for row in rows if flagged(row)]))
+    return output
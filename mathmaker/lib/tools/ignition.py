@@ -28,16 +28,21 @@ language for gettext translations.
 """
 
 import os
+import json
 import shlex
+import shutil
 import gettext
 import warnings
 import subprocess
 from tempfile import TemporaryFile
-from packaging.version import Version
+from packaging.version import Version, InvalidVersion
 
 from mathmaker import __software_name__
+from mathmaker.core.env import USER_LOCAL_SHARE
 from mathmaker.lib.constants import latex
 
+DEPENDENCIES_CACHE = os.path.join(USER_LOCAL_SHARE, 'dependencies.json')
+
 
 def retrieve_fonts(fonts_list_file='mathmaker/data/fonts_list.txt',
                    datadir='mathmaker/data',
@@ -82,8 +87,88 @@ def warning_msg(name: str, path_to: str, c_out: str, c_err: str,
         '  > ERR: ' + str(g_err) + '\n'
 
 
+def executable_fingerprint(path_to: str):
+    """
+    Identify an executable by its resolved path, size and modification time.
+
+    Return None if path_to does not match any executable.
+
+    :param path_to: the path to (or the name of) the executable
+    :type path_to: str
+    :rtype: list
+    """
+    resolved = shutil.which(path_to)
+    if resolved is None:
+        return None
+    resolved = os.path.realpath(resolved)
+    st = os.stat(resolved)
+    return [resolved, st.st_size, st.st_mtime_ns]
+
+
+def load_dependencies_cache(cache_path=DEPENDENCIES_CACHE) -> dict:
+    """Load the versions of the dependencies found at previous checks."""
+    try:
+        with open(cache_path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_dependencies_cache(cache: dict, cache_path=DEPENDENCIES_CACHE):
+    """Save the versions of the dependencies, for next checks."""
+    try:
+        os.makedirs(os.path.dirname(cache_path), mode=0o770, exist_ok=True)
+        with open(cache_path, mode='wt') as f:
+            json.dump(cache, f, indent=2)
+    except OSError:
+        warnings.warn('Could not save the dependencies\' versions to '
+                      + str(cache_path))
+
+
+def probe_version(name: str, path_to: str):
+    """
+    Run `executable --version` and retrieve the version number from output.
+
+    Return None if the version number could not be found.
+
+    :param name: the dependency's name.
+    :type name: str
+    :param path_to: the path to the executable to test
+    :type path_to: str
+    :rtype: str
+    """
+    the_call_out, the_call_err = \
+        subprocess.Popen([path_to, '--version'],
+                         stdout=subprocess.PIPE,
+                         stderr=subprocess.STDOUT).communicate()
+    gkw = {'lualatex': 'Version',
+           'luaotfload-tool': 'luaotfload-tool version',
+           'msgfmt': name}.get(name, 'version')
+    # Equivalent of `executable --version | grep gkw`
+    grep_out = b''.join(line for line in the_call_out.splitlines(True)
+                        if gkw.encode() in line)
+    v = None
+    try:
+        if name in ['lualatex']:
+            temp = shlex.split(grep_out.decode())[4]
+            if len(temp.split(sep='-')) >= 2:
+                v = temp.split(sep='-')[1]
+            else:
+                v = temp
+        elif name in ['luaotfload-tool']:
+            temp = grep_out.decode().split()[-1]
+            v = temp[1:-1]
+        else:
+            v = shlex.split(grep_out.decode())[-1]
+    except IndexError:
+        warnings.warn(warning_msg(name=name, path_to=path_to,
+                                  c_out=the_call_out, c_err=the_call_err,
+                                  gkw=gkw, g_out=grep_out, g_err=None))
+    return v
+
+
 def check_dependency(name: str, goal: str, path_to: str,
-                     required_version_nb: str) -> bool:
+                     required_version_nb: str, cache=None) -> bool:
     """
     Will check if a dependency is installed plus its version number.
 
@@ -91,6 +176,10 @@ def check_dependency(name: str, goal: str, path_to: str,
     line containing 'version' when calling `executable --version`
     (or the equivalent).
 
+    If a cache is provided, the version number found at a previous check
+    is reused, as long as the executable's resolved path, size and
+    modification time did not change; otherwise the cache is updated.
+
     :param name: the dependency's name.
     :type name: str
     :param goal: tells shortly why mathmaker needs it for
@@ -99,79 +188,31 @@ def check_dependency(name: str, goal: str, path_to: str,
     :type path_to: str
     :param required_version_nb: well, the required version number
     :type required_version_nb: str
+    :param cache: versions found at previous checks, per dependency's name
+    :type cache: dict
     :rtype: bool
     """
     err_msg = "mathmaker requires {n} to {g}".format(n=name, g=goal)
-    the_call = the_call_out = the_call_err = None
     try:
-        the_call = subprocess.Popen([path_to, '--version'],
-                                    stdout=subprocess.PIPE,
-                                    stderr=subprocess.STDOUT)
-        the_call_out, the_call_err = \
-            subprocess.Popen([path_to, '--version'],
-                             stdout=subprocess.PIPE,
-                             stderr=subprocess.STDOUT).communicate()
+        fingerprint = executable_fingerprint(path_to)
+        if fingerprint is None:
+            raise OSError
+        cached = cache.get(name) if cache is not None else None
+        if cached is not None and cached.get('fingerprint') == fingerprint:
+            v = cached['version']
+        else:
+            v = probe_version(name, path_to)
+            if cache is not None and v is not None:
+                cache[name] = {'fingerprint': fingerprint, 'version': v}
     except OSError:
         add_msg = " but the path to {n} written in mathmaker's "\
                   "config file doesn't seem to match anything.".format(n=name)
         raise EnvironmentError(err_msg + add_msg)
 
-    if name in ['lualatex']:
+    if name in ['lualatex'] and v is not None:
         from mathmaker import settings
-        try:
-            grep_out, grep_err = subprocess.Popen(['grep', 'Version'],
-                                                  stdin=the_call.stdout,
-                                                  stdout=subprocess.PIPE)\
-                .communicate()
-            temp = shlex.split(grep_out.decode())[4]
-            if len(temp.split(sep='-')) >= 2:
-                v = temp.split(sep='-')[1]
-            else:
-                v = temp
-            settings.luatex_version = str(v)
-        except IndexError:
-            warnings.warn(warning_msg(name=name, path_to=path_to,
-                                      c_out=the_call_out, c_err=the_call_err,
-                                      gkw='Version',
-                                      g_out=grep_out, g_err=grep_err))
-    elif name in ['luaotfload-tool']:
-        try:
-            grep_out, grep_err = subprocess.Popen(['grep',
-                                                   'luaotfload-tool version'],
-                                                  stdin=the_call.stdout,
-                                                  stdout=subprocess.PIPE)\
-                .communicate()
-            temp = grep_out.decode().split()[-1]
-            v = temp[1:-1]
-        except IndexError:
-            warnings.warn(warning_msg(name=name, path_to=path_to,
-                                      c_out=the_call_out, c_err=the_call_err,
-                                      gkw='luaotfload-tool version',
-                                      g_out=grep_out, g_err=grep_err))
-    elif name in ['msgfmt']:
-        try:
-            grep_out, grep_err = subprocess.Popen(['grep', name],
-                                                  stdin=the_call.stdout,
-                                                  stdout=subprocess.PIPE)\
-                .communicate()
-            v = shlex.split(grep_out.decode())[-1]
-        except IndexError:
-            warnings.warn(warning_msg(name=name, path_to=path_to,
-                                      c_out=the_call_out, c_err=the_call_err,
-                                      gkw=name,
-                                      g_out=grep_out, g_err=grep_err))
-    else:
-        try:
-            grep_out, grep_err = subprocess.Popen(['grep', 'version'],
-                                                  stdin=the_call.stdout,
-                                                  stdout=subprocess.PIPE)\
-                .communicate()
-            v = shlex.split(grep_out.decode())[-1]
-        except IndexError:
-            warnings.warn(warning_msg(name=name, path_to=path_to,
-                                      c_out=the_call_out, c_err=the_call_err,
-                                      gkw='version',
-                                      g_out=grep_out, g_err=grep_err))
+        settings.luatex_version = str(v)
+
     installed_version_nb = str(v)
 
     try:
@@ -181,46 +222,58 @@ def check_dependency(name: str, goal: str, path_to: str,
                       .format(nb1=installed_version_nb,
                               nb2=required_version_nb)
             raise EnvironmentError(err_msg + add_msg)
-    except TypeError:
+    except (TypeError, InvalidVersion):
         add_msg = ' but something went wrong while trying to determine ' \
             'the installed version number. Likely, {n} is installed but ' \
             'the version number could not be retrieved (got: {v}).'\
             .format(n=name, v=installed_version_nb)
         raise EnvironmentError(err_msg + add_msg)
+    return True
 
 
 def check_dependencies(euktoeps='euktoeps',
                        xmllint='xmllint',
                        lualatex='lualatex',
-                       luaotfload_tool='luaotfload-tool') -> bool:
-    """Will check all mathmaker's dependencies."""
+                       luaotfload_tool='luaotfload-tool',
+                       recheck=False) -> bool:
+    """
+    Will check all mathmaker's dependencies.
+
+    The versions found are cached (see check_dependency()). If recheck is
+    True, the cached versions are ignored and all dependencies are probed
+    again.
+    """
     infos = ''
     missing_dependency = False
+    cache = {} if recheck else load_dependencies_cache()
+    cached = json.dumps(cache, sort_keys=True)
     try:
         check_dependency("euktoeps", "produce pictures",
-                         euktoeps, "1.5.4")
+                         euktoeps, "1.5.4", cache=cache)
     except EnvironmentError as e:
         infos += str(e) + '\n'
         missing_dependency = True
     try:
         check_dependency("xmllint", "read xml files",
-                         xmllint, "20901")
+                         xmllint, "20901", cache=cache)
     except EnvironmentError as e:
         infos += str(e) + '\n'
         missing_dependency = True
     try:
         check_dependency("lualatex", "compile LaTeX files",
-                         lualatex, "0.76.0")
+                         lualatex, "0.76.0", cache=cache)
     except EnvironmentError as e:
         infos += str(e) + '\n'
         missing_dependency = True
     try:
         check_dependency("luaotfload-tool", "list the fonts available for"
                                             " lualatex",
-                         luaotfload_tool, "2.4-3")
+                         luaotfload_tool, "2.4-3", cache=cache)
     except EnvironmentError as e:
         infos += str(e) + '\n'
         missing_dependency = True
+    if json.dumps(cache, sort_keys=True) != cached:
+        save_dependencies_cache(cache)
     if missing_dependency:
         raise EnvironmentError('Some dependencies are missing or outdated. '
                                'Following message(s) have been returned:\n'
@@ -20,11 +20,102 @@
 # along with Mathmaker; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
 
+import queue
 import logging
 from urllib.parse import parse_qs
 from subprocess import Popen, PIPE
 
 from .mmd_tools import block_ip, manage_daemon_db, get_all_sheets
+from .mmd_tools import load_config
+from .mmd_pool import create_pool
+from .mmd_reservoir import create_reservoir
+
+# Pool of pre-initialized workers; None means each request spawns mathmaker
+pool = None
+# Stocks of pre-generated documents; None means no sheet is pre-generated
+reservoir = None
+# Extra options passed to the mathmaker command
+mathmaker_options = []
+# Maximum number of copies of a sheet in one document
+max_copies = 40
+# The pdf cache the mathmaker processes store the seeded documents in, opened
+# at the first seeded request (see cached_seeded_document()); False if it is
+# disabled
+pdf_cache = None
+
+
+def open_pdf_cache():
+    """
+    Open the pdf cache mathmaker's processes use, if it is enabled.
+
+    The dependencies are checked, as by mathmaker, from the versions cached
+    by the previous checks, because the version of lualatex is part of the
+    documents' keys.
+
+    Return False if the pdf cache is disabled.
+    """
+    from mathmaker import settings
+    from mathmaker.lib.tools.pdf_cache import PdfCache
+    from mathmaker.lib.tools.ignition import check_dependencies
+    settings.init()
+    if not (settings.pdf_cache or '--pdf-cache' in mathmaker_options):
+        return False
+    check_dependencies(euktoeps=settings.euktoeps,
+                       xmllint=settings.xmllint,
+                       lualatex=settings.lualatex,
+                       luaotfload_tool=settings.luaotfload_tool)
+    return PdfCache(settings.pdf_cachedir,
+                    max_size=settings.pdf_cache_max_size,
+                    luatex_version=settings.luatex_version,
+                    font=settings.font)
+
+
+def cached_seeded_document(sheet_name, seed, enable_js_form=False,
+                           copies=1):
+    """
+    The document of sheet_name generated with seed, from the pdf cache.
+
+    Its key is the one mathmaker stores it under (see seeded_key()). Return
+    None if it has not been generated yet, or if the pdf cache is disabled.
+    """
+    global pdf_cache
+    if pdf_cache is None:
+        pdf_cache = open_pdf_cache()
+    if not pdf_cache:
+        return None
+    from mathmaker.lib.tools.pdf_cache import seeded_key
+    return pdf_cache.get(seeded_key(sheet_name, seed, shift=False,
+                                    enable_js_form=enable_js_form,
+                                    copies=copies))
+
+
+def generate_document(sheet_name, optional_args=None, copies=1, seed=None):
+    """
+    Create the pdf document of sheet_name, using the pool if enabled.
+
+    Otherwise, a document generated with a seed is looked for in the pdf
+    cache first, and mathmaker is only spawned if it is not found.
+    """
+    if optional_args is None:
+        optional_args = []
+    enable_js_form = '--interactive' in optional_args
+    if pool is not None:
+        return pool.generate(sheet_name, enable_js_form=enable_js_form,
+                             copies=copies, seed=seed)
+    if seed is not None:
+        document = cached_seeded_document(sheet_name, seed,
+                                          enable_js_form=enable_js_form,
+                                          copies=copies)
+        if document is not None:
+            return document
+    if copies > 1:
+        optional_args = [*optional_args, '--copies', str(copies)]
+    if seed is not None:
+        optional_args = [*optional_args, '--seed', str(seed)]
+    command = ['mathmaker', '--pdf', *mathmaker_options, *optional_args,
+               sheet_name]
+    p = Popen(command, stdout=PIPE)
+    return p.stdout.read()
 
 
 def request_handler(environ, start_response):
@@ -53,20 +144,23 @@ def request_handler(environ, start_response):
         app_logger.warning(f'{log_header} 429 too many requests from {ip}')
         return [response_body.encode('UTF-8')]
 
-    if not (1 <= len(query) <= 2):
-        response_body = 'Error 404: one or two parameters allowed'
+    if not (1 <= len(query) <= 4):
+        response_body = 'Error 404: one to four parameters allowed'
         start_response('404 Not Found', [('Content-Type', 'text/html')])
-        app_logger.warning(f'{log_header} 404 (only one or two parameters '
+        app_logger.warning(f'{log_header} 404 (only one to four parameters '
                            f'allowed)')
         return [response_body.encode('UTF-8')]
 
     if ('sheetname' not in query
-            or (len(query) == 2 and 'ip' not in query)):
+            or any(k not in ('sheetname', 'ip', 'copies', 'seed')
+                   for k in query)):
         response_body = ('Error 404: sheetname must be in parameters. '
-                         'Only ip is accepted as other possible argument.')
+                         'Only ip, copies and seed are accepted as other '
+                         'possible arguments.')
         start_response('404 Not Found', [('Content-Type', 'text/html')])
         app_logger.warning(f'{log_header} 404 (sheetname not in query or '
-                           f'second argument different from ip)')
+                           f'other argument different from ip, copies and '
+                           f'seed)')
         return [response_body.encode('UTF-8')]
 
     sheet_name = query['sheetname'][0]
@@ -82,17 +176,57 @@ def request_handler(environ, start_response):
             app_logger.warning(f'{log_header} 400 (unknown parameter)')
             return [response_body.encode('UTF-8')]
 
+    copies = query.get('copies', ['1'])[0]
+    copies = int(copies) if copies.isascii() and copies.isdecimal() \
+        else 0
+    if not (1 <= copies <= max_copies):
+        response_body = (f'Error 400: copies must be an integer from 1 to '
+                         f'{max_copies}.')
+        start_response('400 Bad Request', [('Content-Type', 'text/html')])
+        app_logger.warning(f'{log_header} 400 (wrong number of copies)')
+        return [response_body.encode('UTF-8')]
+
+    if copies > 1 and optional_args:
+        response_body = 'Error 400: interactive sheets cannot be copied.'
+        start_response('400 Bad Request', [('Content-Type', 'text/html')])
+        app_logger.warning(f'{log_header} 400 (copies of an interactive '
+                           f'sheet)')
+        return [response_body.encode('UTF-8')]
+
+    seed = query.get('seed', [None])[0]
+    if seed is not None:
+        if not (seed.isascii() and seed.isdecimal() and len(seed) <= 20):
+            response_body = 'Error 400: seed must be a non-negative integer.'
+            start_response('400 Bad Request',
+                           [('Content-Type', 'text/html')])
+            app_logger.warning(f'{log_header} 400 (wrong seed)')
+            return [response_body.encode('UTF-8')]
+        seed = int(seed)
+
     if sheet_name not in all_sheets:
         response_body = 'Error 404: No such sheetname'
         start_response('404 Not Found', [('Content-Type', 'text/html')])
         app_logger.warning(f'{log_header} 404 (no such sheetname)')
         return [response_body.encode('UTF-8')]
 
-    document = b''
+    document = None
+    if (reservoir is not None and not optional_args and copies == 1
+        and seed is None and sheet_name in reservoir):
+        document = reservoir.pop(sheet_name)
+        if document is not None:
+            start_response('200 OK', [('Content-Type', 'application/pdf')])
+            app_logger.info(f'{log_header} 200 (from reservoir)')
+            return [document]
+
     try:
-        command = ['mathmaker', '--pdf', *optional_args, sheet_name]
-        p = Popen(command, stdout=PIPE)
-        document = p.stdout.read()
+        document = generate_document(sheet_name, optional_args,
+                                     copies=copies, seed=seed)
+    except queue.Full:
+        response_body = 'Error 503: server busy, try again later'
+        start_response('503 Service Unavailable',
+                       [('Content-Type', 'text/html')])
+        app_logger.warning(f'{log_header} 503 (workers pool is full)')
+        return [response_body.encode('UTF-8')]
     except Exception:
         response_body = 'Error 500: something failed'
         start_response('500 Internal Server Error',
@@ -108,5 +242,24 @@ def request_handler(environ, start_response):
 def mmd_app():
     """
     Factory function to create the WSGI application
+
+    If the pool or the reservoir are enabled in mathmakerd configuration,
+    the workers and refilling threads are started here, so that they belong
+    to the daemonized process.
     """
+    global pool, reservoir, mathmaker_options, max_copies
+    config = load_config()
+    max_copies = config['settings'].get('max_copies', max_copies)
+    mathmaker_options = [option
+                         for key, option in [('pdf_cache', '--pdf-cache'),
+                                             ('preamble_format',
+                                              '--preamble-format')]
+                         if config['settings'].get(key, False)]
+    if config['settings'].get('profile_draws', None):
+        mathmaker_options += ['--profile-draws',
+                              config['settings']['profile_draws']]
+    if pool is None:
+        pool = create_pool(config)
+    if reservoir is None:
+        reservoir = create_reservoir(config, generate_document)
     return request_handler
@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+
+# Mathmaker creates automatically maths exercises sheets
+# with their answers
+# Copyright 2006-2017 Nicolas Hainaux <nh.techn@gmail.com>
+
+# This file is part of Mathmaker.
+
+# Mathmaker is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# any later version.
+
+# Mathmaker is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Mathmaker; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""
+Pool of pre-initialized worker processes for mathmakerd.
+
+Each worker runs the same startup sequence as the command line interface
+(settings, translations, locale, databases and sources) once, then keeps
+its live state to generate as many sheets as it is asked to, until it is
+recycled after a configurable number of jobs.
+"""
+
+import io
+import os
+import sys
+import queue
+import locale
+import logging
+import threading
+import multiprocessing
+from functools import partial
+from contextlib import redirect_stdout
+
+POOL_DEFAULTS = {'enabled': False,
+                 'size': 2,
+                 'queue_depth': 8,
+                 'max_jobs_per_worker': 50,
+                 'timeout': 120}
+
+
+def init_worker(pdf_cache=False, preamble_format=False, profile_draws=''):
+    """
+    Run mathmaker's startup sequence in the current (worker) process.
+
+    As the command line interface does, the dependencies are checked (from
+    the versions cached by the previous checks, see check_dependencies()),
+    so that settings.luatex_version is set: the preambles, the pdf cache's
+    keys and the preambles' formats depend on it.
+
+    :param pdf_cache: whether to enable the compiled documents' cache
+    :type pdf_cache: bool
+    :param preamble_format: whether to enable the preambles' formats
+    :type preamble_format: bool
+    :param profile_draws: where to write the report of the draws' profiler
+    (the worker's pid is added to the file's name); '' to not profile them
+    :type profile_draws: str
+    """
+    import mathmakerlib.config
+    from mathmaker import settings
+    from mathmaker.lib import shared
+    from mathmaker.lib.tools.ignition \
+        import (check_dependencies, install_gettext_translations,
+                check_settings_consistency)
+    mathmakerlib.config.polygons.DEFAULT_WINDING = 'clockwise'
+    settings.init()
+    check_dependencies(euktoeps=settings.euktoeps,
+                       xmllint=settings.xmllint,
+                       lualatex=settings.lualatex,
+                       luaotfload_tool=settings.luaotfload_tool)
+    install_gettext_translations(language=settings.language)
+    settings.locale = settings.language + '.' + settings.encoding \
+        if not sys.platform.startswith('win') \
+        else settings.language
+    locale.setlocale(locale.LC_ALL, settings.locale)
+    settings.pdf_cache = settings.pdf_cache or pdf_cache
+    settings.preamble_format = settings.preamble_format or preamble_format
+    if profile_draws:
+        root, ext = os.path.splitext(profile_draws)
+        settings.profile_draws = '{}-{}{}'.format(root, os.getpid(), ext)
+    check_settings_consistency()
+    shared.init()
+    mathmakerlib.config.language = settings.language
+
+
+def build_sheet(sheet_name, enable_js_form=False):
+    """
+    Create the Sheet object matching sheet_name.
+
+    :param sheet_name: the name of an old style, xml or yaml sheet
+    :type sheet_name: str
+    :param enable_js_form: whether to add the interactive fields
+    :type enable_js_form: bool
+    """
+    from mathmaker.lib import old_style_sheet
+    from mathmaker.lib.document.frames import Sheet
+    from mathmaker.lib.tools.frameworks import read_index
+    from mathmaker.lib.tools.xml import get_xml_sheets_paths
+    if sheet_name in old_style_sheet.AVAILABLE:
+        return old_style_sheet.AVAILABLE[sheet_name][0]()
+    xml_sheets = get_xml_sheets_paths()
+    if sheet_name in xml_sheets:
+        return Sheet('', '', '', filename=xml_sheets[sheet_name])
+    yaml_sheets = read_index()
+    if sheet_name in yaml_sheets:
+        return Sheet(*yaml_sheets[sheet_name], filename=None,
+                     enable_js_form=enable_js_form)
+    raise ValueError(f'No such sheetname: {sheet_name}')
+
+
+def generate(sheet_name, enable_js_form=False, copies=1, seed=None):
+    """
+    Generate the pdf document of sheet_name in the current (worker) process.
+
+    With several copies, they are all written in the same document (see
+    Copies).
+
+    With a seed, the sheet is generated from it (see shared.use_seed()), from
+    a fresh state of the LaTeX packages required and of the points' names,
+    as it would be by a new process. If the pdf cache is enabled, the
+    document is then looked for in it before being generated, and stored in
+    it after.
+
+    The databases' modifications (timestamps, locks) are committed at the
+    end of each job, so that a worker can be recycled at any time. So is
+    the report of the draws' profiler (of all the worker's jobs) written.
+
+    :param sheet_name: the name of an old style, xml or yaml sheet
+    :type sheet_name: str
+    :param enable_js_form: whether to add the interactive fields
+    :type enable_js_form: bool
+    :param copies: the number of copies of the sheet
+    :type copies: int
+    :param seed: the seed to generate the sheet from, if any
+    :type seed: None or int
+    :rtype: bytes
+    """
+    from mathmakerlib import required
+    from mathmaker.lib import shared
+    from mathmaker.lib.document.frames import Copies
+    from mathmaker.lib.tools.pdf_cache import seeded_key
+    key = None
+    if seed is not None:
+        shared.use_seed(seed)
+        key = seeded_key(sheet_name, seed, shift=False,
+                         enable_js_form=enable_js_form, copies=copies)
+    required.init()
+    shared.enable_js_form = False
+    raw = io.BytesIO()
+    out = io.TextIOWrapper(raw, write_through=True)
+    try:
+        with redirect_stdout(out):
+            if key is None or not shared.machine.write_seeded(key):
+                if copies == 1:
+                    sh = build_sheet(sheet_name,
+                                     enable_js_form=enable_js_form)
+                else:
+                    sh = Copies(partial(build_sheet, sheet_name,
+                                        enable_js_form=enable_js_form),
+                                copies)
+                shared.machine.write_out(str(sh), pdf_output=True,
+                                         seeded_key=key)
+        out.flush()
+        document = raw.getvalue()
+    finally:
+        if seed is not None:
+            # The next jobs draw from the shared state again
+            shared.use_seed(None)
+    shared.commit()
+    if shared.draws_profiler is not None:
+        from mathmaker import settings
+        shared.draws_profiler.write(settings.profile_draws)
+    return document
+
+
+class WorkerPool(object):
+    """
+    Pool of pre-initialized mathmaker processes.
+
+    Requests beyond size + queue_depth concurrent jobs are refused at once
+    (queue.Full is raised) rather than piling up. A job keeps its slot until
+    its worker is done with it, even if the request stopped waiting for it
+    (timeout).
+    """
+
+    def __init__(self, size=2, queue_depth=8, max_jobs_per_worker=50,
+                 timeout=120, pdf_cache=False, preamble_format=False,
+                 profile_draws=''):
+        self.log = logging.getLogger('pool')
+        self.size = size
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(size + queue_depth)
+        self._pool = multiprocessing.Pool(
+            processes=size, initializer=init_worker,
+            initargs=(pdf_cache, preamble_format, profile_draws),
+            maxtasksperchild=max_jobs_per_worker or None)
+        self.log.info(f'Started {size} workers (queue depth: {queue_depth}, '
+                      f'max jobs per worker: {max_jobs_per_worker})')
+
+    def generate(self, sheet_name, enable_js_form=False, copies=1,
+                 seed=None):
+        """Generate the pdf document of sheet_name in one of the workers."""
+        if not self._slots.acquire(blocking=False):
+            raise queue.Full(f'All {self.size} workers are busy and the '
+                             f'queue is full')
+        try:
+            job = self._pool.apply_async(generate, (sheet_name, ),
+                                         {'enable_js_form': enable_js_form,
+                                          'copies': copies,
+                                          'seed': seed},
+                                         callback=self._release,
+                                         error_callback=self._release)
+        except BaseException:
+            self._slots.release()
+            raise
+        return job.get(timeout=self.timeout)
+
+    def _release(self, result):
+        """Free the slot of a job, once its worker is done with it."""
+        self._slots.release()
+
+    def close(self):
+        self._pool.close()
+        self._pool.join()
+        self.log.info('Workers stopped')
+
+
+def create_pool(config):
+    """
+    Create the workers' pool from the 'pool' section of mathmakerd config.
+
+    Return None if the pool is disabled.
+    """
+    pool_config = dict(POOL_DEFAULTS)
+    pool_config.update(config.get('pool', None) or {})
+    if not pool_config.pop('enabled'):
+        return None
+    settings = config.get('settings', {})
+    return WorkerPool(pdf_cache=settings.get('pdf_cache', False),
+                      preamble_format=settings.get('preamble_format', False),
+                      profile_draws=settings.get('profile_draws', ''),
+                      **pool_config)
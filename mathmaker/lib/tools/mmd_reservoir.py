@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+
+# Mathmaker creates automatically maths exercises sheets
+# with their answers
+# Copyright 2006-2017 Nicolas Hainaux <nh.techn@gmail.com>
+
+# This file is part of Mathmaker.
+
+# Mathmaker is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# any later version.
+
+# Mathmaker is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Mathmaker; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""
+Reservoir of already compiled sheets for mathmakerd.
+
+For each configured sheetname, a bounded stock of pdf documents is kept in
+memory. A request takes one document out of the stock (so that each
+document is served at most once) and background threads generate new ones
+as soon as the stock falls under its low-water mark, or as soon as outdated
+documents are evicted from it.
+"""
+
+import time
+import queue
+import logging
+import threading
+from collections import deque
+
+RESERVOIR_DEFAULTS = {'enabled': False,
+                      'threads': 1,
+                      'max_age': 3600,
+                      'size': 5,
+                      'low_water': 2,
+                      'sheets': {}}
+
+
+class Reservoir(object):
+    """Bounded stocks of pre-generated pdf documents, one per sheetname."""
+
+    def __init__(self, generate, sheets, max_age=3600, threads=1):
+        """
+        Initialize the stocks and start the refilling threads.
+
+        :param generate: function taking a sheetname and returning the pdf
+        document (bytes)
+        :param sheets: for each sheetname, a dict containing its 'size' and
+        'low_water' values
+        :type sheets: dict
+        :param max_age: documents older than this (in seconds) are discarded
+        :type max_age: int
+        :param threads: number of refilling threads
+        :type threads: int
+        """
+        self.log = logging.getLogger('reservoir')
+        self.generate = generate
+        self.sheets = sheets
+        self.max_age = max_age
+        self._stock = {name: deque() for name in sheets}
+        self._pending = {name: 0 for name in sheets}
+        self._lock = threading.Lock()
+        self._orders = queue.Queue()
+        self._threads = [threading.Thread(target=self._refill_loop,
+                                          daemon=True)
+                         for _ in range(threads)]
+        for t in self._threads:
+            t.start()
+        for name in sheets:
+            self._order(name, force=True)
+
+    def __contains__(self, sheet_name):
+        return sheet_name in self._stock
+
+    def level(self, sheet_name):
+        """Number of documents currently in stock for sheet_name."""
+        self._order(sheet_name)
+        with self._lock:
+            return len(self._stock[sheet_name])
+
+    def _evict(self, sheet_name):
+        """Discard the outdated documents and return how many they were."""
+        # Must be called with self._lock acquired
+        stock = self._stock[sheet_name]
+        limit = time.monotonic() - self.max_age
+        evicted = 0
+        while stock and stock[0][0] < limit:
+            stock.popleft()
+            evicted += 1
+            self.log.debug(f'Evicted an outdated {sheet_name} document')
+        return evicted
+
+    def _next_eviction(self):
+        """Seconds until the oldest document gets outdated (None if none)."""
+        with self._lock:
+            dates = [stock[0][0] for stock in self._stock.values() if stock]
+        if not dates:
+            return None
+        return max(min(dates) + self.max_age - time.monotonic(), 0)
+
+    def _order(self, sheet_name, force=False):
+        """
+        Order enough documents to fill the stock, if needed.
+
+        It is needed if the stock is under its low-water mark, or if
+        outdated documents have just been evicted from it.
+        """
+        with self._lock:
+            evicted = self._evict(sheet_name)
+            stored = len(self._stock[sheet_name])
+            if (not force and not evicted
+                and stored >= self.sheets[sheet_name]['low_water']):
+                return
+            missing = (self.sheets[sheet_name]['size'] - stored
+                       - self._pending[sheet_name])
+            self._pending[sheet_name] += max(missing, 0)
+        for _ in range(missing):
+            self._orders.put(sheet_name)
+
+    def pop(self, sheet_name):
+        """
+        Take a document out of the stock of sheet_name.
+
+        Return None if the stock is empty (the caller then has to generate
+        the document by itself).
+        """
+        document = None
+        with self._lock:
+            self._evict(sheet_name)
+            if self._stock[sheet_name]:
+                document = self._stock[sheet_name].popleft()[1]
+        self._order(sheet_name)
+        return document
+
+    def _refill_loop(self):
+        """
+        Generate the ordered documents.
+
+        While there is no order, wake up when the oldest document gets
+        outdated, to replace the evicted documents at once, rather than at
+        the next request.
+        """
+        while True:
+            try:
+                sheet_name = self._orders.get(timeout=self._next_eviction())
+            except queue.Empty:
+                for name in self.sheets:
+                    self._order(name)
+                continue
+            if sheet_name is None:
+                break
+            try:
+                document = self.generate(sheet_name)
+            except Exception:
+                self.log.error(f'Could not generate {sheet_name}',
+                               exc_info=True)
+                document = None
+            with self._lock:
+                self._pending[sheet_name] -= 1
+                if (document
+                    and (len(self._stock[sheet_name])
+                         < self.sheets[sheet_name]['size'])):
+                    self._stock[sheet_name].append((time.monotonic(),
+                                                    document))
+
+    def close(self):
+        """Stop the refilling threads once the current orders are done."""
+        for _ in self._threads:
+            self._orders.put(None)
+        for t in self._threads:
+            t.join()
+
+
+def create_reservoir(config, generate):
+    """
+    Create the reservoir from the 'reservoir' section of mathmakerd config.
+
+    Each sheet may redefine the default size and low_water values. Return
+    None if the reservoir is disabled or no sheet is configured.
+    """
+    reservoir_config = dict(RESERVOIR_DEFAULTS)
+    reservoir_config.update(config.get('reservoir', None) or {})
+    if not reservoir_config['enabled'] or not reservoir_config['sheets']:
+        return None
+    sheets = {}
+    for name, values in reservoir_config['sheets'].items():
+        sheets[name] = {'size': reservoir_config['size'],
+                        'low_water': reservoir_config['low_water']}
+        sheets[name].update(values or {})
+    return Reservoir(generate, sheets,
+                     max_age=reservoir_config['max_age'],
+                     threads=reservoir_config['threads'])
@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+
+# Mathmaker creates automatically maths exercises sheets
+# with their answers
+# Copyright 2006-2017 Nicolas Hainaux <nh.techn@gmail.com>
+
+# This file is part of Mathmaker.
+
+# Mathmaker is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# any later version.
+
+# Mathmaker is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Mathmaker; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+
+"""
+Read-only databases with their state kept aside.
+
+The databases shipped with mathmaker (the *.db-dist files) are opened
+read-only, as they are, without copying them. The only columns mathmaker
+modifies (the timestamps and locks of the rows) are kept in a small state
+database, attached to the same connection: its freshness table holds one row
+per table's row whose state is not the initial one (all zeros).
+
+Each table of the shipped database is shadowed by a temporary view of the
+same name, reading the table and the state of its rows, so that the queries
+are the same as on a copy of the database. The shipped databases come with
+the indexes of their own columns (see dist_indexes()), that the queries on
+the views use. The updates of the view are redirected to the freshness
+table by a trigger. The views are only meant for the draw queries: the
+state of the rows as such (e.g. the timestamped rows to reset) is read from
+and written to the freshness table directly (see WriteBehind.clear()), as
+the view would look the state of each row of the table up.
+
+The other shipped databases can be attached to the same connection, and
+share its state database.
+"""
+
+import os
+import sqlite3
+from urllib.request import pathname2url
+
+from mathmaker.lib.tools.queries_census import index_name, load_indexes
+from mathmaker.lib.tools.queries_census import create_indexes
+
+# The columns whose values are kept in the state database
+STATE_COLUMNS = ('drawDate', 'locked', 'lock_equal_products')
+
+STATE_TABLE = 'freshness'
+
+# The indexes of the freshness table, besides its primary key (tbl, id) that
+# serves the updates of given rows: the rows of a table whose state column
+# is set are counted, listed and reset in the order of its values (see
+# WriteBehind.clear())
+STATE_INDEXES = [['tbl', c] for c in STATE_COLUMNS]
+
+
+def _create_state_table(db):
+    db.execute('CREATE TABLE IF NOT EXISTS state.{} ('
+               'tbl TEXT, id INTEGER, {}, PRIMARY KEY (tbl, id)) '
+               'WITHOUT ROWID;'
+               .format(STATE_TABLE,
+                       ', '.join('{} INTEGER NOT NULL DEFAULT 0'.format(c)
+                                 for c in STATE_COLUMNS)))
+    for cols in STATE_INDEXES:
+        db.execute('CREATE INDEX IF NOT EXISTS state.{} ON {} ({});'
+                   .format(index_name(STATE_TABLE, cols), STATE_TABLE,
+                           ', '.join(cols)))
+
+
+def _ro_uri(path):
+    """URI to open the database path read-only, as it is."""
+    return 'file:{}?mode=ro&immutable=1'.format(pathname2url(path))
+
+
+def _shadow(db, table, schema='main'):
+    """Shadow table by a view adding the state of its rows to it."""
+    cols = [row[1]
+            for row in db.execute(f'PRAGMA {schema}.table_info({table});')]
+    state_cols = [c for c in cols if c in STATE_COLUMNS]
+    if not state_cols:
+        return
+    # The view reads one table only, so that the conditions on its columns
+    # use its indexes as they would on the table itself; the state of each
+    # row is looked up by its primary key, only for the rows matching them
+    db.execute('CREATE TEMP VIEW {table} AS SELECT {cols} '
+               'FROM {schema}.{table} AS t;'
+               .format(table=table, schema=schema,
+                       cols=', '.join("ifnull((SELECT s.{c} "
+                                      "FROM state.{state} AS s "
+                                      "WHERE s.tbl = '{table}' "
+                                      "AND s.id = t.id), 0) AS {c}"
+                                      .format(c=c, state=STATE_TABLE,
+                                              table=table)
+                                      if c in STATE_COLUMNS else 't.' + c
+                                      for c in cols)))
+    # The statements of a trigger cannot name the database of the table they
+    # modify: freshness is found in the state database
+    db.execute('CREATE TEMP TRIGGER {table}_update INSTEAD OF UPDATE '
+               'ON {table} BEGIN '
+               "INSERT INTO {state} (tbl, id, {cols}) "
+               "VALUES ('{table}', OLD.id, {new}) "
+               'ON CONFLICT (tbl, id) DO UPDATE SET {updates}; '
+               "DELETE FROM {state} WHERE tbl = '{table}' AND id = OLD.id "
+               'AND {zeros}; '
+               'END;'
+               .format(table=table, state=STATE_TABLE,
+                       cols=', '.join(state_cols),
+                       new=', '.join('NEW.' + c for c in state_cols),
+                       updates=', '.join('{c} = excluded.{c}'.format(c=c)
+                                         for c in state_cols),
+                       zeros=' AND '.join('{} = 0'.format(c)
+                                          for c in STATE_COLUMNS)))
+
+
+def connect(dist_path, state_path, session=False, attached=None, **kwargs):
+    """
+    Open the database dist_path read-only, with its state in state_path.
+
+    Other shipped databases may be attached to the same connection, under
+    their own schema names: their tables are shadowed the same way, and the
+    state of their rows is kept in the same state database (so, the names
+    of the tables of all these databases must differ). They then share the
+    page cache, the pragmas and the transactions of the connection.
+
+    The state database is created if it does not exist yet. It is shared by
+    the processes running at the same time, so it is in WAL mode (readers
+    do not wait for a writer) and the connection is in autocommit mode: the
+    modifications are written in short transactions (see
+    WriteBehind.flush()), instead of one transaction lasting until the end.
+
+    With session=True, the state is read from state_path, but kept in
+    memory, and never written back: each process then has its own state,
+    and does not wait for the others at all. If state_path is None, this
+    state starts empty.
+
+    :param dist_path: the path to the shipped database
+    :type dist_path: str
+    :param state_path: the path to the state database
+    :type state_path: None or str
+    :param session: whether to keep the state in memory
+    :type session: bool
+    :param attached: the paths to the other shipped databases to attach,
+    by schema name
+    :type attached: None or dict
+    :param kwargs: passed to sqlite3.connect() (e.g. timeout, the time to
+    wait for another process to release the write lock)
+    :rtype: sqlite3.Connection
+    """
+    attached = attached or {}
+    db = sqlite3.connect(_ro_uri(dist_path), uri=True, isolation_level=None,
+                         **kwargs)
+    for schema, path in attached.items():
+        db.execute('ATTACH DATABASE ? AS {};'.format(schema),
+                   (_ro_uri(path), ))
+    if session:
+        db.execute("ATTACH DATABASE ':memory:' AS state;")
+        _create_state_table(db)
+        if state_path is not None and os.path.isfile(state_path):
+            db.execute('ATTACH DATABASE ? AS shared_state;',
+                       ('file:{}?mode=ro'.format(pathname2url(state_path)), ))
+            db.execute('INSERT INTO state.{table} '
+                       'SELECT * FROM shared_state.{table};'
+                       .format(table=STATE_TABLE))
+            db.execute('DETACH DATABASE shared_state;')
+    else:
+        db.execute('ATTACH DATABASE ? AS state;', (state_path, ))
+        db.execute('PRAGMA state.journal_mode = WAL;')
+        _create_state_table(db)
+    for schema in ['main'] + list(attached):
+        for (table, ) in tuple(db.execute("SELECT name FROM {}.sqlite_master "
+                                          "WHERE type = 'table';"
+                                          .format(schema))):
+            _shadow(db, table, schema=schema)
+    return db
+
+
+def dist_indexes(indexes):
+    """
+    The indexes to create in a shipped database.
+
+    The state columns are dropped from the indexes, as their values are
+    not read from the shipped database (the state database has its own
+    indexes, see STATE_INDEXES).
+
+    :param indexes: the columns of the indexes of each table
+    :type indexes: dict
+    :rtype: dict
+    """
+    result = {}
+    for table, cols_list in indexes.items():
+        kept = []
+        for cols in cols_list:
+            cols = [c for c in cols if c not in STATE_COLUMNS]
+            if cols and cols not in kept:
+                kept.append(cols)
+        if kept:
+            result[table] = kept
+    return result
+
+
+def create_dist_indexes(databases):
+    """
+    Create the indexes of sql_indexes.json in the shipped databases.
+
+    They are created when the databases are built (see build_db.py), or
+    added to the databases built before (see its --indexes-only option).
+
+    :param databases: the connections to the shipped databases, by their
+    names in sql_indexes.json (e.g. 'db', 'natural_nb_tuples_db')
+    :type databases: dict
+    """
+    indexes = load_indexes()
+    for name, db in databases.items():
+        create_indexes(db, dist_indexes(indexes.get(name, {})))
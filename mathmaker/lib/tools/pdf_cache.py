@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+
+# Mathmaker creates automatically maths exercises sheets
+# with their answers
+# Copyright 2006-2017 Nicolas Hainaux <nh.techn@gmail.com>
+
+# This file is part of Mathmaker.
+
+# Mathmaker is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# any later version.
+
+# Mathmaker is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Mathmaker; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""
+On disk cache of compiled pdf documents, keyed by their LaTeX source.
+
+The documents generated with a seed are also stored under a key made of
+what they have been generated from (see seeded_key()), so that they can be
+found before being generated again.
+"""
+
+import os
+import json
+import hashlib
+from glob import glob
+from tempfile import NamedTemporaryFile
+
+
+class PdfCache(object):
+    """
+    Store compiled pdf documents, named after a hash of their LaTeX source.
+
+    The total size of the cache is bounded: the least recently used
+    documents are removed first. A document's last use is recorded as its
+    file's modification time.
+    """
+
+    def __init__(self, cachedir, max_size=200, luatex_version='', font=None):
+        """
+        :param cachedir: the directory where to store the documents
+        :type cachedir: str
+        :param max_size: maximum total size of the documents, in MB
+        :type max_size: int or float
+        :param luatex_version: part of the key, as a different version may
+        produce a different document from the same source
+        :type luatex_version: str
+        :param font: part of the key, for the same reason
+        :type font: str
+        """
+        self.cachedir = cachedir
+        self.max_size = int(max_size * 1024 * 1024)
+        self.salt = f'{luatex_version}\0{font}\0'
+        os.makedirs(self.cachedir, mode=0o770, exist_ok=True)
+
+    def key(self, latex_document):
+        """Hash of latex_document, lualatex's version and the font."""
+        h = hashlib.sha256(self.salt.encode('utf-8'))
+        h.update(latex_document.encode('utf-8'))
+        return h.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cachedir, key + '.pdf')
+
+    def get(self, latex_document):
+        """Return the cached pdf document, or None if there's none."""
+        path = self._path(self.key(latex_document))
+        try:
+            with open(path, mode='rb') as f:
+                document = f.read()
+        except FileNotFoundError:
+            return None
+        os.utime(path)
+        return document
+
+    def put(self, latex_document, pdf_document):
+        """Store pdf_document, then evict old documents if necessary."""
+        with NamedTemporaryFile(mode='wb', dir=self.cachedir,
+                                suffix='.tmp', delete=False) as f:
+            f.write(pdf_document)
+        os.replace(f.name, self._path(self.key(latex_document)))
+        self.evict()
+
+    def evict(self):
+        """Remove the least recently used documents beyond max_size."""
+        entries = []
+        for path in glob(os.path.join(self.cachedir, '*.pdf')):
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:  # removed by a concurrent process
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+        total = sum(e[1] for e in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+def seeded_key(directive, seed, **options):
+    """
+    Text standing for the document of directive generated with seed.
+
+    The same directive, generated with the same seed (see shared.use_seed()),
+    options and configuration, by the same version of mathmaker, is the same
+    document. So this text is made of all of them, including the settings
+    overriding the configuration.
+
+    :param directive: the name of the sheet
+    :type directive: str
+    :param seed: the seed
+    :type seed: int
+    :param options: the options the sheet is created with (e.g. copies)
+    :rtype: str
+    """
+    from mathmaker import __version__, settings
+    from mathmaker.lib.tools import load_config
+    return json.dumps(['seeded', __version__, directive, seed, options,
+                       settings.language, settings.encoding,
+                       settings.mc_belts,
+                       load_config('user_config', settings.settingsdir)],
+                      sort_keys=True, default=str)
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+
+# Mathmaker creates automatically maths exercises sheets
+# with their answers
+# Copyright 2006-2017 Nicolas Hainaux <nh.techn@gmail.com>
+
+# This file is part of Mathmaker.
+
+# Mathmaker is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# any later version.
+
+# Mathmaker is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Mathmaker; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""
+Precompiled LuaLaTeX formats of the documents' preambles.
+
+The preamble of a document (everything before \\begin{document}) is dumped
+once into a format file, using the mylatexformat package; the documents
+sharing this preamble are then compiled against the format, so that
+lualatex does not load and initialize all packages again.
+
+The formats are named after a hash of the preamble and of the TeX
+installation (lualatex's path, size, modification time and version), so
+that they are rebuilt automatically when one of them changes. A format that
+could not be built is not tried again with the same TeX installation, until
+FAILED_FORMAT_TTL has passed (e.g. to let a missing package be installed).
+"""
+
+import os
+import time
+import shutil
+import hashlib
+import subprocess
+
+from mathmaker import settings
+
+BEGIN_DOCUMENT = '\\begin{document}'
+# Time (in seconds) before a format that could not be built is tried again
+FAILED_FORMAT_TTL = 24 * 3600
+
+
+def split_preamble(latex_document):
+    """
+    Split latex_document into its preamble and its body.
+
+    :param latex_document: the entire LaTeX document
+    :type latex_document: str
+    :rtype: tuple
+    """
+    i = latex_document.find(BEGIN_DOCUMENT)
+    if i == -1:
+        return ('', latex_document)
+    return (latex_document[:i], latex_document[i:])
+
+
+def tex_fingerprint(lualatex='lualatex', luatex_version=''):
+    """Identify the TeX installation, to know when formats are outdated."""
+    path = shutil.which(lualatex) or lualatex
+    try:
+        path = os.path.realpath(path)
+        st = os.stat(path)
+        return f'{path}\0{st.st_size}\0{st.st_mtime_ns}\0{luatex_version}'
+    except OSError:
+        return f'{path}\0{luatex_version}'
+
+
+class PreambleFormats(object):
+    """Build and keep the formats of the preambles."""
+
+    def __init__(self, fmtdir, lualatex='lualatex', luatex_version=''):
+        """
+        :param fmtdir: the directory where to store the formats
+        :type fmtdir: str
+        :param lualatex: the lualatex executable
+        :type lualatex: str
+        :param luatex_version: lualatex's version number
+        :type luatex_version: str
+        """
+        self.log = settings.mainlogger
+        self.fmtdir = fmtdir
+        self.lualatex = lualatex
+        self.fingerprint = tex_fingerprint(lualatex, luatex_version)
+        os.makedirs(self.fmtdir, mode=0o770, exist_ok=True)
+
+    @property
+    def env(self):
+        """Environment to run lualatex with, so that it finds the formats."""
+        env = dict(os.environ)
+        # The trailing separator keeps the default search path
+        env['TEXFORMATS'] = self.fmtdir + os.pathsep \
+            + env.get('TEXFORMATS', '')
+        return env
+
+    def key(self, preamble):
+        """Name of the format matching preamble."""
+        h = hashlib.sha256(self.fingerprint.encode('utf-8'))
+        h.update(preamble.encode('utf-8'))
+        return 'mm-' + h.hexdigest()[:32]
+
+    def _path(self, key, ext):
+        return os.path.join(self.fmtdir, key + ext)
+
+    def mark_failed(self, key):
+        """Remember this format cannot be built, not to try it again soon."""
+        with open(self._path(key, '.failed'), mode='wt') as f:
+            f.write(self.fingerprint)
+
+    def failed(self, key):
+        """
+        Tell whether this format could not be built lately.
+
+        The marker only counts if it was written with the same TeX
+        installation, less than FAILED_FORMAT_TTL seconds ago.
+        """
+        path = self._path(key, '.failed')
+        try:
+            with open(path, mode='rt') as f:
+                fingerprint = f.read()
+            age = time.time() - os.path.getmtime(path)
+        except FileNotFoundError:
+            return False
+        return fingerprint == self.fingerprint and age < FAILED_FORMAT_TTL
+
+    def discard(self, key):
+        """Remove this format, so that it is built again next time."""
+        try:
+            os.remove(self._path(key, '.fmt'))
+        except FileNotFoundError:
+            pass
+
+    def get(self, preamble):
+        """
+        Return the name of the format matching preamble.
+
+        The format is built if it does not exist yet. Return None if it
+        cannot be built.
+        """
+        key = self.key(preamble)
+        if self.failed(key):
+            return None
+        if not os.path.isfile(self._path(key, '.fmt')):
+            if not self._build(preamble, key):
+                self.mark_failed(key)
+                return None
+        return key
+
+    def _build(self, preamble, key):
+        jobname = f'{key}-{os.getpid()}'
+        source = self._path(jobname, '.tex')
+        with open(source, mode='wt') as f:
+            f.write(preamble + BEGIN_DOCUMENT + '\n\\end{document}\n')
+        self.log.info(f'Build LuaLaTeX format {key}')
+        p = subprocess.run([self.lualatex, '-ini', f'-jobname={jobname}',
+                            '-interaction=nonstopmode', '&lualatex',
+                            'mylatexformat.ltx', source],
+                           cwd=self.fmtdir, stdout=subprocess.DEVNULL,
+                           stderr=subprocess.DEVNULL)
+        built = (p.returncode == 0
+                 and os.path.isfile(self._path(jobname, '.fmt')))
+        if built:
+            os.replace(self._path(jobname, '.fmt'), self._path(key, '.fmt'))
+        else:
+            self.log.warning(f'Could not build LuaLaTeX format {key}, see '
+                             f'{self._path(jobname, ".log")}')
+        for ext in ('.tex', '.fmt') + (('.log', ) if built else ()):
+            try:
+                os.remove(self._path(jobname, ext))
+            except FileNotFoundError:
+                pass
+        return built
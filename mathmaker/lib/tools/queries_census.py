@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+
+# Mathmaker creates automatically maths exercises sheets
+# with their answers
+# Copyright 2006-2017 Nicolas Hainaux <nh.techn@gmail.com>
+
+# This file is part of Mathmaker.
+
+# Mathmaker is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# any later version.
+
+# Mathmaker is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Mathmaker; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""
+Census of the shapes of the queries sent to the databases.
+
+The shape of a query is, for each table it reads or updates, the columns
+its conditions compare to a value: either for equality (=, IN) or as a
+range (<, <=, >, >=, !=, BETWEEN). The census counts the shapes met while
+generating sheets and deduces the indexes that let SQLite find the matching
+rows without scanning the whole tables (see toolbox/queries_census.py).
+"""
+
+import re
+import json
+import logging
+import sqlite3
+from collections import Counter
+
+from mathmaker import settings
+
+# Table-valued functions, like json_each(...), are not tables; the tables
+# may be prefixed by the name of their database (e.g. state.freshness)
+_TABLE = re.compile(r'\b(?:FROM|UPDATE)\s+(?:\w+\.)?(\w+)\b(?!\s*[(.])',
+                    re.IGNORECASE)
+_WHERE = re.compile(r'\bWHERE\b', re.IGNORECASE)
+_CONDITION = re.compile(r'\b(\w+)\s*(NOT\s+IN\b|IN\b|BETWEEN\b'
+                        r'|!=|<=|>=|=|<|>|%)', re.IGNORECASE)
+_EQUALITY = ('=', 'IN')
+_RANGE = ('<', '<=', '>', '>=', '!=', 'BETWEEN')
+
+
+def _columns_order(col):
+    # drawDate is put after the other columns compared for equality, so that
+    # the same index also serves the queries on timestamped rows
+    # (drawDate != 0)
+    return (col == 'drawDate', col)
+
+
+def query_shapes(statement, columns):
+    """
+    Return the shapes of statement, as (table, equal_cols, range_cols).
+
+    Columns compared with NOT IN or modulo are ignored, as an index cannot
+    help to check them.
+
+    :param statement: the SQL statement
+    :type statement: str
+    :param columns: the columns' names of each table
+    :type columns: dict
+    :rtype: list
+    """
+    shapes = []
+    tables = list(_TABLE.finditer(statement))
+    for i, m in enumerate(tables):
+        table = m.group(1)
+        end = tables[i + 1].start() if i + 1 < len(tables) else None
+        where = _WHERE.search(statement, m.end(), end or len(statement))
+        if table not in columns or where is None:
+            continue
+        equal, ranged = set(), set()
+        for col, op in _CONDITION.findall(statement[where.end():end]):
+            op = op.upper()
+            if col not in columns[table]:
+                continue
+            if op in _EQUALITY:
+                equal.add(col)
+            elif op in _RANGE:
+                ranged.add(col)
+        shapes.append((table, tuple(sorted(equal, key=_columns_order)),
+                       tuple(sorted(ranged - equal, key=_columns_order))))
+    return shapes
+
+
+def index_columns(equal_cols, range_cols):
+    """
+    Columns of the index matching a shape, or () if it needs none.
+
+    An index can serve all the equalities, then one range.
+    """
+    if 'id' in equal_cols:  # the primary key is enough
+        return ()
+    return tuple(equal_cols) + tuple(range_cols[:1])
+
+
+def serves(cols, equal_cols, range_cols):
+    """Tell whether the index on cols serves the shape."""
+    n = len(equal_cols)
+    return (set(cols[:n]) == set(equal_cols)
+            and (not range_cols or (len(cols) > n and cols[n] in range_cols)))
+
+
+def index_name(table, cols):
+    return 'idx_{}__{}'.format(table.lstrip('_'), '_'.join(cols))
+
+
+class QueriesCensus(object):
+    """Count the shapes of the statements sent to some databases."""
+
+    def __init__(self):
+        self.shapes = {}
+        self.columns = {}
+        self.sizes = {}
+        # The names of the databases of each connection
+        self._names = {}
+
+    def attach(self, db_name, db, schema='main'):
+        """
+        Record all statements that will be executed by db.
+
+        :param db_name: the name of the database in the census
+        :type db_name: str
+        :param db: the connection
+        :type db: sqlite3.Connection
+        :param schema: the name of the database in the connection (several
+        databases may be attached to the same connection, their tables'
+        names must then differ)
+        :type schema: str
+        """
+        self.shapes.setdefault(db_name, Counter())
+        self.columns[db_name] = {}
+        self.sizes[db_name] = {}
+        for (table, ) in tuple(db.execute(f"SELECT name "
+                                          f"FROM {schema}.sqlite_master "
+                                          f"WHERE type = 'table';")):
+            self.columns[db_name][table] = \
+                {row[1] for row in db.execute(f'PRAGMA {schema}.table_info'
+                                              f'({table});')}
+            self.sizes[db_name][table] = \
+                tuple(db.execute(f'SELECT COUNT(*) '
+                                 f'FROM {schema}.{table};'))[0][0]
+        names = self._names.setdefault(db, [])
+        names.append(db_name)
+
+        def record(statement):
+            for name in names:
+                self.record(name, statement)
+        db.set_trace_callback(record)
+
+    def record(self, db_name, statement):
+        self.shapes[db_name].update(
+            query_shapes(statement, self.columns[db_name]))
+
+    def indexes(self, max_per_table=4, min_rows=1000):
+        """
+        The indexes matching the recorded shapes.
+
+        The shapes are examined from the most to the least frequent one; an
+        index is added only if none of the previous ones serves the shape,
+        and is then merged into any longer index it is the prefix of. Only
+        the max_per_table indexes serving the most queries are kept.
+        Tables having less than min_rows rows are scanned fast enough
+        without index.
+
+        :rtype: dict
+        """
+        result = {}
+        for db_name, shapes in self.shapes.items():
+            chosen = {}
+            for (table, equal, ranged), n in shapes.most_common():
+                cols = index_columns(equal, ranged)
+                if not cols or self.sizes[db_name][table] < min_rows:
+                    continue
+                table_indexes = chosen.setdefault(table, Counter())
+                for index in table_indexes:
+                    if serves(index, equal, ranged):
+                        table_indexes[index] += n
+                        break
+                else:
+                    table_indexes[cols] += n
+            for table_indexes in chosen.values():
+                # An index that is the prefix of another one is useless
+                for index in sorted(table_indexes, key=len, reverse=True):
+                    longer = [i for i in table_indexes
+                              if len(i) > len(index)
+                              and i[:len(index)] == index]
+                    if longer:
+                        table_indexes[longer[0]] += table_indexes.pop(index)
+            result[db_name] = {
+                table: [list(cols) for cols, _
+                        in table_indexes.most_common(max_per_table)]
+                for table, table_indexes in sorted(chosen.items())}
+        return result
+
+
+def load_indexes():
+    """The indexes of each database, as listed in the data directory."""
+    try:
+        with open(settings.sql_indexes_path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def create_indexes(db, indexes):
+    """
+    Create the indexes that do not exist yet in db.
+
+    :param indexes: the columns of the indexes of each table
+    :type indexes: dict
+    """
+    for table, cols_list in indexes.items():
+        for cols in cols_list:
+            try:
+                db.execute('CREATE INDEX IF NOT EXISTS {} ON {} ({});'
+                           .format(index_name(table, cols), table,
+                                   ', '.join(cols)))
+            except sqlite3.OperationalError as excinfo:
+                logging.getLogger('__main__')\
+                    .warning(f'Could not create index on {table}: {excinfo}')
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+
+# Mathmaker creates automatically maths exercises sheets
+# with their answers
+# Copyright 2006-2017 Nicolas Hainaux <nh.techn@gmail.com>
+
+# This file is part of Mathmaker.
+
+# Mathmaker is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# any later version.
+
+# Mathmaker is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Mathmaker; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""
+Rendering of the questions of an exercise, possibly in parallel.
+
+Once the numbers of an exercise have been drawn (see Exercise), its
+questions can be built independently of one another. With several
+processes, they are split into contiguous chunks, each one built by a
+process forked from the current one, then gathered in their order. The
+forked processes open their own connections to the databases, commit the
+rows they draw, and send back the LaTeX packages their questions require.
+As they do not see the rows the others draw, each one draws from its own
+share of the rows and values (see shared.share_draws()).
+
+It is only done where forking is safe: on the platforms supporting it, and
+not from a daemonic process (e.g. a mathmakerd worker) nor from a process
+running several threads. Neither is it done for a seeded sheet (see
+shared.use_seed()), that must not depend on the number of processes.
+Otherwise, the questions are built one after the other.
+"""
+
+import pickle
+import random
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from mathmaker import settings
+
+# The attributes of mathmakerlib.required the questions may set
+REQUIRED = ('package', 'options', 'tikz_library', 'tikzset', 'callout_style')
+
+# The attributes of a Question that are turned into strings before it is
+# sent back by a forked process
+PRINTED = ('q_text', 'q_answer', 'q_hint')
+
+# The chunks of drafts being built: the forked processes inherit them, only
+# their indexes are sent to them (the numbers drawn cannot all be pickled)
+_chunks = []
+
+
+def parallel(processes, n):
+    """Tell whether n questions would be built by several processes."""
+    return (processes > 1 and n > 1 and settings.seed is None
+            and 'fork' in multiprocessing.get_all_start_methods()
+            and not multiprocessing.current_process().daemon
+            and threading.active_count() == 1)
+
+
+def _build(drafts):
+    from mathmaker.lib.document.frames.question import Question
+    return [Question(q_kind, **options) for q_kind, options in drafts]
+
+
+def _init_process():
+    from mathmaker.lib import shared
+    shared.reconnect()
+
+
+def _build_chunk(i):
+    """Build the questions of the i-th chunk, in a forked process."""
+    from mathmakerlib import required
+    from mathmaker.lib import shared
+    seed, first, drafts = _chunks[i]
+    random.seed(seed)
+    shared.share_draws(i, len(_chunks))
+    shared.number_of_the_question += first
+    questions = _build(drafts)
+    shared.commit()
+    for q in questions:
+        for attr in PRINTED:
+            setattr(q, attr, str(getattr(q, attr)))
+    result = (questions, {name: getattr(required, name)
+                          for name in REQUIRED if hasattr(required, name)})
+    try:
+        pickle.loads(pickle.dumps(result))
+    except Exception as excinfo:
+        raise RuntimeError(f'The questions cannot be sent back: {excinfo!r}')
+    return result
+
+
+def _merge_required(flags):
+    """Require the LaTeX packages (and options) required in flags."""
+    from mathmakerlib import required
+    for name, values in flags.items():
+        current = getattr(required, name)
+        for key, value in values.items():
+            if isinstance(value, set):
+                current.setdefault(key, set()).update(value)
+            elif value:
+                current[key] = value
+
+
+def render(drafts, processes=1):
+    """
+    Build the questions of drafts, in their order.
+
+    The expressions of the questions built by a forked process are numbered
+    from the number of the first question of its chunk.
+
+    :param drafts: the arguments to build each Question with, as
+    (q_kind, options) (see Exercise._draw_numbers())
+    :type drafts: list
+    :param processes: the maximum number of processes building them
+    :type processes: int
+    :rtype: list of Question
+    """
+    if not parallel(processes, len(drafts)):
+        return _build(drafts)
+    from mathmaker.lib import shared
+    # The forked processes' connections must see the rows drawn so far
+    shared.commit()
+    size = -(-len(drafts) // min(processes, len(drafts)))
+    _chunks[:] = [(random.getrandbits(64), i, drafts[i:i + size])
+                  for i in range(0, len(drafts), size)]
+    context = multiprocessing.get_context('fork')
+    try:
+        with ProcessPoolExecutor(len(_chunks), mp_context=context,
+                                 initializer=_init_process) as executor:
+            results = list(executor.map(_build_chunk, range(len(_chunks))))
+    except Exception:
+        settings.mainlogger.warning('Could not build the questions in '
+                                    'parallel, building them one after the '
+                                    'other.', exc_info=True)
+        return _build(drafts)
+    finally:
+        _chunks.clear()
+    questions = []
+    for chunk_questions, flags in results:
+        questions += chunk_questions
+        _merge_required(flags)
+    return questions
@@ -0,0 +1,356 @@
+# -*- coding: utf-8 -*-
+
+# Mathmaker creates automatically maths exercises sheets
+# with their answers
+# Copyright 2006-2017 Nicolas Hainaux <nh.techn@gmail.com>
+
+# This file is part of Mathmaker.
+
+# Mathmaker is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# any later version.
+
+# Mathmaker is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Mathmaker; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+
+"""
+Write-behind buffer of the timestamps and locks of the drawn rows.
+
+Instead of updating the tables at each draw, the sources record the ids of
+the rows to timestamp (drawDate) or to lock (locked, lock_equal_products)
+in the buffer of their connection. The draw queries consult it, through
+the Pending placeholders of their parameters, so that the rows are excluded
+exactly as if they had been updated. The buffer is written to the database
+in one batch, and one short transaction, when it gets too big, before a
+table is reset, and when the databases' modifications are committed.
+"""
+
+import json
+import sqlite3
+from datetime import datetime, timedelta, timezone
+from collections import Counter
+
+from mathmaker import settings
+from mathmaker.lib.tools.overlay import STATE_COLUMNS, STATE_TABLE
+
+# Number of pending rows that triggers a flush
+THRESHOLD = 1000
+
+# Subquery listing the ids bound to a Pending placeholder
+PENDING_IDS = '(SELECT value FROM json_each(?))'
+
+_buffers = {}
+
+# The last time returned by now()
+_last = None
+
+
+def now():
+    """
+    Current time, in the format of sqlite's strftime('%Y-%m-%d %H:%M:%f')
+
+    Two calls never return the same time (the second one is then one
+    millisecond later than the first one), so that the timestamps keep the
+    order of the draws, whatever their pace (see source._twothirds_reset()).
+    """
+    global _last
+    t = datetime.now(timezone.utc)
+    t = t.replace(microsecond=t.microsecond // 1000 * 1000)
+    if _last is not None and t <= _last:
+        t = _last + timedelta(milliseconds=1)
+    _last = t
+    return t.strftime('%Y-%m-%d %H:%M:%S.') \
+        + '{:03d}'.format(t.microsecond // 1000)
+
+
+class Pending(object):
+    """Placeholder of the ids of the rows whose column is pending update."""
+
+    def __init__(self, table, column):
+        self.table = table
+        self.column = column
+
+    def __eq__(self, other):
+        return (isinstance(other, Pending)
+                and (self.table, self.column) == (other.table, other.column))
+
+    def __hash__(self):
+        return hash((self.table, self.column))
+
+    def __repr__(self):
+        return 'Pending({}.{})'.format(self.table, self.column)
+
+
+class WriteBehind(object):
+    """Pending updates of the rows of one database."""
+
+    def __init__(self, db, threshold=THRESHOLD):
+        self.db = db
+        self.threshold = threshold
+        # {(table, column): {id: value}}
+        self.rows = {}
+        self.idcols = {}
+        # The ids bound to the Pending placeholders, serialized once for all
+        # the draws until the pending updates of their column change:
+        # {(table, column): str}
+        self.bound = {}
+        # Number of flushes, of the flushes writing updates of each table,
+        # and of resets (or unlocks) of each table
+        self.flushes = 0
+        self.written = Counter()
+        self.resets = Counter()
+        # The drawn rows of the tables, shared by their columnar sources
+        # (see columnar.py): {table: (version, bitset)}
+        self.drawn = {}
+        # The ids of the drawn rows of the tables, shared by the sources
+        # looking up their rows (see source.lookup()): {table: (version, set)}
+        self.drawn_ids = {}
+        # The numbers of rows left to draw for recent queries, shared by the
+        # sources of the tables (see source._rows_left()):
+        # {table: (version, {(query, parameters): number of rows})}
+        self.counts = {}
+        # The database the updates are written to (see overlay.py)
+        self.schema = 'state' \
+            if 'state' in [row[1]
+                           for row in db.execute('PRAGMA database_list;')] \
+            else 'main'
+
+    def __len__(self):
+        return sum(len(rows) for rows in self.rows.values())
+
+    def add(self, table, column, ids, value, idcol='id'):
+        """Record that column must be set to value in the rows ids."""
+        self.idcols[table] = idcol
+        rows = self.rows.setdefault((table, column), {})
+        self.bound.pop((table, column), None)
+        for i in ids:
+            rows[i] = value
+        if len(self) >= self.threshold:
+            self.flush()
+
+    def reset(self, table):
+        """Record that the rows of table have been reset (or unlocked)."""
+        self.resets[table] += 1
+
+    def version(self, table):
+        """
+        Version of the state of the rows of table.
+
+        It changes when the rows of table are reset or unlocked, when the
+        pending updates of table are written, and when another connection
+        writes to the database: the numbers of rows counted before may be
+        too low. The flushes of the other tables do not change it.
+        """
+        return (self.written[table], self.resets[table], self._data_version())
+
+    def up_to_date(self, table, version):
+        """
+        Whether version is still the version of the state of table.
+
+        The data_version of the database is only read if the table has not
+        been reset, and none of its pending updates have been written, since
+        version.
+        """
+        return (version is not None
+                and version[:2] == (self.written[table], self.resets[table])
+                and version[2] == self._data_version())
+
+    def _data_version(self):
+        """Version of the database, changed by other connections' writes."""
+        return tuple(self.db.execute('PRAGMA {}.data_version;'
+                                     .format(self.schema)))[0][0]
+
+    def ids(self, table, column):
+        """The ids of the rows whose column is pending a non-zero value."""
+        return [i for i, value in self.rows.get((table, column), {}).items()
+                if value]
+
+    def _written(self, table, column):
+        """
+        The table holding the state of the rows of table, and the condition
+        (with its parameters) selecting the rows whose column is not 0.
+
+        With a state database (see overlay.py), its freshness table is read
+        directly, rather than the view shadowing table, that would look the
+        state of each row of table up.
+        """
+        if self.schema == 'state':
+            return ('state.{}'.format(STATE_TABLE),
+                    'tbl = ? AND {} != 0'.format(column), (table, ))
+        return (table, '{} != 0'.format(column), ())
+
+    def count(self, table, column):
+        """
+        Number of rows of table whose column is not 0 in the database.
+
+        The pending updates are not taken into account.
+        """
+        target, cond, params = self._written(table, column)
+        return tuple(self.db.execute('SELECT COUNT(*) FROM {} WHERE {};'
+                                     .format(target, cond), params))[0][0]
+
+    def written_ids(self, table, column):
+        """
+        The ids of the rows of table whose column is not 0 in the database.
+
+        The pending updates are not taken into account.
+        """
+        target, cond, params = self._written(table, column)
+        return [row[0] for row in self.db.execute(
+            'SELECT {} FROM {} WHERE {};'.format(self._idcol(table), target,
+                                                 cond),
+            params)]
+
+    def clear(self, table, column, limit=None):
+        """
+        Set column back to 0 in the rows of table, in the database.
+
+        If limit is given, only the limit rows having the lowest values of
+        column (e.g. the oldest timestamps), then the lowest ids, are
+        cleared. The rows back to their initial state are dropped from the
+        state database. The pending updates are not modified (see drop()).
+
+        :param limit: the maximum number of rows to clear
+        :type limit: None or int
+        """
+        target, cond, params = self._written(table, column)
+        statement = 'UPDATE {} SET {} = 0 WHERE {}'.format(target, column,
+                                                            cond)
+        if limit is not None:
+            oldest, oldest_params = self.oldest(table, column, limit)
+            statement += ' AND {} IN {}'.format(self._idcol(table), oldest)
+            params = params + oldest_params
+        began = not self.db.in_transaction
+        if began:
+            self.db.execute('BEGIN IMMEDIATE;')
+        try:
+            self.db.execute(statement + ';', params)
+            if self.schema == 'state':
+                self.db.execute('DELETE FROM {} WHERE tbl = ? AND {};'
+                                .format(target,
+                                        ' AND '.join('{} = 0'.format(c)
+                                                     for c in STATE_COLUMNS)),
+                                (table, ))
+        except sqlite3.Error:
+            if began:
+                self.db.rollback()
+            raise
+        if began:
+            self.db.commit()
+
+    def oldest(self, table, column, limit):
+        """
+        Subquery (with its parameters) listing the ids of the limit rows of
+        table having the lowest non-zero values of column (e.g. the oldest
+        timestamps), then the lowest ids, in the database.
+
+        These are the rows clear() clears, given limit.
+        """
+        target, cond, params = self._written(table, column)
+        return ('(SELECT {idcol} FROM {target} WHERE {cond} '
+                'ORDER BY {column}, {idcol} LIMIT ?)'
+                .format(idcol=self._idcol(table), target=target, cond=cond,
+                        column=column),
+                params + (limit, ))
+
+    def _idcol(self, table):
+        """The column of the ids of the rows of table, in _written()'s."""
+        return 'id' if self.schema == 'state' \
+            else self.idcols.get(table, 'id')
+
+    def bind(self, params):
+        """Replace the Pending placeholders of params by the pending ids."""
+        return tuple(self._bound(p.table, p.column)
+                     if isinstance(p, Pending) else p
+                     for p in params)
+
+    def _bound(self, table, column):
+        """The ids of self.ids(table, column), serialized (and cached)."""
+        key = (table, column)
+        if key not in self.bound:
+            self.bound[key] = json.dumps(self.ids(table, column))
+        return self.bound[key]
+
+    def drop(self, table, column):
+        """Forget the pending updates of column in table (e.g. reset)."""
+        self.rows.pop((table, column), None)
+        self.bound.pop((table, column), None)
+
+    def flush(self, *tables):
+        """
+        Write the pending updates of tables (of all tables by default).
+
+        They are written in one short transaction, that takes the write lock
+        at once (waiting for it at most the busy timeout of the connection)
+        and is committed at once, so that several processes can share the
+        database. If the lock cannot be taken, or the writes fail because of
+        another process, the updates are kept pending, to be written by the
+        next flush.
+
+        :rtype: bool (whether the updates have been written)
+        """
+        keys = [(table, column) for (table, column) in self.rows
+                if not tables or table in tables]
+        if not keys:
+            return True
+        try:
+            if not self.db.in_transaction:
+                self.db.execute('BEGIN IMMEDIATE;')
+            for (table, column) in keys:
+                self.db.executemany(
+                    'UPDATE {} SET {} = ? WHERE {} = ?;'
+                    .format(table, column, self.idcols[table]),
+                    [(value, i)
+                     for i, value in self.rows[(table, column)].items()])
+            self.db.commit()
+        except sqlite3.OperationalError as excinfo:
+            if self.db.in_transaction:
+                self.db.rollback()
+            settings.dbg_logger.getChild('db_flush')\
+                .debug('Could not write {} pending updates ({}), they are '
+                       'kept for the next flush.\n'
+                       .format(len(self), excinfo))
+            return False
+        except sqlite3.Error:
+            self.db.rollback()
+            raise
+        for key in keys:
+            del self.rows[key]
+            self.bound.pop(key, None)
+        self.flushes += 1
+        self.written.update({table for (table, column) in keys})
+        return True
+
+
+def write_behind(db):
+    """The write-behind buffer of the db connection."""
+    if db not in _buffers:
+        _buffers[db] = WriteBehind(db)
+    return _buffers[db]
+
+
+def flush(db):
+    """
+    Write the pending updates of db, if any.
+
+    It is the last chance to write them: if they cannot be written, they
+    are lost, and it is logged (they only let the next draws avoid the rows
+    drawn recently).
+    """
+    if db in _buffers and not _buffers[db].flush():
+        settings.mainlogger.warning('Could not write {} timestamps or locks '
+                                    'of the drawn rows to the database.'
+                                    .format(len(_buffers[db])))
+
+
+def forget(db):
+    """Drop the buffer of db (and its pending updates), e.g. on closing."""
+    _buffers.pop(db, None)
@@ -25,7 +25,6 @@ import logging
 import logging.config
 from glob import glob
 from pathlib import Path
-from shutil import copyfile
 
 from mathmaker import __version__, __software_name__
 from mathmaker.lib.tools import ext_dict, load_config
@@ -71,52 +70,23 @@ class default_object(object):
 class path_object(object):
     def __init__(self, ldd='', dd='', logger=None):
         ldd += '/'
-        self.db = ldd + '{}-{}.db'.format(__software_name__, __version__)
         self.db_dist = dd + '{}.db-dist'.format(__software_name__)
-        self.natural_nb_tuples_db = ldd + 'natural_nb_tuples-{}.db'\
-            .format(__version__)
         self.natural_nb_tuples_db_dist = dd + 'natural_nb_tuples.db-dist'
         self.daemon_db = ldd + '{}d.db'.format(__software_name__)
-        self.shapes_db = ldd + 'shapes-{}.db'.format(__version__)
         self.shapes_db_dist = dd + 'shapes.db-dist'
-        self.solids_db = ldd + 'solids-{}.db'.format(__version__)
         self.solids_db_dist = dd + 'solids.db-dist'
-        self.anglessets_db = ldd + 'anglessets-{}.db'.format(__version__)
         self.anglessets_db_dist = dd + 'anglessets.db-dist'
-        logger.info('db={}'.format(self.db))
-        logger.info('shapes db={}'.format(self.shapes_db))
-        logger.info('solids db={}'.format(self.solids_db))
-        logger.info('anglessets db={}'.format(self.anglessets_db))
+        # The *.db-dist files are opened read-only, the timestamps and locks
+        # of their rows are written in the state database
+        self.db_state = ldd + '{}-{}-state.db'.format(__software_name__,
+                                                      __version__)
+        logger.info('db={}'.format(self.db_dist))
+        logger.info('shapes db={}'.format(self.shapes_db_dist))
+        logger.info('solids db={}'.format(self.solids_db_dist))
+        logger.info('anglessets db={}'.format(self.anglessets_db_dist))
         logger.info('natural_nb_tuples db={}'
-                    .format(self.natural_nb_tuples_db))
-        if (not os.path.isfile(self.db)
-            or os.path.getmtime(self.db) < os.path.getmtime(self.db_dist)):
-            logger.info('Copy main db from {}\n'.format(self.db_dist))
-            copyfile(self.db_dist, self.db)
-        if (not os.path.isfile(self.shapes_db)
-            or os.path.getmtime(self.shapes_db)
-            < os.path.getmtime(self.shapes_db_dist)):
-            logger.info('Copy shapes db from {}\n'
-                        .format(self.shapes_db_dist))
-            copyfile(self.shapes_db_dist, self.shapes_db)
-        if (not os.path.isfile(self.solids_db)
-            or os.path.getmtime(self.solids_db)
-            < os.path.getmtime(self.solids_db_dist)):
-            logger.info('Copy solids db from {}\n'
-                        .format(self.solids_db_dist))
-            copyfile(self.solids_db_dist, self.solids_db)
-        if (not os.path.isfile(self.anglessets_db)
-            or os.path.getmtime(self.anglessets_db)
-            < os.path.getmtime(self.anglessets_db_dist)):
-            logger.info('Copy anglessets db from {}\n'
-                        .format(self.anglessets_db_dist))
-            copyfile(self.anglessets_db_dist, self.anglessets_db)
-        if (not os.path.isfile(self.natural_nb_tuples_db)
-            or os.path.getmtime(self.natural_nb_tuples_db)
-            < os.path.getmtime(self.natural_nb_tuples_db_dist)):
-            logger.info('Copy natural_nb_tuples db from {}\n'
-                        .format(self.natural_nb_tuples_db_dist))
-            copyfile(self.natural_nb_tuples_db_dist, self.natural_nb_tuples_db)
+                    .format(self.natural_nb_tuples_db_dist))
+        logger.info('state db={}'.format(self.db_state))
 
 
 def init():
@@ -132,6 +102,7 @@ def init():
     global solids_db_index_path
     global anglessets_db_index_path
     global natural_nb_tuples_db_index_path
+    global sql_indexes_path
     global default, path
     global mainlogger
     global dbg_logger
@@ -158,6 +129,17 @@ def init():
     global luatex_version
     global mc_belts
     global mc_titles
+    global pdf_cache
+    global pdf_cache_max_size
+    global pdf_cachedir
+    global preamble_format
+    global formatsdir
+    global columnar_sources
+    global db_busy_timeout
+    global session_state
+    global profile_draws
+    global render_processes
+    global seed
 
     luatex_version = ''
 
@@ -182,6 +164,7 @@ def init():
     anglessets_db_index_path = datadir + 'anglessets_db_index.json'
     natural_nb_tuples_db_index_path = \
         datadir + 'natural_nb_tuples_db_index.json'
+    sql_indexes_path = datadir + 'sql_indexes.json'
     settingsdir = rootdir + settings_dirname
     projectdir = rootdir[:-len('mathmaker/')]
 
@@ -260,3 +243,16 @@ def init():
 
     round_letters_in_math_expr = CONFIG['LATEX']\
         .get('ROUND_LETTERS_IN_MATH_EXPR', False)
+    pdf_cache = CONFIG['LATEX'].get('PDF_CACHE', False)
+    pdf_cache_max_size = CONFIG['LATEX'].get('PDF_CACHE_MAX_SIZE', 200)
+    pdf_cachedir = os.path.join(USER_LOCAL_SHARE, 'pdf_cache')
+    preamble_format = CONFIG['LATEX'].get('PREAMBLE_FORMAT', False)
+    formatsdir = os.path.join(USER_LOCAL_SHARE, 'formats')
+    columnar_sources = CONFIG.get('DATABASES', {})\
+        .get('COLUMNAR_SOURCES', False)
+    db_busy_timeout = CONFIG.get('DATABASES', {}).get('BUSY_TIMEOUT', 30)
+    session_state = CONFIG.get('DATABASES', {}).get('SESSION_STATE', False)
+    profile_draws = CONFIG.get('DATABASES', {}).get('PROFILE_DRAWS', '')
+    render_processes = CONFIG['DOCUMENT'].get('RENDER_PROCESSES', 1)
+    # Only set for the seeded generations (see shared.use_seed())
+    seed = None
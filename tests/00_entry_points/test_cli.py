@@ -72,6 +72,41 @@ def test_yaml_sheet():
         assert str(excinfo.value) == '0'
 
 
+def test_yaml_sheet_copies():
+    """Test `mathmaker --copies 2 y1b1_exam`"""
+    testargs = [__software_name__, '--copies', '2', 'y1b1_exam']
+    with patch.object(sys, 'argv', testargs):
+        with pytest.raises(SystemExit) as excinfo:
+            entry_point()
+        assert str(excinfo.value) == '0'
+
+
+def test_interactive_copies():
+    """Test `mathmaker --copies 2 --interactive y1b1_exam` is refused"""
+    testargs = [__software_name__, '--copies', '2', '--interactive',
+                'y1b1_exam']
+    with patch.object(sys, 'argv', testargs):
+        with pytest.raises(SystemExit) as excinfo:
+            entry_point()
+        assert str(excinfo.value) == '2'
+
+
+def test_yaml_sheet_seed(capsys):
+    """Test `mathmaker --seed 3 y1b4_W05a` twice gives the same sheet"""
+    testargs = [__software_name__, '--seed', '3', 'y1b4_W05a']
+    outputs = []
+    try:
+        for _ in range(2):
+            with patch.object(sys, 'argv', testargs):
+                with pytest.raises(SystemExit) as excinfo:
+                    entry_point()
+                assert str(excinfo.value) == '0'
+            outputs.append(capsys.readouterr().out)
+    finally:
+        shared.use_seed(None)
+    assert outputs[0] and outputs[0] == outputs[1]
+
+
 def test_unknown_directive():
     """Test `mathmaker undefined`"""
     testargs = [__software_name__, 'undefined']
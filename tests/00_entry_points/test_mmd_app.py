@@ -36,14 +36,20 @@ def mock_dependencies(mocker):
             'mathmaker.lib.tools.mmd_app.get_all_sheets'),
         'block_ip': mocker.patch(
             'mathmaker.lib.tools.mmd_app.block_ip'),
-        'popen': mocker.patch('mathmaker.lib.tools.mmd_app.Popen')
+        'popen': mocker.patch('mathmaker.lib.tools.mmd_app.Popen'),
+        'open_pdf_cache': mocker.patch(
+            'mathmaker.lib.tools.mmd_app.open_pdf_cache')
     }
+    mocker.patch('mathmaker.lib.tools.mmd_app.pdf_cache', None)
 
     # Setup default values
     mocks['manage_daemon_db'].return_value = FAKE_TIMESTAMP_NOW
     mocks['get_all_sheets'].return_value = {'test_sheet': 'path/to/sheet'}
     mocks['block_ip'].return_value = False
 
+    # The pdf cache is disabled
+    mocks['open_pdf_cache'].return_value = False
+
     # Setup Popen
     mock_process = MagicMock()
     mock_process.stdout.read.return_value = b'mock pdf content'
@@ -149,25 +155,26 @@ def test_wsgi_app_200_with_interactive_arg(mocker,
     assert response['status'] == '200 OK'
 
 
-def test_wsgi_app_404_with_three_parameters(mocker,
-                                            mock_dependencies,
-                                            wsgi_app_factory):
+def test_wsgi_app_404_with_five_parameters(mocker,
+                                           mock_dependencies,
+                                           wsgi_app_factory):
     mock_logger = mocker.patch('mathmaker.lib.tools.mmd_app.logging.getLogger',
                                autospec=True)
     mock_logger.return_value = MagicMock()
     response = wsgi_app_factory(
-        path='/?sheetname=test_sheet&ip=192.168.1.1&extraneous=any_value',
+        path='/?sheetname=test_sheet&ip=192.168.1.1&copies=2&seed=7'
+        '&extraneous=any_value',
         client_ip='192.168.1.1'
     )
 
     assert response['status'] == '404 Not Found'
     assert ('Content-Type', 'text/html') in response['headers']
-    assert response['body'] == b'Error 404: one or two parameters allowed'
+    assert response['body'] == b'Error 404: one to four parameters allowed'
 
     mock_logger.return_value.warning.assert_called_once_with(
-        '192.168.1.1 GET /?sheetname=test_sheet&ip=192.168.1.1'
-        '&extraneous=any_value 404 '
-        '(only one or two parameters allowed)')
+        '192.168.1.1 GET /?sheetname=test_sheet&ip=192.168.1.1&copies=2'
+        '&seed=7&extraneous=any_value 404 '
+        '(only one to four parameters allowed)')
 
 
 def test_wsgi_app_404_missing_sheetname(mocker,
@@ -184,13 +191,14 @@ def test_wsgi_app_404_missing_sheetname(mocker,
     assert response['status'] == '404 Not Found'
     assert ('Content-Type', 'text/html') in response['headers']
     assert response['body'] \
-        == b'Error 404: sheetname must be in parameters. Only ip is accepted '\
-           b'as other possible argument.'
+        == b'Error 404: sheetname must be in parameters. Only ip, copies '\
+           b'and seed are accepted as other possible arguments.'
 
     mock_logger.return_value.warning.assert_called_once_with(
         '192.168.1.1 GET /?ip=192.168.1.1&extraneous_parameter=any_value '
         '404 '
-        '(sheetname not in query or second argument different from ip)')
+        '(sheetname not in query or other argument different from ip, '
+        'copies and seed)')
 
 
 def test_wsgi_app_404_unknown_sheetname(mocker,
@@ -227,13 +235,14 @@ def test_wsgi_app_404_second_arg_not_ip(mocker,
     assert response['status'] == '404 Not Found'
     assert ('Content-Type', 'text/html') in response['headers']
     assert response['body'] \
-        == b'Error 404: sheetname must be in parameters. Only ip is accepted '\
-           b'as other possible argument.'
+        == b'Error 404: sheetname must be in parameters. Only ip, copies '\
+           b'and seed are accepted as other possible arguments.'
 
     mock_logger.return_value.warning.assert_called_once_with(
         '192.168.1.1 GET /?sheetname=test_sheet&unknown_arg=value '
         '404 '
-        '(sheetname not in query or second argument different from ip)')
+        '(sheetname not in query or other argument different from ip, '
+        'copies and seed)')
 
 
 def test_wsgi_app_429_block_IP_scenario1(mocker,
@@ -304,6 +313,96 @@ def test_wsgi_app_400_unknown_parameter(mocker,
         '&ip=192.168.1.1 400 (unknown parameter)')
 
 
+def test_wsgi_app_200_with_copies(mocker, mock_dependencies,
+                                  wsgi_app_factory):
+    mock_logger = mocker.patch('mathmaker.lib.tools.mmd_app.logging.getLogger',
+                               autospec=True)
+    mock_logger.return_value = MagicMock()
+    mock_reservoir = MagicMock()
+    mock_reservoir.__contains__.return_value = True
+    mocker.patch('mathmaker.lib.tools.mmd_app.reservoir', mock_reservoir)
+    response = wsgi_app_factory(
+        path='/?sheetname=test_sheet&ip=192.168.1.1&copies=3',
+        client_ip='192.168.1.1',
+    )
+
+    mock_reservoir.pop.assert_not_called()
+    mock_dependencies['popen'].assert_called_once_with(
+        ['mathmaker', '--pdf', '--copies', '3', 'test_sheet'], stdout=-1)
+    assert response['status'] == '200 OK'
+
+
+@pytest.mark.parametrize('copies', ['0', '41', 'two', '-1', '²', '٣'])
+def test_wsgi_app_400_wrong_copies(mocker, mock_dependencies,
+                                   wsgi_app_factory, copies):
+    mock_logger = mocker.patch('mathmaker.lib.tools.mmd_app.logging.getLogger',
+                               autospec=True)
+    mock_logger.return_value = MagicMock()
+    response = wsgi_app_factory(path=f'/?sheetname=test_sheet&copies={copies}')
+
+    mock_dependencies['popen'].assert_not_called()
+    assert response['status'] == '400 Bad Request'
+    assert response['body'] \
+        == b'Error 400: copies must be an integer from 1 to 40.'
+    mock_logger.return_value.warning.assert_called_once_with(
+        f'127.0.0.1 GET /?sheetname=test_sheet&copies={copies} '
+        f'400 (wrong number of copies)')
+
+
+def test_wsgi_app_400_interactive_copies(mocker, mock_dependencies,
+                                         wsgi_app_factory):
+    mock_logger = mocker.patch('mathmaker.lib.tools.mmd_app.logging.getLogger',
+                               autospec=True)
+    mock_logger.return_value = MagicMock()
+    response = wsgi_app_factory(
+        path='/?sheetname=test_sheet|interactive&copies=2')
+
+    mock_dependencies['popen'].assert_not_called()
+    assert response['status'] == '400 Bad Request'
+    assert response['body'] \
+        == b'Error 400: interactive sheets cannot be copied.'
+
+
+def test_wsgi_app_200_with_seed(mocker, mock_dependencies,
+                               wsgi_app_factory):
+    mock_logger = mocker.patch('mathmaker.lib.tools.mmd_app.logging.getLogger',
+                               autospec=True)
+    mock_logger.return_value = MagicMock()
+    mock_reservoir = MagicMock()
+    mock_reservoir.__contains__.return_value = True
+    mocker.patch('mathmaker.lib.tools.mmd_app.reservoir', mock_reservoir)
+    response = wsgi_app_factory(
+        path='/?sheetname=test_sheet&ip=192.168.1.1&copies=2&seed=42',
+        client_ip='192.168.1.1',
+    )
+
+    mock_reservoir.pop.assert_not_called()
+    # The pdf cache is disabled: mathmaker is spawned
+    mock_dependencies['open_pdf_cache'].assert_called_once_with()
+    mock_dependencies['popen'].assert_called_once_with(
+        ['mathmaker', '--pdf', '--copies', '2', '--seed', '42', 'test_sheet'],
+        stdout=-1)
+    assert response['status'] == '200 OK'
+
+
+@pytest.mark.parametrize('seed', ['-1', 'abc', '1.5', '1' * 21, '²',
+                                  '٣'])
+def test_wsgi_app_400_wrong_seed(mocker, mock_dependencies,
+                                 wsgi_app_factory, seed):
+    mock_logger = mocker.patch('mathmaker.lib.tools.mmd_app.logging.getLogger',
+                               autospec=True)
+    mock_logger.return_value = MagicMock()
+    response = wsgi_app_factory(path=f'/?sheetname=test_sheet&seed={seed}')
+
+    mock_dependencies['popen'].assert_not_called()
+    assert response['status'] == '400 Bad Request'
+    assert response['body'] \
+        == b'Error 400: seed must be a non-negative integer.'
+    mock_logger.return_value.warning.assert_called_once_with(
+        f'127.0.0.1 GET /?sheetname=test_sheet&seed={seed} '
+        f'400 (wrong seed)')
+
+
 def test_wsgi_app_500_external_script_failed(mocker,
                                              mock_dependencies,
                                              wsgi_app_factory):
@@ -330,3 +429,124 @@ def test_mmd_app():
     from mathmaker.lib.tools.mmd_app import mmd_app, request_handler
     app = mmd_app()
     assert app == request_handler
+
+
+def test_wsgi_app_200_seeded_from_pdf_cache(mocker, mock_dependencies,
+                                            wsgi_app_factory):
+    mock_logger = mocker.patch('mathmaker.lib.tools.mmd_app.logging.getLogger',
+                               autospec=True)
+    mock_logger.return_value = MagicMock()
+    mock_cache = MagicMock()
+    mock_cache.get.return_value = b'cached pdf content'
+    mocker.patch('mathmaker.lib.tools.mmd_app.pdf_cache', mock_cache)
+    mock_key = mocker.patch('mathmaker.lib.tools.pdf_cache.seeded_key',
+                            return_value='key')
+    response = wsgi_app_factory(path='/?sheetname=test_sheet&seed=42')
+
+    mock_key.assert_called_once_with('test_sheet', 42, shift=False,
+                                     enable_js_form=False, copies=1)
+    mock_cache.get.assert_called_once_with('key')
+    mock_dependencies['popen'].assert_not_called()
+    assert response['status'] == '200 OK'
+    assert response['body'] == b'cached pdf content'
+
+
+def test_wsgi_app_200_seeded_not_in_pdf_cache(mocker, mock_dependencies,
+                                              wsgi_app_factory):
+    mock_logger = mocker.patch('mathmaker.lib.tools.mmd_app.logging.getLogger',
+                               autospec=True)
+    mock_logger.return_value = MagicMock()
+    mock_cache = MagicMock()
+    mock_cache.get.return_value = None
+    mocker.patch('mathmaker.lib.tools.mmd_app.pdf_cache', mock_cache)
+    mocker.patch('mathmaker.lib.tools.pdf_cache.seeded_key',
+                 return_value='key')
+    response = wsgi_app_factory(path='/?sheetname=test_sheet&seed=42')
+
+    mock_dependencies['popen'].assert_called_once_with(
+        ['mathmaker', '--pdf', '--seed', '42', 'test_sheet'], stdout=-1)
+    assert response['body'] == b'mock pdf content'
+
+
+def test_wsgi_app_200_with_pool(mocker, mock_dependencies, wsgi_app_factory):
+    mock_logger = mocker.patch('mathmaker.lib.tools.mmd_app.logging.getLogger',
+                               autospec=True)
+    mock_logger.return_value = MagicMock()
+    mock_pool = MagicMock()
+    mock_pool.generate.return_value = b'pooled pdf content'
+    mocker.patch('mathmaker.lib.tools.mmd_app.pool', mock_pool)
+    response = wsgi_app_factory(path='/?sheetname=test_sheet|interactive')
+
+    mock_pool.generate.assert_called_once_with('test_sheet',
+                                               enable_js_form=True,
+                                               copies=1, seed=None)
+    mock_dependencies['popen'].assert_not_called()
+    assert response['status'] == '200 OK'
+    assert response['body'] == b'pooled pdf content'
+
+
+def test_wsgi_app_503_pool_full(mocker, mock_dependencies, wsgi_app_factory):
+    import queue
+    mock_logger = mocker.patch('mathmaker.lib.tools.mmd_app.logging.getLogger',
+                               autospec=True)
+    mock_logger.return_value = MagicMock()
+    mock_pool = MagicMock()
+    mock_pool.generate.side_effect = queue.Full
+    mocker.patch('mathmaker.lib.tools.mmd_app.pool', mock_pool)
+    response = wsgi_app_factory(path='/?sheetname=test_sheet')
+
+    assert response['status'] == '503 Service Unavailable'
+    assert response['body'] == b'Error 503: server busy, try again later'
+    mock_logger.return_value.warning.assert_called_once_with(
+        '127.0.0.1 GET /?sheetname=test_sheet 503 (workers pool is full)')
+
+
+def test_create_pool_disabled():
+    from mathmaker.lib.tools.mmd_pool import create_pool
+    assert create_pool({'pool': {'enabled': False}}) is None
+    assert create_pool({}) is None
+
+
+def test_create_pool_enabled(mocker):
+    mock_worker_pool = mocker.patch(
+        'mathmaker.lib.tools.mmd_pool.WorkerPool')
+    from mathmaker.lib.tools.mmd_pool import create_pool
+    create_pool({'pool': {'enabled': True, 'size': 4}})
+    mock_worker_pool.assert_called_once_with(pdf_cache=False,
+                                             preamble_format=False,
+                                             profile_draws='', size=4,
+                                             queue_depth=8,
+                                             max_jobs_per_worker=50,
+                                             timeout=120)
+
+
+def test_wsgi_app_200_from_reservoir(mocker, mock_dependencies,
+                                     wsgi_app_factory):
+    mock_logger = mocker.patch('mathmaker.lib.tools.mmd_app.logging.getLogger',
+                               autospec=True)
+    mock_logger.return_value = MagicMock()
+    mock_reservoir = MagicMock()
+    mock_reservoir.__contains__.return_value = True
+    mock_reservoir.pop.return_value = b'stored pdf content'
+    mocker.patch('mathmaker.lib.tools.mmd_app.reservoir', mock_reservoir)
+    response = wsgi_app_factory(path='/?sheetname=test_sheet')
+
+    mock_reservoir.pop.assert_called_once_with('test_sheet')
+    mock_dependencies['popen'].assert_not_called()
+    assert response['status'] == '200 OK'
+    assert response['body'] == b'stored pdf content'
+    mock_logger.return_value.info.assert_called_once_with(
+        '127.0.0.1 GET /?sheetname=test_sheet 200 (from reservoir)')
+
+
+def test_wsgi_app_200_empty_reservoir(mocker, mock_dependencies,
+                                      wsgi_app_factory):
+    mock_reservoir = MagicMock()
+    mock_reservoir.__contains__.return_value = True
+    mock_reservoir.pop.return_value = None
+    mocker.patch('mathmaker.lib.tools.mmd_app.reservoir', mock_reservoir)
+    response = wsgi_app_factory(path='/?sheetname=test_sheet')
+
+    mock_dependencies['popen'].assert_called_once_with(
+        ['mathmaker', '--pdf', 'test_sheet'], stdout=-1)
+    assert response['body'] == b'mock pdf content'
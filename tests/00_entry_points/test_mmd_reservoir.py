@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+# Mathmaker creates automatically maths exercises sheets
+# with their answers
+# Copyright 2006-2017 Nicolas Hainaux <nh.techn@gmail.com>
+
+# This file is part of Mathmaker.
+
+# Mathmaker is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# any later version.
+
+# Mathmaker is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Mathmaker; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import time
+import itertools
+
+import pytest
+
+from mathmaker.lib.tools.mmd_reservoir import Reservoir, create_reservoir
+
+
+@pytest.fixture
+def fake_generate():
+    counter = itertools.count()
+
+    def generate(sheet_name):
+        return f'{sheet_name} {next(counter)}'.encode()
+
+    return generate
+
+
+def test_reservoir_fill_and_pop(fake_generate):
+    r = Reservoir(fake_generate, {'sheet1': {'size': 3, 'low_water': 1}})
+    r.close()
+    assert 'sheet1' in r
+    assert 'sheet2' not in r
+    assert r.level('sheet1') == 3
+    served = {r.pop('sheet1') for _ in range(3)}
+    assert len(served) == 3
+    assert r.pop('sheet1') is None
+
+
+def test_reservoir_refills_under_low_water(fake_generate):
+    r = Reservoir(fake_generate, {'sheet1': {'size': 3, 'low_water': 2}},
+                  threads=2)
+    r.pop('sheet1')
+    r.pop('sheet1')
+    r.close()
+    assert r.level('sheet1') == 3
+
+
+def test_reservoir_eviction(fake_generate):
+    r = Reservoir(fake_generate, {'sheet1': {'size': 2, 'low_water': 1}},
+                  max_age=-1)
+    r.close()
+    assert r.level('sheet1') == 0
+    assert r.pop('sheet1') is None
+
+
+def test_reservoir_replaces_evicted_documents(fake_generate):
+    r = Reservoir(fake_generate, {'sheet1': {'size': 2, 'low_water': 1}},
+                  max_age=0.5)
+    time.sleep(0.2)
+    with r._lock:
+        first = {document for _, document in r._stock['sheet1']}
+    assert len(first) == 2
+    # No request comes: the refilling thread replaces the outdated documents
+    time.sleep(0.6)
+    with r._lock:
+        stock = {document for _, document in r._stock['sheet1']}
+    r.close()
+    assert len(stock) == 2
+    assert not stock & first
+
+
+def test_create_reservoir(mocker, fake_generate):
+    assert create_reservoir({}, fake_generate) is None
+    assert create_reservoir({'reservoir': {'enabled': True}},
+                            fake_generate) is None
+    mock_reservoir = mocker.patch(
+        'mathmaker.lib.tools.mmd_reservoir.Reservoir')
+    create_reservoir({'reservoir': {'enabled': True,
+                                    'sheets': {'s1': None,
+                                               's2': {'size': 10}}}},
+                     fake_generate)
+    mock_reservoir.assert_called_once_with(
+        fake_generate,
+        {'s1': {'size': 5, 'low_water': 2},
+         's2': {'size': 10, 'low_water': 2}},
+        max_age=3600, threads=1)
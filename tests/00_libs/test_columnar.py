@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+# Mathmaker creates automatically maths exercises sheets
+# with their answers
+# Copyright 2006-2017 Nicolas Hainaux <nh.techn@gmail.com>
+
+# This file is part of Mathmaker.
+
+# Mathmaker is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# any later version.
+
+# Mathmaker is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Mathmaker; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+
+import sqlite3
+
+from mathmaker.lib.tools import columnar
+
+
+def pairs_db():
+    db = sqlite3.connect(':memory:')
+    db.execute('CREATE TABLE pairs (id INTEGER PRIMARY KEY, nb1 INTEGER, '
+               'nb2 INTEGER, code TEXT, drawDate INTEGER);')
+    db.executemany('INSERT INTO pairs (nb1, nb2, code, drawDate) '
+                   'VALUES (?, ?, ?, 0);',
+                   [(i, j, '{}_{}'.format(i, j))
+                    for i in range(2, 10) for j in range(i, 10)])
+    return db
+
+
+def test_bits():
+    """Check the bitsets' helpers."""
+    bits = columnar.bitset([0, 3, 64, 100], 101)
+    assert bits == 1 | 8 | 1 << 64 | 1 << 100
+    assert columnar.popcount(bits) == 4
+    assert [columnar.nth_bit(bits, n) for n in range(4)] == [0, 3, 64, 100]
+
+
+def test_columnar_source():
+    """Check the draws from memory match the conditions, without repeats."""
+    db = pairs_db()
+    src = columnar.columnar_source('pairs', ['id', 'nb1', 'nb2'], db=db)
+    assert src.size == 36
+    assert src.integer_columns == ['id', 'nb1', 'nb2', 'drawDate']
+    drawn = [src.next(nb1_min=3, nb2_max=5) for _ in range(6)]
+    assert sorted(drawn) == [(3, 3), (3, 4), (3, 5), (4, 4), (4, 5), (5, 5)]
+    assert len(src.pending) == 6
+    assert not tuple(db.execute('SELECT id FROM pairs WHERE drawDate != 0;'))
+    # Two thirds of the drawn rows are reset when all the matching rows are
+    # drawn
+    assert src.next(nb1_min=3, nb2_max=5) in drawn
+    assert columnar.popcount(src.drawn) == 3
+    src._reset()
+    assert not src.drawn
+    # The conditions the engine does not check are left to SQLite
+    assert src.next(code='2_7') == (2, 7)
+    assert src.next(nb1_in=['8'], not_in=['9']) == (8, 8)
+    assert src.next(nb1=4, nb2_mod=5) == (4, 5)
+    assert src.next(nb1='nb2', nb2_ge=9) == (9, 9)
+    assert src.next(timestamped=True, nb1=4, nb2_mod=5) == (4, 5)
+    src.pending.flush()
+    assert tuple(db.execute('SELECT COUNT(*) FROM pairs '
+                            'WHERE drawDate != 0;')) == ((4, ), )
+    # The drawn rows are read from the database
+    src = columnar.columnar_source('pairs', ['id', 'nb1', 'nb2'], db=db)
+    assert columnar.popcount(src.drawn) == 4
+
+
+def test_shared_drawn(tmp_path):
+    """Check the sources of a table do not repeat each other's draws."""
+    db = pairs_db()
+    src1 = columnar.columnar_source('pairs', ['id', 'nb1', 'nb2'], db=db)
+    src2 = columnar.columnar_source('pairs', ['id', 'nb1', 'nb2'], db=db)
+    drawn = [src.next(nb1=2, enablereset=False)
+             for _ in range(4) for src in (src1, src2)]
+    assert sorted(drawn) == [(2, j) for j in range(2, 10)]
+    src2.pending.flush()
+    assert columnar.popcount(src1.drawn) == 8
+    # The draws of another connection are seen too
+    path = str(tmp_path / 'pairs.db')
+    db.execute('VACUUM INTO ?;', (path, ))
+    db1 = sqlite3.connect(path, isolation_level=None)
+    db2 = sqlite3.connect(path, isolation_level=None)
+    src1 = columnar.columnar_source('pairs', ['id', 'nb1', 'nb2'], db=db1)
+    src2 = columnar.columnar_source('pairs', ['id', 'nb1', 'nb2'], db=db2)
+    assert columnar.popcount(src1.drawn) == 8
+    drawn = src2.next(nb1=3)
+    src2.pending.flush()
+    assert columnar.popcount(src1.drawn) == 9
+    assert src1.next(nb1=3, nb2=drawn[1], timestamped=True) == drawn
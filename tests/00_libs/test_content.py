@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+
+# Mathmaker creates automatically maths exercises sheets
+# with their answers
+# Copyright 2006-2017 Nicolas Hainaux <nh.techn@gmail.com>
+
+# This file is part of Mathmaker.
+
+# Mathmaker is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# any later version.
+
+# Mathmaker is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Mathmaker; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+
+import pytest
+
+from mathmaker.lib.document.content import QUESTIONS, get_question_module
+
+
+def test_questions_index():
+    """Checks the index of the questions' modules."""
+    assert QUESTIONS['expand_simple'] \
+        == 'mathmaker.lib.document.content.algebra'
+    assert QUESTIONS['multi_direct'] \
+        == 'mathmaker.lib.document.content.calculation'
+    assert QUESTIONS['angle_measure'] \
+        == 'mathmaker.lib.document.content.geometry'
+    assert 'vocabulary_questions' not in QUESTIONS
+
+
+def test_get_question_module():
+    """Checks the questions' modules are found and imported."""
+    from mathmaker.lib.document.content.calculation import divi_direct
+    assert get_question_module('divi_direct') is divi_direct
+    assert hasattr(get_question_module('pythagorean_theorem'), 'sub_object')
+    with pytest.raises(AttributeError):
+        get_question_module('no_such_question')
@@ -22,12 +22,15 @@
 
 import pytest
 from decimal import Decimal
+from itertools import product
 
 from intspan import intspan
 
 from mathmaker.lib.tools.database import generate_random_decimal_nb
 from mathmaker.lib.tools.database import parse_sql_creation_query
-from mathmaker.lib.tools.database import IntspansProduct
+from mathmaker.lib.tools.database import IntspansProduct, TuplesProduct
+from mathmaker.lib.tools.database import SampledTuples
+from mathmaker.lib.tools.database import SAMPLED_TUPLES_ATTEMPTS
 
 
 def test_intspansproduct_errors():
@@ -386,6 +389,92 @@ def test_intspansproduct_random_draw_distcode():
         assert len(set(d)) == len(d) - 1
 
 
+def test_intspansproduct_compile():
+    """Check the spans are parsed once, with their constructibility."""
+    c = IntspansProduct('4-5×8×12').compiled
+    assert c.values == ((4, 5), (8, ), (12, ))
+    assert c.lengths == (2, 1, 1)
+    assert (c.mini, c.maxi) == ((4, 8, 12), (5, 8, 12))
+    assert c.order == (1, 2, 0)
+    assert c.constructible and c.not_constructible
+    assert IntspansProduct('4-5×8×12').compiled is c
+    assert IntspansProduct('4-5×8×12').spans[0] is c.spans[0]
+    c = IntspansProduct._compile(('3', '4', '7-10'))
+    assert not c.constructible and c.not_constructible
+    c = IntspansProduct._compile(('3-5', '3-5', '3-5'))
+    assert c.constructible and not c.not_constructible
+    c = IntspansProduct('').compiled
+    assert c.mini is None and c.constructible is None
+    assert IntspansProduct._packed_spans(('1', '2-3', '2-4'), '2_1') \
+        == ((intspan('2-3'), intspan('2-3'), intspan('1')), )
+
+
+def test_intspansproduct_feasible_tuples():
+    """Check the tuples drawable under given conditions are listed once."""
+    IntspansProduct._solve.cache_clear()
+    spans = [intspan('2-9'), intspan('2-9'), intspan('2-9')]
+    assert tuple(IntspansProduct._feasible_tuples(
+        [intspan('6-9'), intspan('6-9')], nb1_mod=3, nb2_notmod=3)) \
+        == ((6, 7), (6, 8), (9, 7), (9, 8))
+    assert tuple(IntspansProduct._feasible_tuples(spans, code='3')) \
+        == tuple((n, n, n) for n in range(2, 10))
+    assert len(IntspansProduct._feasible_tuples(spans, code='1_1_1')) \
+        == 8 * 7 * 6
+    assert all(2 * max(t) < sum(t)
+               for t in IntspansProduct._feasible_tuples(spans,
+                                                         constructible=True))
+    IntspansProduct._feasible_tuples(spans, code='3')
+    assert IntspansProduct._solve.cache_info().hits == 1
+    with pytest.raises(RuntimeError) as excinfo:
+        IntspansProduct._feasible_tuples([intspan('1-2'), intspan('1-2')],
+                                         code='1_1', nb1_neq=1, nb2_neq=1)
+    assert str(excinfo.value) == 'Impossible to draw an int tuple from '\
+        "['1-2', '1-2'] under these conditions: nb1_neq=1; nb2_neq=1; "\
+        'code=1_1.\n'
+    # Without conditions linking the numbers, the tuples are not listed
+    feasible = IntspansProduct._feasible_tuples(
+        [intspan('1-1000'), intspan('1-1000')], nb2_mod=10)
+    assert isinstance(feasible, TuplesProduct)
+    assert len(feasible) == 10 ** 5
+    assert feasible[0] == (1, 10) and feasible[-1] == (1000, 1000)
+    assert feasible[12345] == (124, 460)
+    with pytest.raises(IndexError):
+        feasible[10 ** 5]
+    assert IntspansProduct('1-1000×1-1000').feasible() is None
+    # Too many tuples to check the conditions linking their numbers: they
+    # are drawn until one matches
+    sampled = IntspansProduct._feasible_tuples(
+        [intspan('1-1000'), intspan('1-1000')], constructible=False)
+    assert isinstance(sampled, SampledTuples)
+    assert IntspansProduct('1-1000×1-1000').feasible(constructible=False) \
+        is None
+    with pytest.raises(RuntimeError) as excinfo:
+        SampledTuples([[1, 2], [5, 6]], [1, 1], constructible=True,
+                      description="['1-2', '5-6']").draw()
+    assert str(excinfo.value) == "No int tuple drawn from ['1-2', '5-6'] "\
+        'after {} attempts.\n'.format(SAMPLED_TUPLES_ATTEMPTS)
+
+
+def test_intspansproduct_sampled_tuples():
+    """Check the tuples of big linked products are drawn, not listed."""
+    for _ in range(20):
+        t = IntspansProduct('2-100×2-100×2-100')\
+            .random_draw(constructible=True)
+        assert 2 * max(t) < sum(t)
+        t = IntspansProduct('2-100×2-100×2-100').random_draw(code='1_1_1')
+        assert len(set(t)) == 3
+        t = IntspansProduct('31-199×31-199').random_draw(code='1_1')
+        assert t[0] != t[1] and all(31 <= n <= 199 for n in t)
+
+
+def test_tuples_product():
+    """Check the tuples of a product are those of itertools.product()."""
+    values = [[2, 3], [5], [7, 8, 9]]
+    tuples = TuplesProduct(values, [1, 2, 1])
+    assert list(tuples) == [(a, b, b, c) for a, b, c in product(*values)]
+    assert (3, 5, 5, 8) in tuples and len(tuples) == 6
+
+
 def test_parse_sql_creation_query():
     """Check if parse_sql_creation_query parses correctly."""
     assert parse_sql_creation_query('''CREATE TABLE w3l
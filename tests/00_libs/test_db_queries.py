@@ -21,15 +21,18 @@
 # Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
 
 import os
+import re
 import pytest
 import sqlite3
-from collections import namedtuple
+from collections import Counter, namedtuple
 
 from mathmaker import settings
 from mathmaker.lib import shared
-from mathmaker.lib.tools import database
+from mathmaker.lib.tools import database, write_behind
 from mathmaker.lib.document.frames.exercise \
-    import get_nb_sources_from_question_info
+    import get_nb_sources_from_question_info, pop_prefetched
+
+PROBE = re.compile(r'WHERE id = \d+;$')
 
 
 def test_empty_query_result():
@@ -96,3 +99,420 @@ def test_intpairs_for_deci2():
         for (nb_source, xkw) in nbsources_xkw_list:
             drawn = shared.mc_source.next(nb_source, **xkw)
             assert drawn == (9, 9)
+
+
+def test_random_draw():
+    """Check rows are drawn among the right ones, without ORDER BY random()."""
+    db = sqlite3.connect(':memory:')
+    db.execute('CREATE TABLE pairs (id INTEGER PRIMARY KEY, nb1 INTEGER, '
+               'nb2 INTEGER, drawDate INTEGER);')
+    db.executemany('INSERT INTO pairs (nb1, nb2, drawDate) VALUES (?, ?, ?);',
+                   [(i, i + 1, 0) for i in range(2, 10)])
+    db.execute('UPDATE pairs SET drawDate = 1 WHERE nb1 = 2;')
+    src = database.source('pairs', ['id', 'nb1', 'nb2'], db=db)
+    cmd, params = src._cmd(nb1_max=5)
+    assert 'random()' not in cmd
+    assert src._count(cmd, params) == 3
+    drawn = {src._draw(cmd, params)[0][1:] for _ in range(100)}
+    assert drawn == {(3, 4), (4, 5), (5, 6)}
+    assert src._draw(*src._cmd(nb1_min=20)) == ()
+    drawn = {src.next(nb1_max=3, timestamp=False) for _ in range(10)}
+    assert drawn == {(3, 4)}
+
+
+def test_remaining_rows():
+    """Check the rows left are counted once, and the fallbacks counted."""
+    db = sqlite3.connect(':memory:')
+    db.execute('CREATE TABLE pairs (id INTEGER PRIMARY KEY, nb1 INTEGER, '
+               'nb2 INTEGER, drawDate INTEGER);')
+    db.executemany('INSERT INTO pairs (nb1, nb2, drawDate) VALUES (?, ?, 0);',
+                   [(i, i + 1) for i in range(2, 10)])
+    statements = []
+    db.set_trace_callback(statements.append)
+    src = database.source('pairs', ['id', 'nb1', 'nb2'], db=db)
+    drawn = {src.next(nb1_max=4) for _ in range(3)}
+    assert drawn == {(2, 3), (3, 4), (4, 5)}
+    assert len([s for s in statements if 'COUNT(*)' in s]) == 1
+    assert not src.fallbacks
+    # Known to be exhausted: the table is reset without counting again
+    statements.clear()
+    assert src.next(nb1_max=4) in drawn
+    assert 'COUNT(*) FROM (SELECT' not in statements[0]
+    assert src.fallbacks == {'twothirds_reset': 1}
+    # Another query drawing the same rows makes the count too high: the
+    # rows are counted again
+    src._reset()
+    assert src.next(nb1_min=8) in {(8, 9), (9, 10)}
+    src._timestamp({'nb1_min': 8})
+    assert src.next(nb1_min=8) in {(8, 9), (9, 10)}
+    assert src.fallbacks == {'twothirds_reset': 2}
+    src.pending.flush()
+    # One of the two rows has been reset, then drawn again
+    assert tuple(db.execute('SELECT COUNT(*) FROM pairs '
+                            'WHERE drawDate != 0;')) == ((2, ), )
+
+
+def test_single_fallback():
+    """Check only the fallback freeing rows of the query is used."""
+    db = sqlite3.connect(':memory:')
+    db.execute('CREATE TABLE mini_pb_time_wordings (id INTEGER PRIMARY KEY, '
+               'wording_context TEXT, type TEXT, drawDate INTEGER, '
+               'locked INTEGER);')
+    db.executemany('INSERT INTO mini_pb_time_wordings '
+                   '(wording_context, type, drawDate, locked) '
+                   'VALUES (?, ?, 0, 1);',
+                   [('ctxt{}'.format(i), 'type') for i in range(6)])
+    src = database.source('mini_pb_time_wordings',
+                          ['id', 'wording_context', 'type'], db=db)
+    # The rows are only locked: unlocking them is enough
+    assert src.next(lock_equal_contexts=True)[0].startswith('ctxt')
+    assert src.fallbacks == {'unlock': 1}
+    db.execute('CREATE TABLE pairs (id INTEGER PRIMARY KEY, nb1 INTEGER, '
+               'nb2 INTEGER, drawDate INTEGER);')
+    db.executemany('INSERT INTO pairs (nb1, nb2, drawDate) VALUES (?, ?, ?);',
+                   [(i, i + 1, i) for i in range(1, 10)])
+    src = database.source('pairs', ['id', 'nb1', 'nb2'], db=db)
+    # The rows of the query are the last drawn ones, that a reset of the two
+    # thirds of the table would not reset: the table is fully reset at once
+    assert src.next(nb1_min=8) in {(8, 9), (9, 10)}
+    assert src.fallbacks == {'reset': 1}
+    src.pending.flush()
+    assert tuple(db.execute('SELECT COUNT(*) FROM pairs '
+                            'WHERE drawDate != 0;')) == ((1, ), )
+
+
+def test_next_many_remaining_rows():
+    """Check next_many() reuses the counts of the rows left, too."""
+    db = sqlite3.connect(':memory:')
+    db.execute('CREATE TABLE pairs (id INTEGER PRIMARY KEY, nb1 INTEGER, '
+               'nb2 INTEGER, drawDate INTEGER);')
+    db.executemany('INSERT INTO pairs (nb1, nb2, drawDate) VALUES (?, ?, 0);',
+                   [(i, i + 1) for i in range(2, 20)])
+    statements = []
+    db.set_trace_callback(statements.append)
+    src = database.source('pairs', ['id', 'nb1', 'nb2'], db=db)
+    drawn = src.next_many(4, nb1_max=9) + src.next_many(4, nb1_max=9)
+    assert len(set(drawn)) == 8
+    assert len([s for s in statements if 'COUNT(*)' in s]) == 1
+    assert src.pending.counts['pairs'][1][src._cmd(nb1_max=9)] == 0
+
+
+def test_remaining_rows_version(tmp_path):
+    """Check the rows are counted again when they may have been reset."""
+    db = sqlite3.connect(str(tmp_path / 'test.db'))
+    db.execute('CREATE TABLE pairs (id INTEGER PRIMARY KEY, nb1 INTEGER, '
+               'nb2 INTEGER, drawDate INTEGER);')
+    db.executemany('INSERT INTO pairs (nb1, nb2, drawDate) VALUES (?, ?, 0);',
+                   [(i, i + 1) for i in range(2, 10)])
+    db.commit()
+    statements = []
+    db.set_trace_callback(statements.append)
+    src = database.source('pairs', ['id', 'nb1', 'nb2'], db=db)
+    src.next(nb1_max=4)
+    src.next(nb1_max=4)
+    assert len([s for s in statements if 'COUNT(*)' in s]) == 1
+    src.pending.flush()
+    src.next(nb1_max=4)
+    assert len([s for s in statements if 'COUNT(*)' in s]) == 2
+    # Another process resets the table
+    other = sqlite3.connect(str(tmp_path / 'test.db'))
+    other.execute('UPDATE pairs SET drawDate = 0;')
+    other.commit()
+    src.next(nb1_max=4)
+    assert len([s for s in statements if 'COUNT(*)' in s]) == 3
+    assert not src.fallbacks
+
+
+def test_probed_draws():
+    """Check the rows are drawn at random ids, when they are numerous."""
+    db = sqlite3.connect(':memory:')
+    db.execute('CREATE TABLE pairs (id INTEGER PRIMARY KEY, nb1 INTEGER, '
+               'nb2 INTEGER, drawDate INTEGER);')
+    db.executemany('INSERT INTO pairs (nb1, nb2, drawDate) VALUES (?, ?, 0);',
+                   [(i, i + 1) for i in range(2, 42)])
+    statements = []
+    db.set_trace_callback(statements.append)
+    src = database.source('pairs', ['id', 'nb1', 'nb2'], db=db)
+    drawn = Counter(src.next(nb1_max=31, timestamp=False)
+                    for _ in range(3000))
+    assert set(drawn) == {(i, i + 1) for i in range(2, 32)}
+    # Each row is drawn about 100 times
+    assert all(50 < n < 150 for n in drawn.values())
+    assert [s for s in statements if PROBE.search(s)]
+    assert not [s for s in statements if 'OFFSET' in s]
+    # Too few rows selected: they are read at a random position
+    statements.clear()
+    assert src.next(nb1_max=2) == (2, 3)
+    assert not [s for s in statements if PROBE.search(s)]
+    assert [s for s in statements if 'OFFSET' in s]
+
+
+def test_shared_counts():
+    """Check the sources of a table share the counts of its rows."""
+    db = sqlite3.connect(':memory:')
+    db.execute('CREATE TABLE pairs (id INTEGER PRIMARY KEY, nb1 INTEGER, '
+               'nb2 INTEGER, drawDate INTEGER);')
+    db.executemany('INSERT INTO pairs (nb1, nb2, drawDate) VALUES (?, ?, 0);',
+                   [(i, i + 1) for i in range(2, 10)])
+    statements = []
+    db.set_trace_callback(statements.append)
+    src1 = database.source('pairs', ['id', 'nb1', 'nb2'], db=db)
+    src2 = database.source('pairs', ['id', 'nb1', 'nb2'], db=db)
+    src1.next(nb1_max=4)
+    src2.next(nb1_max=4)
+    assert len([s for s in statements if 'COUNT(*)' in s]) == 1
+    assert src1.pending.counts['pairs'][1][src1._cmd(nb1_max=4)] == 1
+    # Writing the updates of another table keeps the counts
+    db.execute('CREATE TABLE singles (id INTEGER PRIMARY KEY, '
+               'drawDate INTEGER);')
+    db.execute('INSERT INTO singles (drawDate) VALUES (0);')
+    src1.pending.add('singles', 'drawDate', [1], 7)
+    src1.pending.flush('singles')
+    src1.next(nb1_max=4)
+    assert len([s for s in statements if 'COUNT(*)' in s]) == 1
+
+
+def test_bound_values():
+    """Check the values are bound to the queries, instead of quoted in."""
+    db = sqlite3.connect(':memory:')
+    db.execute('CREATE TABLE contexts (id INTEGER PRIMARY KEY, '
+               'wording_context TEXT, nb1 INTEGER, locked INTEGER, '
+               'drawDate INTEGER);')
+    db.executemany('INSERT INTO contexts (wording_context, nb1, locked, '
+                   'drawDate) VALUES (?, ?, 0, 0);',
+                   [("children's books", 1), ('cars', 2), ("it's", 3)])
+    src = database.source('contexts', ['id', 'wording_context', 'nb1'],
+                          db=db)
+    cmd, params = src._cmd(wording_context="children's books", nb1_max=2,
+                           not_in=["it's"])
+    assert "children" not in cmd
+    assert params[1:] == ("children's books", 2, "it's", "it's")
+    assert src.next(wording_context="children's books") \
+        == ("children's books", 1)
+    assert src.next(not_in=["children's books", 'cars'],
+                    timestamp=False) == ("it's", 3)
+    src._lock(("it's", ), lock_equal_contexts=True)
+    assert tuple(db.execute('SELECT locked FROM contexts WHERE nb1 = 3;')) \
+        == ((0, ), )  # only mini problems' wordings tables can be locked
+    src._timestamp({'wording_context': "it's"})
+    src.pending.flush()
+    assert tuple(db.execute('SELECT COUNT(*) FROM contexts '
+                            'WHERE drawDate != 0;')) == ((2, ), )
+
+
+def test_statements_cache():
+    """Check the queries are built once, and only the last ones are kept."""
+    db = sqlite3.connect(':memory:')
+    db.execute('CREATE TABLE pairs (id INTEGER PRIMARY KEY, nb1 INTEGER, '
+               'nb2 INTEGER, drawDate INTEGER);')
+    src = database.source('pairs', ['id', 'nb1', 'nb2'], db=db)
+    query = src._cmd(nb1_max=5, not_in=['3'])
+    assert src._cmd(nb1_max=5, not_in=['3']) is query
+    assert src._cmd(nb1_max=5, not_in=['4']) is not query
+    for n in range(database.STATEMENTS_CACHE_SIZE + 10):
+        src._cmd(nb1_max=n)
+    assert len(src._statements) == database.STATEMENTS_CACHE_SIZE
+    assert src._cmd(nb1_max=5, not_in=['3']) is not query
+
+
+def test_write_behind():
+    """Check the timestamps and locks are only written on flush."""
+    db = sqlite3.connect(':memory:')
+    db.execute('CREATE TABLE int_pairs (id INTEGER PRIMARY KEY, nb1 INTEGER, '
+               'nb2 INTEGER, lock_equal_products INTEGER, drawDate INTEGER);')
+    db.executemany('INSERT INTO int_pairs (nb1, nb2, lock_equal_products, '
+                   'drawDate) VALUES (?, ?, 0, 0);',
+                   [(2, 6), (3, 4), (2, 5), (5, 7)])
+    src = database.source('int_pairs', ['id', 'nb1', 'nb2'], db=db)
+    drawn = {src.next(nb1_max=3, lock_equal_products=True,
+                      info_lock={(2, 6): [(3, 4)], (3, 4): [(2, 6)]})
+             for _ in range(2)}
+    assert (2, 5) in drawn
+    assert len(src.pending) == 4
+    assert tuple(db.execute('SELECT COUNT(*) FROM int_pairs '
+                            'WHERE drawDate != 0 '
+                            'OR lock_equal_products != 0;')) == ((0, ), )
+    # Pending timestamps and locks count as written ones
+    assert src.next(nb1_max=3, timestamped=True, timestamp=False) in drawn
+    with pytest.raises(RuntimeError):
+        src.next(nb1_max=3, enablereset=False, lock_equal_products=True,
+                 info_lock={})
+    src.pending.flush()
+    assert not len(src.pending)
+    assert tuple(db.execute('SELECT COUNT(*) FROM int_pairs '
+                            'WHERE drawDate != 0;')) == ((2, ), )
+    assert tuple(db.execute('SELECT COUNT(*) FROM int_pairs '
+                            'WHERE lock_equal_products != 0;')) == ((2, ), )
+    assert src.next(nb1=5) == (5, 7)
+    assert len(src.pending) == 1
+    # A reset writes the pending updates first
+    assert src.next(nb1=5) == (5, 7)
+    assert len(src.pending) == 1
+    buffer = write_behind.WriteBehind(db, threshold=2)
+    buffer.add('int_pairs', 'drawDate', [1], 7)
+    assert len(buffer) == 1
+    buffer.add('int_pairs', 'drawDate', [2], 7)
+    assert not len(buffer)
+    assert tuple(db.execute('SELECT COUNT(*) FROM int_pairs '
+                            'WHERE drawDate = 7;')) == ((2, ), )
+
+
+def test_write_behind_bind():
+    """Check the pending ids are serialized once, until they change."""
+    db = sqlite3.connect(':memory:')
+    db.execute('CREATE TABLE pairs (id INTEGER PRIMARY KEY, nb1 INTEGER, '
+               'drawDate INTEGER);')
+    db.executemany('INSERT INTO pairs (nb1, drawDate) VALUES (?, 0);',
+                   [(i, ) for i in range(4)])
+    buffer = write_behind.WriteBehind(db)
+    pending = write_behind.Pending('pairs', 'drawDate')
+    assert buffer.bind((pending, 3)) == ('[]', 3)
+    buffer.add('pairs', 'drawDate', [1, 2], 7)
+    bound = buffer.bind((pending, ))[0]
+    assert bound == '[1, 2]'
+    assert buffer.bind((pending, ))[0] is bound
+    buffer.add('pairs', 'drawDate', [2], 0)
+    assert buffer.bind((pending, )) == ('[1]', )
+    buffer.flush()
+    assert buffer.bind((pending, )) == ('[]', )
+    buffer.add('pairs', 'drawDate', [3], 7)
+    buffer.drop('pairs', 'drawDate')
+    assert buffer.bind((pending, )) == ('[]', )
+
+
+def test_data_version_reads():
+    """Check data_version is only read to reuse a count, or to keep one."""
+    db = sqlite3.connect(':memory:')
+    db.execute('CREATE TABLE pairs (id INTEGER PRIMARY KEY, nb1 INTEGER, '
+               'nb2 INTEGER, drawDate INTEGER);')
+    db.executemany('INSERT INTO pairs (nb1, nb2, drawDate) VALUES (?, ?, 0);',
+                   [(i, i + 1) for i in range(2, 10)])
+    statements = []
+    db.set_trace_callback(statements.append)
+    src = database.source('pairs', ['id', 'nb1', 'nb2'], db=db)
+    for _ in range(3):
+        src.next(nb1_max=6)
+    assert len([s for s in statements if 'data_version' in s]) == 3
+    statements.clear()
+    src.next(nb1_max=6, timestamped=True, timestamp=False)
+    assert not [s for s in statements if 'data_version' in s]
+    # After a flush, the kept count is obsolete: data_version is not read to
+    # tell, only to keep the new count
+    src.pending.flush()
+    statements.clear()
+    src.next(nb1_max=6)
+    assert len([s for s in statements if 'data_version' in s]) == 1
+    assert len([s for s in statements if 'COUNT(*)' in s]) == 1
+
+
+def test_lookup():
+    """Check the rows are looked up by their values, drawn or not."""
+    db = sqlite3.connect(':memory:')
+    db.execute('CREATE TABLE pairs (id INTEGER PRIMARY KEY, nb1 INTEGER, '
+               'nb2 INTEGER, drawDate INTEGER);')
+    db.executemany('INSERT INTO pairs (nb1, nb2, drawDate) VALUES (?, ?, 0);',
+                   [(2, 6), (3, 4), (2, 5)])
+    src1 = database.source('pairs', ['id', 'nb1', 'nb2'], db=db)
+    src2 = database.source('pairs', ['id', 'nb1', 'nb2'], db=db)
+    assert src1.lookup((7, 8)) is None
+    assert src1.lookup((3, 4)) == (2, False)
+    assert src2.next(nb1=3) == (3, 4)
+    # The pending timestamps, then the written ones, are seen
+    assert src1.lookup((3, 4)) == (2, True)
+    src2.pending.flush()
+    assert src1.lookup((3, 4)) == (2, True)
+    assert src1.lookup([2, 5]) == (3, False)
+    src2._reset()
+    assert src1.lookup((3, 4)) == (2, False)
+    # The drawn rows are read once, until they may have changed
+    src1.lookup((2, 6))
+    db.execute('UPDATE pairs SET drawDate = 1 WHERE id = 1;')
+    assert src1.lookup((2, 6)) == (1, False)
+    src1.pending.reset('pairs')
+    assert src1.lookup((2, 6)) == (1, True)
+
+
+def test_next_many():
+    """Check several rows are drawn at once, as by as many calls to next()."""
+    db = sqlite3.connect(':memory:')
+    db.execute('CREATE TABLE int_pairs (id INTEGER PRIMARY KEY, nb1 INTEGER, '
+               'nb2 INTEGER, lock_equal_products INTEGER, drawDate INTEGER);')
+    db.executemany('INSERT INTO int_pairs (nb1, nb2, lock_equal_products, '
+                   'drawDate) VALUES (?, ?, 0, 0);',
+                   [(i, j) for i in range(2, 10) for j in range(i, 10)])
+    src = database.source('int_pairs', ['id', 'nb1', 'nb2'], db=db)
+    drawn = src.next_many(10, nb1_max=5)
+    assert len(set(drawn)) == 10
+    assert all(nb1 <= 5 for nb1, _ in drawn)
+    drawn = src.next_many(6, distinct_on='nb1', timestamp=False)
+    assert len({nb1 for nb1, _ in drawn}) == 6
+    src._reset()
+    drawn = src.next_many(8, distinct_on='nb2', nb1=2)
+    assert sorted(drawn) == [(2, j) for j in range(2, 10)]
+    # Not enough rows left: the table is reset
+    drawn = src.next_many(3, nb1=2)
+    assert len(set(drawn)) == 3
+    info_lock = {(2, 6): [(3, 4)], (3, 4): [(2, 6)]}
+    for _ in range(10):
+        drawn = src.next_many(2, nb1_max=3, nb2_in=['4', '6'],
+                              lock_equal_products=True, info_lock=info_lock,
+                              timestamp=False)
+        assert not ((2, 6) in drawn and (3, 4) in drawn)
+        src._reset(lock_equal_products=True)
+    # The locks written during the batch still count
+    src.pending.threshold = 2
+    for _ in range(10):
+        drawn = src.next_many(2, nb1_max=3, nb2_in=['4', '6'],
+                              lock_equal_products=True, info_lock=info_lock)
+        assert not ((2, 6) in drawn and (3, 4) in drawn)
+        src._reset(lock_equal_products=True)
+
+
+def test_mc_source_next_many():
+    """Check mc_source draws several values of a tag at once."""
+    drawn = shared.mc_source.next_many(4, 'intpairs_2to9', distinct_on='nb1')
+    assert len({nb1 for nb1, _ in drawn}) == 4
+    assert shared.mc_source.batchable('table_2')
+    assert not shared.mc_source.batchable('nnpairs:2-9×2-9')
+    drawn = shared.mc_source.next_many(3, 'nnpairs:2-9×2-9')
+    assert len(drawn) == 3
+
+
+def test_excludes_and_release():
+    """Check not_in is applied like the query does, and rows are released."""
+    db = sqlite3.connect(':memory:')
+    db.execute('CREATE TABLE int_pairs (id INTEGER PRIMARY KEY, nb1 INTEGER, '
+               'nb2 INTEGER, lock_equal_products INTEGER, drawDate INTEGER);')
+    db.executemany('INSERT INTO int_pairs (nb1, nb2, lock_equal_products, '
+                   'drawDate) VALUES (?, ?, 0, 0);',
+                   [(2, 5), (2, 6), (3, 4), (4, 5)])
+    src = database.source('int_pairs', ['id', 'nb1', 'nb2'], db=db)
+    assert src.excludes((2, 5), not_in=['5'])
+    assert src.excludes((2, 5), not_in=['5.0'])
+    assert not src.excludes((2, 5), not_in=None)
+    assert not src.excludes((2, 5), not_in=['5'], prevails=['5'])
+    assert not src.excludes((2, 5), not_in=['5'], nb2='5')
+    assert src.excludes((2, 5), not_in=['2', '5'], nb2='5')
+    info_lock = {(2, 6): [(3, 4)], (3, 4): [(2, 6)]}
+    assert src.next(nb1=2, nb2=6, lock_equal_products=True,
+                    info_lock=info_lock) == (2, 6)
+    with pytest.raises(RuntimeError):
+        src.next(nb1=3, enablereset=False, lock_equal_products=True,
+                 info_lock=info_lock)
+    src.release((2, 6), lock_equal_products=True, info_lock=info_lock)
+    assert src.next(nb1=3, enablereset=False, lock_equal_products=True,
+                    info_lock=info_lock) == (3, 4)
+    assert src.next(nb2=6, enablereset=False) == (2, 6)
+
+
+def test_pop_prefetched():
+    """Check the prefetched numbers are checked against not_in as in db."""
+    prefetched = [(2, 5), (3, 7), (4, 6)]
+    assert pop_prefetched(prefetched, 'intpairs_2to9',
+                          not_in=['5', '7.0']) == (4, 6)
+    assert pop_prefetched(prefetched, 'intpairs_2to9', not_in=['5', '7'],
+                          prevails=['5']) == (2, 5)
+    assert pop_prefetched(prefetched, 'intpairs_2to9',
+                          not_in=['7']) is None
+    assert pop_prefetched(prefetched, 'intpairs_2to9') == (3, 7)
+    assert prefetched == []
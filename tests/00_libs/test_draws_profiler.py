@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+
+# Mathmaker creates automatically maths exercises sheets
+# with their answers
+# Copyright 2006-2017 Nicolas Hainaux <nh.techn@gmail.com>
+
+# This file is part of Mathmaker.
+
+# Mathmaker is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# any later version.
+
+# Mathmaker is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Mathmaker; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import json
+import sqlite3
+
+import pytest
+
+from mathmaker import settings
+from mathmaker.lib import shared
+from mathmaker.lib.tools import database, draws_profiler
+
+
+@pytest.fixture
+def profiler(monkeypatch):
+    monkeypatch.setattr(shared, 'draws_profiler',
+                        draws_profiler.DrawsProfiler())
+    yield shared.draws_profiler
+
+
+def pairs_db():
+    db = sqlite3.connect(':memory:')
+    db.execute('CREATE TABLE pairs (id INTEGER PRIMARY KEY, nb1 INTEGER, '
+               'nb2 INTEGER, drawDate INTEGER);')
+    db.execute('CREATE INDEX idx_pairs__nb1 ON pairs (nb1);')
+    db.executemany('INSERT INTO pairs (nb1, nb2, drawDate) VALUES (?, ?, 0);',
+                   [(i, j) for i in range(2, 10) for j in range(2, 10)])
+    return db
+
+
+def test_signature_and_buckets():
+    """Check the draws are grouped by the names of their keywords."""
+    assert draws_profiler.signature({'nb1': 2, 'nb2_max': 5,
+                                     'info_lock': {}, 'timestamp': False}) \
+        == ('nb1', 'nb2_max')
+    assert draws_profiler.bucket(0.05) == '<0.1ms'
+    assert draws_profiler.bucket(2) == '<3ms'
+    assert draws_profiler.bucket(5000) == '>=1000ms'
+
+
+def test_profiled_draws(profiler, tmp_path):
+    """Check the draws are timed, once, with the fallbacks and query plans."""
+    src = database.source('pairs', ['id', 'nb1', 'nb2'], db=pairs_db())
+    for nb1 in range(2, 6):
+        src.next(nb1=nb1)
+    src.next_many(3, nb1=7)
+    for _ in range(9):
+        src.next(nb1=8, nb2_max=3)
+    report = profiler.report()
+    assert [(g['name'], g['signature'], g['calls'])
+            for g in sorted(report['tables'], key=lambda g: g['calls'])] \
+        == [('pairs', ['nb1'], 5), ('pairs', ['nb1', 'nb2_max'], 9)]
+    assert all(sum(g['histogram'].values()) == g['calls']
+               for g in report['tables'])
+    assert report['fallbacks'] == {'pairs': dict(src.fallbacks)}
+    assert src.fallbacks['twothirds_reset']
+    assert len(report['worst']) == 2
+    assert any('idx_pairs__nb1' in detail
+               for group in report['worst'] for detail in group['plan'])
+    shared.mc_source.next_many(2, 'intpairs_2to9')
+    assert [(g['name'], g['calls'])
+            for g in profiler.report()['tags']] == [('intpairs_2to9', 1)]
+    profiler.write(str(tmp_path / 'report.json'))
+    with open(str(tmp_path / 'report.json')) as f:
+        assert json.load(f)['fallbacks'] == report['fallbacks']
+    profiler.write(str(tmp_path / 'report.txt'))
+    with open(str(tmp_path / 'report.txt')) as f:
+        text = f.read()
+    assert 'pairs (nb1, nb2_max): 9 draws' in text
+    assert 'pairs: {}'.format(', '.join(
+        '{} {}'.format(name, n)
+        for name, n in sorted(src.fallbacks.items()))) in text
+
+
+def test_report_on_close(tmp_path, monkeypatch):
+    """Check the report is written when the databases are closed."""
+    monkeypatch.setattr(settings, 'profile_draws',
+                        str(tmp_path / 'report.json'), raising=False)
+    shared.close()
+    shared.init()
+    try:
+        assert shared.draws_profiler is not None
+        shared.nnpairs_source.next()
+    finally:
+        shared.close()
+        monkeypatch.setattr(settings, 'profile_draws', '')
+        shared.init()
+    with open(str(tmp_path / 'report.json')) as f:
+        assert [g['name'] for g in json.load(f)['tables']] == ['pairs']
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+
+# Mathmaker creates automatically maths exercises sheets
+# with their answers
+# Copyright 2006-2017 Nicolas Hainaux <nh.techn@gmail.com>
+
+# This file is part of Mathmaker.
+
+# Mathmaker is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# any later version.
+
+# Mathmaker is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Mathmaker; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+from mathmaker.lib.tools import feasibility
+
+
+def test_status():
+    """Check the statuses of the sources, from their counts."""
+    assert feasibility.status(3, None) == feasibility.UNCHECKED
+    assert feasibility.status(3, (0, 0)) == feasibility.EMPTY
+    assert feasibility.status(3, (2, 2)) == feasibility.TOO_FEW
+    assert feasibility.status(3, (10, 2)) == feasibility.RUNNING_OUT
+    assert feasibility.status(3, (10, 3)) == feasibility.OK
+
+
+def test_count_source():
+    """Check the values the sources may provide are counted."""
+    assert feasibility.count_source('nnpairs:3-9')[0] == 28
+    assert feasibility.count_source('nnpairs:3-9', code='2')[0] == 7
+    assert feasibility.count_source('nnpairs:3-9', code='1_1')[0] == 21
+    assert feasibility.count_source('nntriples:2-3', code='1_1_1') == (0, 0)
+    assert feasibility.count_source('nnsingletons:1-100000') is None
+    total, fresh = feasibility.count_source('table_2')
+    assert 0 < fresh <= total
+    assert feasibility.count_source('default') is None
+
+
+def test_check_sheet():
+    """Check the sources of a sheet are gathered and counted."""
+    rows = feasibility.check_sheet('y1b4_operations_vocabulary')
+    assert not any(feasibility.failed(row) for row in rows)
+    assert [row.needed for row in rows if row.source == 'nnpairs:4-9'] == [2]
+    rows = feasibility.check_sheet('no_such_sheet')
+    assert len(rows) == 1 and feasibility.failed(rows[0])
+    report = feasibility.report(rows)
+    assert 'no_such_sheet' in report
+    assert report.endswith('1 source(s) checked, 1 flagged.\n')
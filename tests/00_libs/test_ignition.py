@@ -25,7 +25,9 @@ import pytest
 from mathmaker.lib.tools.ignition import (check_dependency,
                                           check_dependencies,
                                           install_gettext_translations,
-                                          check_settings_consistency)
+                                          check_settings_consistency,
+                                          load_dependencies_cache,
+                                          save_dependencies_cache)
 
 
 def test_check_dependency_01():
@@ -47,6 +49,37 @@ def test_check_dependencies():
     assert check_dependencies()
 
 
+def test_check_dependency_cache(mocker):
+    """Checks a cached version is reused while the executable is the same."""
+    fp = mocker.patch('mathmaker.lib.tools.ignition.executable_fingerprint',
+                      return_value=['/usr/bin/xmllint', 100, 1])
+    probe = mocker.patch('mathmaker.lib.tools.ignition.probe_version',
+                         return_value='20914')
+    cache = {}
+    assert check_dependency('xmllint', 'read', 'xmllint', '20901',
+                            cache=cache)
+    assert cache == {'xmllint': {'fingerprint': ['/usr/bin/xmllint', 100, 1],
+                                 'version': '20914'}}
+    assert check_dependency('xmllint', 'read', 'xmllint', '20901',
+                            cache=cache)
+    probe.assert_called_once()
+    fp.return_value = ['/usr/bin/xmllint', 100, 2]
+    probe.return_value = '20800'
+    with pytest.raises(EnvironmentError):
+        check_dependency('xmllint', 'read', 'xmllint', '20901', cache=cache)
+    assert probe.call_count == 2
+    assert cache['xmllint']['version'] == '20800'
+
+
+def test_dependencies_cache_file(tmp_path):
+    """Checks the dependencies' versions are saved and loaded."""
+    cache_path = str(tmp_path / 'sub' / 'dependencies.json')
+    assert load_dependencies_cache(cache_path) == {}
+    save_dependencies_cache({'xmllint': {'version': '20914'}}, cache_path)
+    assert load_dependencies_cache(cache_path) \
+        == {'xmllint': {'version': '20914'}}
+
+
 def test_install_gettext_translations_01():
     """Checks an exception is raised for an unsupported language."""
     with pytest.raises(EnvironmentError):
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+
+# Mathmaker creates automatically maths exercises sheets
+# with their answers
+# Copyright 2006-2017 Nicolas Hainaux <nh.techn@gmail.com>
+
+# This file is part of Mathmaker.
+
+# Mathmaker is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# any later version.
+
+# Mathmaker is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Mathmaker; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import os
+import sys
+import queue
+import logging
+import subprocess
+import threading
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+
+import pytest
+
+from mathmaker.lib.tools import mmd_pool
+
+
+@pytest.fixture
+def thread_pool(monkeypatch):
+    """A WorkerPool of one thread, having no room for a second job."""
+    done = threading.Event()
+    monkeypatch.setattr(mmd_pool, 'generate',
+                        lambda sheet_name, **kwargs: done.wait() and b'pdf')
+    pool = mmd_pool.WorkerPool.__new__(mmd_pool.WorkerPool)
+    pool.log = logging.getLogger('pool')
+    pool.size = 1
+    pool.timeout = 0.05
+    pool._slots = threading.BoundedSemaphore(1)
+    pool._pool = ThreadPool(1)
+    yield pool, done
+    done.set()
+    pool.close()
+
+
+def test_slot_kept_until_done(thread_pool):
+    """Checks a job keeps its slot after a timeout, until it is done."""
+    pool, done = thread_pool
+    with pytest.raises(multiprocessing.TimeoutError):
+        pool.generate('sheet')
+    # The worker is still busy with the first job
+    with pytest.raises(queue.Full):
+        pool.generate('sheet')
+    done.set()
+    # The slot is freed once the first job is done
+    assert pool._slots.acquire(timeout=5)
+    pool._slots.release()
+    pool.timeout = 5
+    assert pool.generate('sheet') == b'pdf'
+
+
+def test_worker_generates_a_document():
+    """Checks a worker's startup sequence is enough to build a document."""
+    # In a new process, where conftest.py did not check the dependencies
+    script = ('import sys\n'
+              'from mathmaker import settings\n'
+              'from mathmaker.lib.tools.mmd_pool \\\n'
+              '    import init_worker, generate\n'
+              'init_worker()\n'
+              'assert settings.luatex_version\n'
+              "document = generate('order_of_operations_positive_numbers')\n"
+              'sys.stdout.buffer.write(document[:4])\n')
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    result = subprocess.run([sys.executable, '-c', script], env=env,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            timeout=300)
+    assert result.returncode == 0, result.stderr.decode()
+    assert result.stdout == b'%PDF'
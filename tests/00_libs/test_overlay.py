@@ -0,0 +1,284 @@
+# -*- coding: utf-8 -*-
+
+# Mathmaker creates automatically maths exercises sheets
+# with their answers
+# Copyright 2006-2017 Nicolas Hainaux <nh.techn@gmail.com>
+
+# This file is part of Mathmaker.
+
+# Mathmaker is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# any later version.
+
+# Mathmaker is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Mathmaker; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+
+import sqlite3
+
+from mathmaker import settings
+from mathmaker.lib.tools import columnar, database, overlay, queries_census
+from mathmaker.lib.tools import write_behind
+
+
+def dist_db(path):
+    db = sqlite3.connect(str(path))
+    db.execute('CREATE TABLE int_pairs (id INTEGER PRIMARY KEY, nb1 INTEGER, '
+               'nb2 INTEGER, lock_equal_products INTEGER, drawDate INTEGER);')
+    db.execute('CREATE TABLE names (id INTEGER PRIMARY KEY, name TEXT);')
+    db.executemany('INSERT INTO int_pairs (nb1, nb2, lock_equal_products, '
+                   'drawDate) VALUES (?, ?, 0, 0);',
+                   [(2, 6), (3, 4), (2, 5), (5, 7)])
+    db.commit()
+    db.close()
+
+
+def test_overlay(tmp_path):
+    """Check the state of the rows is written aside of the dist database."""
+    dist_db(tmp_path / 'test.db-dist')
+    db = overlay.connect(str(tmp_path / 'test.db-dist'),
+                         str(tmp_path / 'test-state.db'))
+    src = database.source('int_pairs', ['id', 'nb1', 'nb2'], db=db)
+    drawn = {src.next(nb1=2) for _ in range(2)}
+    assert drawn == {(2, 6), (2, 5)}
+    src._lock((2, 6), lock_equal_products=True,
+              info_lock={(2, 6): [(3, 4)]})
+    src.pending.flush()
+    db.commit()
+    assert sorted(db.execute('SELECT id, drawDate != 0, lock_equal_products '
+                             'FROM int_pairs;')) \
+        == [(1, 1, 1), (2, 0, 1), (3, 1, 0), (4, 0, 0)]
+    assert tuple(db.execute('SELECT COUNT(*) FROM state.freshness;')) \
+        == ((3, ), )
+    # The rows are back to their initial state, and dropped from the state
+    src._reset(lock_equal_products=True)
+    assert not tuple(db.execute('SELECT * FROM state.freshness;'))
+    assert src.next(nb1=2) in drawn
+    src.pending.flush()
+    assert tuple(db.execute('SELECT tbl, id FROM state.freshness;')) \
+        in ((('int_pairs', 1), ), (('int_pairs', 3), ))
+    db.commit()
+    db.close()
+    db = sqlite3.connect(str(tmp_path / 'test.db-dist'))
+    assert tuple(db.execute('SELECT COUNT(*) FROM int_pairs '
+                            'WHERE drawDate != 0 '
+                            'OR lock_equal_products != 0;')) == ((0, ), )
+
+
+def test_state_read_directly(tmp_path):
+    """Check the resets read and write the state of the rows directly."""
+    dist_db(tmp_path / 'test.db-dist')
+    db = overlay.connect(str(tmp_path / 'test.db-dist'),
+                         str(tmp_path / 'test-state.db'))
+    src = database.source('int_pairs', ['id', 'nb1', 'nb2'], db=db)
+    drawn = [src.next() for _ in range(3)]
+    src.pending.flush()
+    assert src.pending.count('int_pairs', 'drawDate') == 3
+    statements = []
+    db.set_trace_callback(statements.append)
+    src._twothirds_reset()
+    src._unlock()
+    db.set_trace_callback(None)
+    statements = [s for s in statements if 'drawDate' in s or 'locked' in s]
+    assert statements
+    for s in statements:
+        assert 'freshness' in s
+        # The state's indexes are used, the freshness table is not scanned
+        plan = ' '.join(row[-1]
+                        for row in db.execute('EXPLAIN QUERY PLAN ' + s))
+        assert 'USING' in plan and 'SCAN' not in plan
+        for col in overlay.STATE_COLUMNS:
+            if '{} != 0'.format(col) in s:
+                assert queries_census.index_name(
+                    'freshness', ['tbl', col]) in plan
+    # The two oldest timestamps are reset
+    assert tuple(db.execute('SELECT nb1, nb2 FROM int_pairs '
+                            'WHERE drawDate != 0;')) == (drawn[2], )
+    assert src.pending.written_ids('int_pairs', 'drawDate') \
+        == [row[0] for row in db.execute('SELECT id FROM int_pairs '
+                                         'WHERE drawDate != 0;')]
+    assert tuple(db.execute('SELECT COUNT(*) FROM state.freshness;')) \
+        == ((1, ), )
+    db.close()
+
+
+def test_lookup(tmp_path):
+    """Check the drawn rows are looked up in the state of the rows."""
+    dist_db(tmp_path / 'test.db-dist')
+    db = overlay.connect(str(tmp_path / 'test.db-dist'),
+                         str(tmp_path / 'test-state.db'))
+    src = database.source('int_pairs', ['id', 'nb1', 'nb2'], db=db)
+    assert src.lookup((3, 4)) == (2, False)
+    assert src.next(nb1=3) == (3, 4)
+    src.pending.flush()
+    statements = []
+    db.set_trace_callback(statements.append)
+    assert src.lookup((3, 4)) == (2, True)
+    assert src.lookup((2, 6)) == (1, False)
+    db.set_trace_callback(None)
+    # The drawn rows are read once, from the freshness table
+    reads = [s for s in statements if 'drawDate' in s]
+    assert len(reads) == 1 and 'FROM state.freshness' in reads[0]
+    db.close()
+
+
+def test_columnar_drawn(tmp_path):
+    """Check a columnar source reads the drawn rows in the state table."""
+    dist_db(tmp_path / 'test.db-dist')
+    db = overlay.connect(str(tmp_path / 'test.db-dist'),
+                         str(tmp_path / 'test-state.db'))
+    src = columnar.columnar_source('int_pairs', ['id', 'nb1', 'nb2'], db=db)
+    assert src.next(nb1=3) == (3, 4)
+    src.pending.flush()
+    statements = []
+    db.set_trace_callback(statements.append)
+    assert src.drawn == columnar.bitset([src.positions[2]], src.size)
+    db.set_trace_callback(None)
+    reads = [s for s in statements if 'drawDate' in s]
+    assert len(reads) == 1 and 'FROM state.freshness' in reads[0]
+    db.close()
+
+
+def test_attached(tmp_path):
+    """Check the attached databases share the connection and its state."""
+    dist_db(tmp_path / 'test.db-dist')
+    other = sqlite3.connect(str(tmp_path / 'other.db-dist'))
+    other.execute('CREATE TABLE pairs (id INTEGER PRIMARY KEY, nb1 INTEGER, '
+                  'nb2 INTEGER, drawDate INTEGER);')
+    other.executemany('INSERT INTO pairs (nb1, nb2, drawDate) '
+                      'VALUES (?, ?, 0);', [(2, 6), (4, 7)])
+    other.commit()
+    other.close()
+    db = overlay.connect(str(tmp_path / 'test.db-dist'),
+                         str(tmp_path / 'test-state.db'),
+                         attached={'other': str(tmp_path / 'other.db-dist')})
+    src = database.source('pairs', ['id', 'nb1', 'nb2'], db=db)
+    assert src.next(nb1=4) == (4, 7)
+    src.pending.flush()
+    assert tuple(db.execute('SELECT tbl, id FROM state.freshness;')) \
+        == (('pairs', 2), )
+    # The tables of both databases can be joined
+    assert tuple(db.execute('SELECT p.id FROM int_pairs AS i '
+                            'JOIN pairs AS p '
+                            'ON i.nb1 = p.nb1 AND i.nb2 = p.nb2;')) \
+        == ((1, ), )
+    db.close()
+
+
+def test_dist_indexes():
+    """Check the state columns are dropped from the indexes."""
+    assert overlay.dist_indexes({'int_pairs': [['drawDate', 'nb1'],
+                                               ['nb1'],
+                                               ['drawDate'],
+                                               ['nb2', 'drawDate', 'nb1']],
+                                 'polygons': [['drawDate']]}) \
+        == {'int_pairs': [['nb1'], ['nb2', 'nb1']]}
+
+
+def test_indexes_used(tmp_path):
+    """Check the draw queries on the views use the shipped indexes."""
+    dist_db(tmp_path / 'test.db-dist')
+    db = sqlite3.connect(str(tmp_path / 'test.db-dist'))
+    queries_census.create_indexes(
+        db, overlay.dist_indexes({'int_pairs': [['drawDate', 'nb1']]}))
+    db.commit()
+    db.close()
+    db = overlay.connect(str(tmp_path / 'test.db-dist'),
+                         str(tmp_path / 'test-state.db'))
+    src = database.source('int_pairs', ['id', 'nb1', 'nb2'], db=db)
+    cmd, params = src._cmd(nb1=2)
+    plan = ' '.join(row[-1] for row in db.execute(
+        'EXPLAIN QUERY PLAN ' + cmd, src.pending.bind(params)))
+    assert 'USING INDEX {}'.format(queries_census.index_name(
+        'int_pairs', ['nb1'])) in plan
+    assert src.next(nb1=2) in {(2, 6), (2, 5)}
+
+
+def expected_indexes(name):
+    """The names of the indexes of the shipped database name."""
+    indexes = overlay.dist_indexes(queries_census.load_indexes()
+                                   .get(name, {}))
+    return {queries_census.index_name(table, cols)
+            for table, cols_list in indexes.items() for cols in cols_list}
+
+
+def test_create_dist_indexes(tmp_path):
+    """Check the indexes of sql_indexes.json are created, as build_db does."""
+    databases = {}
+    for name, indexes in queries_census.load_indexes().items():
+        db = sqlite3.connect(str(tmp_path / (name + '.db-dist')))
+        for table, cols_list in indexes.items():
+            cols = {c for cols in cols_list for c in cols}
+            db.execute('CREATE TABLE {} (id INTEGER PRIMARY KEY, {});'
+                       .format(table, ', '.join(sorted(cols))))
+        databases[name] = db
+    assert 'db' in databases
+    overlay.create_dist_indexes(databases)
+    for name, db in databases.items():
+        assert {row[0] for row in db.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index';")} \
+            == expected_indexes(name)
+        db.close()
+
+
+def test_shipped_indexes():
+    """Check the tracked shipped databases come with their indexes."""
+    # mathmaker.db-dist is built by build_db.py, with its indexes (see
+    # test_create_dist_indexes())
+    db = sqlite3.connect(settings.path.natural_nb_tuples_db_dist)
+    shipped = {row[0] for row in db.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'index';")}
+    db.close()
+    assert expected_indexes('natural_nb_tuples_db') <= shipped
+
+
+def test_shared_state(tmp_path):
+    """Check several connections share the state, in short transactions."""
+    dist_db(tmp_path / 'test.db-dist')
+    dist, state = str(tmp_path / 'test.db-dist'), str(tmp_path / 'state.db')
+    db1 = overlay.connect(dist, state, timeout=0)
+    db2 = overlay.connect(dist, state, timeout=0)
+    assert tuple(db1.execute('PRAGMA state.journal_mode;')) == (('wal', ), )
+    src1 = database.source('int_pairs', ['id', 'nb1', 'nb2'], db=db1)
+    src2 = database.source('int_pairs', ['id', 'nb1', 'nb2'], db=db2)
+    src1.next(nb1=5)
+    src1.pending.flush()
+    assert not db1.in_transaction
+    assert src2.next(nb1=2, timestamp=False) in {(2, 6), (2, 5)}
+    assert tuple(db2.execute('SELECT COUNT(*) FROM int_pairs '
+                             'WHERE drawDate != 0;')) == ((1, ), )
+    # The pending updates are kept if the write lock cannot be taken
+    db1.execute('BEGIN IMMEDIATE;')
+    src2.next(nb1=3)
+    assert not src2.pending.flush()
+    assert not db2.in_transaction
+    assert len(src2.pending) == 1
+    src2.pending.threshold = 2
+    src2.next(nb1=2, nb2=6, timestamp=False, lock_equal_products=True,
+              info_lock={(2, 6): [(3, 4)]})
+    assert len(src2.pending) == 3
+    write_behind.flush(db2)
+    assert len(src2.pending) == 3
+    db1.rollback()
+    assert src2.pending.flush()
+    assert not len(src2.pending)
+    assert tuple(db1.execute('SELECT COUNT(*) FROM int_pairs '
+                             'WHERE drawDate != 0;')) == ((2, ), )
+    # A session's state is read from the shared one, but not written to it
+    db3 = overlay.connect(dist, state, session=True)
+    src3 = database.source('int_pairs', ['id', 'nb1', 'nb2'], db=db3)
+    assert tuple(db3.execute('SELECT COUNT(*) FROM int_pairs '
+                             'WHERE drawDate != 0;')) == ((2, ), )
+    src3.next(nb1=2)
+    src3.pending.flush()
+    assert tuple(db3.execute('SELECT COUNT(*) FROM int_pairs '
+                             'WHERE drawDate != 0;')) == ((3, ), )
+    assert tuple(db1.execute('SELECT COUNT(*) FROM int_pairs '
+                             'WHERE drawDate != 0;')) == ((2, ), )
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+
+# Mathmaker creates automatically maths exercises sheets
+# with their answers
+# Copyright 2006-2017 Nicolas Hainaux <nh.techn@gmail.com>
+
+# This file is part of Mathmaker.
+
+# Mathmaker is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# any later version.
+
+# Mathmaker is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Mathmaker; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+
+import os
+import time
+
+from mathmaker import settings
+from mathmaker.lib import shared
+from mathmaker.lib.tools.pdf_cache import PdfCache, seeded_key
+
+
+def test_pdf_cache_get_put(tmp_path):
+    """Checks documents are stored and retrieved by their source."""
+    cache = PdfCache(str(tmp_path), luatex_version='1.10.0')
+    assert cache.get('source1') is None
+    cache.put('source1', b'pdf1')
+    assert cache.get('source1') == b'pdf1'
+    assert cache.get('source2') is None
+    assert len(list(tmp_path.glob('*.pdf'))) == 1
+
+
+def test_pdf_cache_key():
+    """Checks the key depends on lualatex's version and the font."""
+    c1 = PdfCache('/tmp', luatex_version='1.10.0')
+    c2 = PdfCache('/tmp', luatex_version='1.12.0')
+    c3 = PdfCache('/tmp', luatex_version='1.10.0', font='Ubuntu')
+    assert c1.key('source') == PdfCache('/tmp', luatex_version='1.10.0')\
+        .key('source')
+    assert len({c1.key('source'), c2.key('source'), c3.key('source')}) == 3
+
+
+def test_pdf_cache_lru_eviction(tmp_path):
+    """Checks the least recently used documents are evicted first."""
+    cache = PdfCache(str(tmp_path), max_size=2.5 / (1024 * 1024))
+    cache.put('source1', b'a')
+    cache.put('source2', b'b')
+    old = time.time() - 100
+    os.utime(cache._path(cache.key('source2')), (old, old))
+    os.utime(cache._path(cache.key('source1')), (old + 10, old + 10))
+    cache.put('source3', b'c')
+    assert cache.get('source2') is None
+    assert cache.get('source1') == b'a'
+    assert cache.get('source3') == b'c'
+    cache.put('source4', b'd')
+    cache.put('source5', b'e')
+    assert len(list(tmp_path.glob('*.pdf'))) == 2
+
+
+def test_write_out_uses_pdf_cache(mocker, tmp_path):
+    """Checks a cache hit skips the compilation."""
+    mocker.patch.object(settings, 'pdf_cache', True)
+    mocker.patch.object(settings, 'pdf_cachedir', str(tmp_path))
+    compile_mock = mocker.patch.object(shared.machine, 'compile',
+                                       return_value=b'%PDF')
+    mocker.patch.object(shared.machine, 'out')
+    out = mocker.patch('sys.stdout')
+    shared.machine.write_out('document', pdf_output=True)
+    shared.machine.write_out('document', pdf_output=True)
+    compile_mock.assert_called_once_with('document', formats=None)
+    assert out.buffer.write.call_count == 2
+    out.buffer.write.assert_called_with(b'%PDF')
+
+
+def test_seeded_key():
+    """Checks the key depends on the sheet, the seed and the options."""
+    key = seeded_key('sheet', 1, copies=1)
+    assert key == seeded_key('sheet', 1, copies=1)
+    assert len({key, seeded_key('sheet', 2, copies=1),
+                seeded_key('other_sheet', 1, copies=1),
+                seeded_key('sheet', 1, copies=2)}) == 4
+
+
+def test_write_seeded(mocker, tmp_path):
+    """Checks a seeded document is stored, then found under its key."""
+    mocker.patch.object(settings, 'pdf_cache', True)
+    mocker.patch.object(settings, 'pdf_cachedir', str(tmp_path))
+    mocker.patch.object(shared.machine, 'compile', return_value=b'%PDF')
+    mocker.patch.object(shared.machine, 'out')
+    out = mocker.patch('sys.stdout')
+    assert not shared.machine.write_seeded('key')
+    shared.machine.write_out('document', pdf_output=True, seeded_key='key')
+    assert shared.machine.write_seeded('key')
+    out.buffer.write.assert_called_with(b'%PDF')
+    mocker.patch.object(settings, 'pdf_cache', False)
+    assert not shared.machine.write_seeded('key')
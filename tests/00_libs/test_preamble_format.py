@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+
+# Mathmaker creates automatically maths exercises sheets
+# with their answers
+# Copyright 2006-2017 Nicolas Hainaux <nh.techn@gmail.com>
+
+# This file is part of Mathmaker.
+
+# Mathmaker is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# any later version.
+
+# Mathmaker is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Mathmaker; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+
+import os
+import time
+from unittest.mock import MagicMock
+
+import pytest
+
+from mathmaker import settings
+from mathmaker.lib import shared
+from mathmaker.lib.tools.preamble_format import FAILED_FORMAT_TTL
+from mathmaker.lib.tools.preamble_format import PreambleFormats
+from mathmaker.lib.tools.preamble_format import split_preamble
+
+DOC = '\\documentclass{article}\n\\begin{document}\nHello\n\\end{document}'
+
+
+def fake_run(returncode=0):
+    """Fake lualatex -ini run, creating the format file if successful."""
+    def run(cmd, cwd=None, **kwargs):
+        jobname = [a for a in cmd if a.startswith('-jobname=')][0][9:]
+        if not returncode:
+            open(os.path.join(cwd, jobname + '.fmt'), 'w').close()
+        return MagicMock(returncode=returncode)
+    return MagicMock(side_effect=run)
+
+
+def test_split_preamble():
+    """Checks the preamble is separated from the document's body."""
+    assert split_preamble(DOC) == ('\\documentclass{article}\n',
+                                   '\\begin{document}\nHello\n'
+                                   '\\end{document}')
+    assert split_preamble('no document') == ('', 'no document')
+
+
+def test_formats_key(tmp_path):
+    """Checks the format's name depends on the preamble and the version."""
+    f1 = PreambleFormats(str(tmp_path), luatex_version='1.10.0')
+    f2 = PreambleFormats(str(tmp_path), luatex_version='1.12.0')
+    assert f1.key('preamble') == f1.key('preamble')
+    assert f1.key('preamble') != f1.key('other preamble')
+    assert f1.key('preamble') != f2.key('preamble')
+
+
+def test_formats_get(mocker, tmp_path):
+    """Checks the format is built once, then reused."""
+    run = mocker.patch('mathmaker.lib.tools.preamble_format.subprocess.run',
+                       fake_run())
+    formats = PreambleFormats(str(tmp_path))
+    key = formats.get('preamble')
+    assert key == formats.key('preamble')
+    assert formats.get('preamble') == key
+    run.assert_called_once()
+    assert os.listdir(str(tmp_path)) == [key + '.fmt']
+    assert formats.env['TEXFORMATS'].startswith(str(tmp_path) + os.pathsep)
+
+
+def test_formats_get_failure(mocker, tmp_path):
+    """Checks a format that cannot be built is not tried again soon."""
+    run = mocker.patch('mathmaker.lib.tools.preamble_format.subprocess.run',
+                       fake_run(returncode=1))
+    formats = PreambleFormats(str(tmp_path))
+    assert formats.get('preamble') is None
+    assert formats.get('preamble') is None
+    run.assert_called_once()
+    # The marker expires with time, and with another TeX installation
+    key = formats.key('preamble')
+    marker = os.path.join(str(tmp_path), key + '.failed')
+    past = time.time() - FAILED_FORMAT_TTL - 1
+    os.utime(marker, (past, past))
+    assert formats.get('preamble') is None
+    assert run.call_count == 2
+    with open(marker, mode='wt') as f:
+        f.write('other TeX installation')
+    assert not formats.failed(key)
+    assert formats.get('preamble') is None
+    assert run.call_count == 3
+
+
+def test_compile_falls_back_without_format(mocker, tmp_path):
+    """Checks a failing compilation with a format is done again without."""
+    mocker.patch('mathmaker.lib.tools.preamble_format.subprocess.run',
+                 fake_run())
+    formats = PreambleFormats(str(tmp_path))
+    _compile = mocker.patch.object(shared.machine, '_compile',
+                                   side_effect=[RuntimeError, b'%PDF'])
+    assert shared.machine.compile(DOC, formats=formats) == b'%PDF'
+    key = formats.key('\\documentclass{article}\n')
+    assert _compile.call_args_list[0][1]['fmt'] == key
+    assert _compile.call_args_list[1] == ((DOC, ), {})
+    # The format is built again next time
+    assert not os.path.isfile(os.path.join(str(tmp_path), key + '.fmt'))
+    assert not formats.failed(key)
+
+
+def test_compile_failure_keeps_format(mocker, tmp_path):
+    """Checks a document failing with and without its format keeps it."""
+    mocker.patch('mathmaker.lib.tools.preamble_format.subprocess.run',
+                 fake_run())
+    formats = PreambleFormats(str(tmp_path))
+    mocker.patch.object(shared.machine, '_compile',
+                        side_effect=[RuntimeError, RuntimeError])
+    with pytest.raises(RuntimeError):
+        shared.machine.compile(DOC, formats=formats)
+    key = formats.key('\\documentclass{article}\n')
+    assert os.listdir(str(tmp_path)) == [key + '.fmt']
+
+
+def test_compile_runs_lualatex_setting(mocker, monkeypatch):
+    """Checks the lualatex executable of the settings is run."""
+    monkeypatch.setattr(settings, 'lualatex', '/opt/tex/bin/lualatex')
+    popen = mocker.patch('mathmaker.lib.machine.LaTeX.subprocess.Popen',
+                         side_effect=OSError)
+    with pytest.raises(OSError):
+        shared.machine._compile(DOC)
+    assert popen.call_args[0][0][0] == '/opt/tex/bin/lualatex'
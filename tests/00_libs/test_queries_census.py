@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+
+# Mathmaker creates automatically maths exercises sheets
+# with their answers
+# Copyright 2006-2017 Nicolas Hainaux <nh.techn@gmail.com>
+
+# This file is part of Mathmaker.
+
+# Mathmaker is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# any later version.
+
+# Mathmaker is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Mathmaker; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+
+import sqlite3
+
+from mathmaker.lib.tools import database, overlay
+from mathmaker.lib.tools.queries_census import query_shapes, serves
+from mathmaker.lib.tools.queries_census import index_columns
+from mathmaker.lib.tools.queries_census import QueriesCensus, create_indexes
+
+COLUMNS = {'int_pairs': {'id', 'nb1', 'nb2', 'drawDate', 'clever', 'code'},
+           'int_triples': {'id', 'nb1', 'nb2', 'nb3', 'drawDate'}}
+
+
+def test_query_shapes():
+    """Check the columns found in the conditions of the queries."""
+    assert query_shapes('SELECT COUNT(*) FROM (SELECT id,nb1,nb2 FROM '
+                        'int_pairs WHERE drawDate = 0 AND ( nb1 >= 2 AND '
+                        'nb1 <= 9 AND clever = 4 AND nb2 % 10 = 0 ) );',
+                        COLUMNS) \
+        == [('int_pairs', ('clever', 'drawDate'), ('nb1', ))]
+    assert query_shapes("UPDATE int_pairs SET drawDate = "
+                        "strftime('%Y-%m-%d %H:%M:%f') WHERE id = 12;",
+                        COLUMNS) \
+        == [('int_pairs', ('id', ), ())]
+    assert query_shapes('SELECT * FROM (SELECT id,nb1 FROM int_pairs WHERE '
+                        'drawDate = 0 AND ( code IN ( 1, 2 ) ) UNION '
+                        'SELECT id,nb1 FROM int_triples WHERE drawDate = 0 '
+                        'AND ( nb1 NOT IN ( 5 ) AND nb3 BETWEEN 2 AND 4 ))',
+                        COLUMNS) \
+        == [('int_pairs', ('code', 'drawDate'), ()),
+            ('int_triples', ('drawDate', ), ('nb3', ))]
+    assert query_shapes('UPDATE int_pairs SET drawDate=0 WHERE id IN '
+                        '(SELECT id FROM int_pairs WHERE drawDate != 0 '
+                        'ORDER BY drawDate LIMIT 3);', COLUMNS) \
+        == [('int_pairs', ('id', ), ()), ('int_pairs', (), ('drawDate', ))]
+    assert query_shapes('UPDATE int_pairs SET drawDate = 0;', COLUMNS) == []
+
+
+def test_state_shapes():
+    """Check the queries on the state of the rows are served by indexes."""
+    columns = {'freshness': {'tbl', 'id', *overlay.STATE_COLUMNS}}
+    shapes = query_shapes("UPDATE state.freshness SET drawDate = 0 "
+                          "WHERE tbl = 'int_pairs' AND drawDate != 0 "
+                          "AND id IN (SELECT id FROM state.freshness "
+                          "WHERE tbl = 'int_pairs' AND drawDate != 0 "
+                          "ORDER BY drawDate, id LIMIT 3);", columns) \
+        + query_shapes("SELECT COUNT(*) FROM state.freshness "
+                       "WHERE tbl = 'int_pairs' AND locked != 0;", columns)
+    assert shapes == [('freshness', ('id', 'tbl'), ('drawDate', )),
+                      ('freshness', ('tbl', ), ('drawDate', )),
+                      ('freshness', ('tbl', ), ('locked', ))]
+    # The rows of given ids are found by the primary key
+    assert all(not index_columns(equal, ranged)
+               or any(serves(cols, equal, ranged)
+                      for cols in overlay.STATE_INDEXES)
+               for _, equal, ranged in shapes)
+
+
+def test_serves():
+    """Check which shapes an index serves."""
+    assert serves(('nb1', 'nb2', 'drawDate'), ('nb1', 'nb2'), ('drawDate', ))
+    assert serves(('nb1', 'nb2', 'drawDate'), ('drawDate', 'nb1', 'nb2'), ())
+    assert not serves(('drawDate', 'nb1'), ('nb1', 'drawDate'), ('nb2', ))
+    assert not serves(('drawDate', ), ('drawDate', ), ('nb1', ))
+
+
+def test_census():
+    """Check the indexes deduced from the queries of a source."""
+    db = sqlite3.connect(':memory:')
+    db.execute('CREATE TABLE int_pairs (id INTEGER PRIMARY KEY, '
+               'nb1 INTEGER, nb2 INTEGER, clever INTEGER, drawDate INTEGER);')
+    db.executemany('INSERT INTO int_pairs (nb1, nb2, clever, drawDate) '
+                   'VALUES (?, ?, ?, 0);',
+                   [(i, j, 0) for i in range(2, 50) for j in range(i, 50)])
+    census = QueriesCensus()
+    census.attach('db', db)
+    src = database.source('int_pairs', ['id', 'nb1', 'nb2'], db=db)
+    for _ in range(3):
+        src.next(nb1_min=3, nb1_max=8)
+    src.next(clever=0)
+    indexes = census.indexes(min_rows=100)
+    assert indexes == {'db': {'int_pairs': [['drawDate', 'nb1'],
+                                            ['clever', 'drawDate']]}}
+    assert census.indexes(min_rows=5000) == {'db': {}}
+    create_indexes(db, indexes['db'])
+    cmd, params = src._cmd(nb1_min=3, nb1_max=8)
+    plan = tuple(db.execute('EXPLAIN QUERY PLAN ' + cmd,
+                            src.pending.bind(params)))
+    assert 'idx_int_pairs__drawDate_nb1' in plan[0][-1]
+    create_indexes(db, indexes['db'])  # already existing indexes are kept
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+# Mathmaker creates automatically maths exercises sheets
+# with their answers
+# Copyright 2006-2017 Nicolas Hainaux <nh.techn@gmail.com>
+
+# This file is part of Mathmaker.
+
+# Mathmaker is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# any later version.
+
+# Mathmaker is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Mathmaker; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import sqlite3
+
+from mathmakerlib import required
+
+from mathmaker import settings
+from mathmaker.lib import shared
+from mathmaker.lib.tools import columnar, database, render_pool
+
+
+def pairs_db():
+    db = sqlite3.connect(':memory:')
+    db.execute('CREATE TABLE pairs (id INTEGER PRIMARY KEY, nb1 INTEGER, '
+               'nb2 INTEGER, drawDate INTEGER);')
+    db.executemany('INSERT INTO pairs (nb1, nb2, drawDate) VALUES (?, ?, 0);',
+                   [(i, j) for i in range(2, 10) for j in range(i, 10)])
+    return db
+
+
+def test_parallel(monkeypatch):
+    """Check when the questions are built by several processes."""
+    assert not render_pool.parallel(1, 10)
+    assert not render_pool.parallel(4, 1)
+    monkeypatch.setattr(settings, 'seed', 7)
+    assert not render_pool.parallel(4, 10)
+
+
+def test_share_draws(monkeypatch):
+    """Check a process building a chunk draws from its share first."""
+    monkeypatch.setattr(shared, 'draws_share', None)
+    monkeypatch.setitem(shared._registry, 'letters_source',
+                        lambda: database.sub_source('uppercase_letters'))
+    for _ in range(4):
+        shared.letters_source.next()
+    shared.share_draws(1, 2)
+    assert shared.draws_share == (1, 2)
+    # The letters start at the second half of the ones left
+    assert shared.letters_source.current == 4 + (104 - 4) // 2
+    del shared.letters_source
+    # The ids of the rows of nb1=2 are 1 to 8: the ones of the share (1, 3)
+    # are 1, 4 and 7, and the others are drawn next
+    monkeypatch.setattr(shared, 'draws_share', (1, 3))
+    for cls in (database.source, columnar.columnar_source):
+        src = cls('pairs', ['id', 'nb1', 'nb2'], db=pairs_db())
+        drawn = [src.next(nb1=2, enablereset=False) for _ in range(3)]
+        assert sorted(drawn) == [(2, 2), (2, 5), (2, 8)]
+        assert src.next(nb1=2, enablereset=False) not in drawn
+    src = database.source('pairs', ['id', 'nb1', 'nb2'], db=pairs_db())
+    drawn = src.next_many(4, nb1=2, enablereset=False)
+    assert {(2, 2), (2, 5), (2, 8)} < set(drawn)
+
+
+def test_merge_required(monkeypatch):
+    """Check the packages required by the forked processes are merged."""
+    monkeypatch.setattr(required, 'package', {'tikz': False,
+                                              'xcolor': True})
+    monkeypatch.setattr(required, 'options', {'xcolor': {'dvipsnames'}})
+    render_pool._merge_required({'package': {'tikz': True, 'xcolor': False},
+                                 'options': {'xcolor': {'table'}}})
+    assert required.package == {'tikz': True, 'xcolor': True}
+    assert required.options == {'xcolor': {'dvipsnames', 'table'}}
+
+
+def test_render_in_order(monkeypatch):
+    """Check the questions are gathered in their order."""
+    monkeypatch.setattr(render_pool, '_build',
+                        lambda drafts: [options['n'] for _, options in drafts])
+    drafts = [('q', {'n': n}) for n in range(7)]
+    assert render_pool.render(drafts) == list(range(7))
+    assert render_pool.render(drafts, processes=3) == list(range(7))
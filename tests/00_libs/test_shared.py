@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+
+# Mathmaker creates automatically maths exercises sheets
+# with their answers
+# Copyright 2006-2017 Nicolas Hainaux <nh.techn@gmail.com>
+
+# This file is part of Mathmaker.
+
+# Mathmaker is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# any later version.
+
+# Mathmaker is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Mathmaker; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+
+import sqlite3
+
+import pytest
+
+from mathmaker.lib import shared
+from mathmaker.lib.tools import database
+
+
+@pytest.fixture
+def fresh_shared():
+    shared.close()
+    shared.init()
+    yield
+    shared.close()
+
+
+def test_sources_are_created_on_first_access(fresh_shared):
+    """Checks sources are only created when they're first used."""
+    assert 'nnpairs_source' not in vars(shared)
+    assert 'natural_nb_tuples_db' not in vars(shared)
+    assert shared.opened_databases() == []
+    src = shared.nnpairs_source
+    assert isinstance(src, database.source)
+    assert shared.nnpairs_source is src
+    assert src.db is shared.natural_nb_tuples_db
+    assert shared.opened_databases() == [shared.natural_nb_tuples_db]
+    assert isinstance(shared.alternate_source, database.sub_source)
+    assert isinstance(shared.mc_source, database.mc_source)
+    assert isinstance(shared.unique_letters_words_source, dict)
+    assert getattr(shared, 'int_pairs_source').db is shared.db
+
+
+def test_unknown_attribute(fresh_shared):
+    """Checks unregistered names still raise an AttributeError."""
+    with pytest.raises(AttributeError):
+        shared.no_such_source
+    assert not hasattr(shared, 'no_such_source')
+
+
+def test_close(fresh_shared):
+    """Checks only opened databases are closed, and may be reopened."""
+    db = shared.shapes_db
+    shared.close()
+    assert shared.opened_databases() == []
+    with pytest.raises(sqlite3.ProgrammingError):
+        db.execute('SELECT 1;')
+    assert shared.shapes_db is not db
+    assert shared.opened_databases() == [shared.shapes_db]
+
+
+def test_init_again(fresh_shared):
+    """Checks init() writes the pending updates and closes the databases."""
+    db = shared.natural_nb_tuples_db
+    shared.nnpairs_source._reset()
+    shared.nnpairs_source.next()
+    assert len(shared.nnpairs_source.pending) == 1
+    shared.init()
+    with pytest.raises(sqlite3.ProgrammingError):
+        db.execute('SELECT 1;')
+    assert shared.opened_databases() == []
+    assert tuple(shared.natural_nb_tuples_db.execute(
+        'SELECT COUNT(*) FROM pairs WHERE drawDate != 0;')) == ((1, ), )
+
+
+def test_close_forgets_sources(fresh_shared):
+    """Checks the sources of the closed databases are created again."""
+    src = shared.int_pairs_source
+    alternate = shared.alternate_source
+    shared.close()
+    assert shared.int_pairs_source is not src
+    assert shared.int_pairs_source.db is shared.db
+    assert shared.alternate_source is alternate
+
+
+def test_reconnect(fresh_shared):
+    """Checks reconnect() opens new connections, leaving the old ones open."""
+    db = shared.db
+    src = shared.int_pairs_source
+    alternate = shared.alternate_source
+    shared.reconnect()
+    assert shared.opened_databases() == []
+    assert shared.int_pairs_source is not src
+    assert shared.int_pairs_source.db is shared.db is not db
+    assert shared.alternate_source is alternate
+    assert db.execute('SELECT 1;').fetchone() == (1, )
+    shared._inherited.remove(db)
+    db.close()
+
+
+def test_use_seed(fresh_shared):
+    """Checks the seeded draws only depend on the seed, and are forgotten."""
+    query = 'SELECT COUNT(*) FROM int_pairs WHERE drawDate != 0;'
+    drawn = tuple(shared.db.execute(query))
+    alternate = shared.alternate_source
+    try:
+        shared.use_seed(7)
+        first = [shared.int_pairs_source.next() for _ in range(5)]
+        shared.use_seed(7)
+        assert [shared.int_pairs_source.next() for _ in range(5)] == first
+        assert shared.alternate_source is not alternate
+    finally:
+        shared.use_seed(None)
+    assert tuple(shared.db.execute(query)) == drawn
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+
+# Mathmaker creates automatically maths exercises sheets
+# with their answers
+# Copyright 2006-2017 Nicolas Hainaux <nh.techn@gmail.com>
+
+# This file is part of Mathmaker.
+
+# Mathmaker is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# any later version.
+
+# Mathmaker is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Mathmaker; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+
+from functools import partial
+
+import pytest
+
+from mathmaker.lib import shared, old_style_sheet
+from mathmaker.lib.document.frames import Sheet, Copies
+
+
+def test_copies():
+    """Checks the copies are different, and written in one document."""
+    copies = Copies(partial(Sheet, 'mental_calculation', 'y1b1', 'exam'), 3)
+    document = str(copies)
+    assert document.count(r'\documentclass') == 1
+    assert document.count(r'\begin{document}') == 1
+    assert document.count(r'\end{document}') == 1
+    bodies = [sh.body_to_str() for sh in copies.sheets]
+    assert len(set(bodies)) == 3
+    assert all(body in document for body in bodies)
+
+
+def test_old_style_sheet_copies():
+    """Checks old style sheets can be copied too."""
+    copies = Copies(
+        old_style_sheet.AVAILABLE['fraction-simplification'][0], 2)
+    shared.machine.write_out(str(copies))
+
+
+def test_copies_errors():
+    """Checks the wrong numbers of copies and interactive sheets."""
+    with pytest.raises(ValueError):
+        Copies(partial(Sheet, 'mental_calculation', 'y1b1', 'exam'), 0)
+    with pytest.raises(ValueError):
+        Copies(partial(Sheet, 'mental_calculation', 'y1b1', 'exam',
+                       filename=None, enable_js_form=True), 2)
+    shared.enable_js_form = False
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+# Mathmaker creates automatically maths exercises sheets
+# with their answers
+# Copyright 2006-2017 Nicolas Hainaux <nh.techn@gmail.com>
+
+# This file is part of Mathmaker.
+
+# Mathmaker is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# any later version.
+
+# Mathmaker is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Mathmaker; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import os
+import sys
+import subprocess
+
+from mathmaker.lib import shared
+from mathmaker.lib.document.frames import Sheet
+
+# Sheets whose questions used to differ between two runs with the same seed
+# (sets of strings, units conversions, points' names, exam sheets mixing
+# several sources)
+SEEDED_SHEETS = ['y1b5_W02a', 'y1b5_W02d', 'y1b6_exam',
+                 'y1b6_units_conversions', 'y2b3_exam']
+
+# Generates the sheets whose names are given as arguments with the same
+# seed, and prints the digest of each one
+GENERATE = '''
+import sys
+import hashlib
+import gettext
+from mathmaker import settings
+from mathmaker.lib import shared
+from mathmaker.lib.tools.frameworks import read_index
+from mathmaker.lib.document.frames import Sheet
+settings.init()
+settings.language = 'en'
+gettext.translation('mathmaker', settings.localedir, ['en']).install()
+shared.init()
+for name in sys.argv[1:]:
+    shared.use_seed(7)
+    body = Sheet(*read_index()[name], filename=None).body_to_str()
+    print(name, hashlib.sha256(body.encode()).hexdigest())
+'''
+
+
+def test_seeded_sheet():
+    """Checks a sheet generated twice with the same seed is the same."""
+    try:
+        documents = []
+        for _ in range(2):
+            shared.use_seed(7)
+            documents.append(str(Sheet('mental_calculation', 'y1b6', 'exam',
+                                       filename=None)))
+    finally:
+        shared.use_seed(None)
+    assert documents[0] == documents[1]
+
+
+def test_seeded_sheets():
+    """
+    Checks some sheets, generated with the same seed by two processes, are
+    the same.
+
+    The processes have different hash seeds, so that the order of the sets
+    of strings differs.
+    """
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    processes = [subprocess.Popen([sys.executable, '-c', GENERATE]
+                                  + SEEDED_SHEETS,
+                                  env=dict(env, PYTHONHASHSEED=hash_seed),
+                                  stdout=subprocess.PIPE,
+                                  stderr=subprocess.PIPE, text=True)
+                 for hash_seed in ('0', '3')]
+    outputs = [p.communicate() for p in processes]
+    for p, (_, errors) in zip(processes, outputs):
+        assert p.returncode == 0, errors
+    digests = [out.splitlines() for out, _ in outputs]
+    assert len(digests[0]) == len(SEEDED_SHEETS)
+    assert [name for name, a, b in zip(SEEDED_SHEETS, *digests)
+            if a != b] == []
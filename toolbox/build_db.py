@@ -24,7 +24,9 @@
 """
 This script adds new entries to the database.
 
-It actually erases the database and builds it entirely.
+It actually erases the database and builds it entirely, with the indexes
+listed in sql_indexes.json (see queries_census.py). With --indexes-only, it
+only adds these indexes to the databases built before.
 It will add all entries:
 - from files mini_pb_addi_direct.yaml, mini_pb_divi_direct.yaml,
   mini_pb_subtr_direct.yaml and mini_pb_multi_direct.yaml from data/wordings/,
@@ -56,6 +58,7 @@ import os
 import sys
 import json
 import sqlite3
+import argparse
 from math import gcd
 from decimal import Decimal
 
@@ -66,6 +69,7 @@ from mathmaker.lib.tools import po_file_get_list_of, check_unique_letters_words
 from mathmaker.lib.tools.frameworks import get_attributes
 from mathmaker.lib.tools.distcode import distcode
 from mathmaker.lib.tools.database import parse_sql_creation_query
+from mathmaker.lib.tools.overlay import create_dist_indexes
 from mathmaker.lib.constants.numeration import DIGITSPLACES
 from mathmaker.lib.constants.numeration import DIGITSPLACES_DECIMAL
 from mathmaker.lib.constants.pythagorean import ALL_TRIPLES_5_200
@@ -97,8 +101,35 @@ def _suits_for_deci2(i, j):
     return not (i % 10 == 0 or j % 10 == 0)
 
 
+def connect_all():
+    """Connect to the shipped databases, by their names in settings.path."""
+    return {name: sqlite3.connect(getattr(settings.path, name + '_dist'))
+            for name in ['db', 'shapes_db', 'solids_db', 'anglessets_db',
+                         'natural_nb_tuples_db']}
+
+
+def add_indexes():
+    """Add the indexes of sql_indexes.json to the shipped databases."""
+    sys.stderr.write('Create indexes (see queries_census.py)...\n')
+    databases = connect_all()
+    create_dist_indexes(databases)
+    for db in databases.values():
+        db.commit()
+        db.close()
+    sys.stderr.write('Done!\n')
+
+
 def __main__():
+    parser = argparse.ArgumentParser(description='Build the databases '
+                                     'shipped with mathmaker.')
+    parser.add_argument('--indexes-only', action='store_true',
+                        help='only add the indexes of sql_indexes.json to '
+                        'the databases built before')
+    args = parser.parse_args()
     settings.init()
+    if args.indexes_only:
+        add_indexes()
+        return
 
     WORDINGS_DIR = settings.datadir + "wordings/"
     WORDINGS_FILES = [WORDINGS_DIR + n + ".yaml"
@@ -1980,6 +2011,12 @@ def __main__():
         "VALUES(?, ?, ?, ?)",
         db_rows)
 
+    sys.stderr.write('Create indexes (see queries_census.py)...\n')
+    create_dist_indexes({'db': db, 'shapes_db': shapes_db,
+                         'solids_db': solids_db,
+                         'anglessets_db': anglessets_db,
+                         'natural_nb_tuples_db': natural_nb_tuples_db})
+
     sys.stderr.write('Commit changes to databases...\n')
     db.commit()
     shapes_db.commit()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Mathmaker creates automatically maths exercises sheets
+# with their answers
+# Copyright 2006-2017 Nicolas Hainaux <nh.techn@gmail.com>
+
+# This file is part of Mathmaker.
+
+# Mathmaker is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# any later version.
+
+# Mathmaker is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Mathmaker; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""
+This script updates the list of the databases' indexes (sql_indexes.json).
+
+It generates sheets (all of them, by default) while recording the shapes of
+the queries sent to the databases, then writes the indexes matching the
+most frequent shapes. Run it again when new filters are added to the
+sources, then run build_db.py: the indexes are only created in the
+databases it builds (the *.db-dist files, that are opened read-only).
+
+The timestamps and locks of the drawn rows are kept in memory (as with
+SESSION_STATE, see overlay.py), so that the census does not modify the
+user's state databases.
+"""
+
+import sys
+import json
+import argparse
+from collections import Counter
+
+from mathmaker import settings
+from mathmaker.lib import shared
+from mathmaker.lib import old_style_sheet
+from mathmaker.lib.tools.xml import get_xml_sheets_paths
+from mathmaker.lib.tools.frameworks import read_index
+from mathmaker.lib.tools.mmd_pool import init_worker, build_sheet
+from mathmaker.lib.tools.queries_census import QueriesCensus
+
+
+def __main__():
+    parser = argparse.ArgumentParser(description='Record the shapes of the '
+                                     'queries sent to the databases and '
+                                     'deduce the indexes they need.')
+    parser.add_argument('sheets', nargs='*',
+                        help='the sheets to generate (default: all)')
+    parser.add_argument('--rounds', type=int, default=1,
+                        help='how many times each sheet is generated')
+    parser.add_argument('--max-per-table', type=int, default=4,
+                        help='maximum number of indexes per table')
+    parser.add_argument('--min-rows', type=int, default=1000,
+                        help='minimum number of rows of an indexed table')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='only print the census and the indexes')
+    args = parser.parse_args()
+
+    init_worker()
+    # The databases are opened on first access, with a throwaway state
+    settings.session_state = True
+    census = QueriesCensus()
+    for name in shared.DATABASES:
+        census.attach(name, shared.db,
+                      schema='main' if name == 'db' else name)
+
+    sheets = args.sheets or (list(old_style_sheet.AVAILABLE)
+                             + list(get_xml_sheets_paths())
+                             + list(read_index()))
+    for sheet_name in sheets:
+        for _ in range(args.rounds):
+            try:
+                str(build_sheet(sheet_name))
+            except Exception as excinfo:
+                sys.stderr.write(f'{sheet_name}: {excinfo!r}\n')
+                break
+    shared.close(commit=False)
+
+    total = Counter()
+    for shapes in census.shapes.values():
+        total.update(shapes)
+    for (table, equal, ranged), n in total.most_common():
+        sys.stderr.write(f'{n:>8} {table}: = {", ".join(equal) or "-"}; '
+                         f'range {", ".join(ranged) or "-"}\n')
+    indexes = census.indexes(max_per_table=args.max_per_table,
+                             min_rows=args.min_rows)
+    if args.dry_run:
+        print(json.dumps(indexes, indent=4))
+    else:
+        with open(settings.sql_indexes_path, 'w') as f:
+            json.dump(indexes, f, indent=4)
+            f.write('\n')
+
+
+if __name__ == '__main__':
+    __main__()